@@ -35,10 +35,13 @@ setup(name='box-linux-sync',
     license='LGPL-3',
     packages=find_packages('src'),
     package_dir = {'': 'src'},
-    namespace_packages = ['noiselabs'],
     include_package_data=True,
     zip_safe=False,
     install_requires=install_requires,
+    extras_require={
+        # Faster scanning of the local tree by the sync engine.
+        'scandir': ['scandir'],
+    },
     entry_points={
         'console_scripts':
             ['box-linux-sync=noiselabs.box:main']
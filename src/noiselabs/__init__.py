@@ -19,7 +19,9 @@
 # License along with box-linux-sync; if not, see
 # <http://www.gnu.org/licenses/>.
 
-__import__('pkg_resources').declare_namespace(__name__)
+# A pkgutil-style namespace package: declaring it through pkg_resources would
+# cost more than everything else box-sync imports to start up.
+__path__ = __import__('pkgutil').extend_path(__path__, __name__)
 
 # Console entry point
 def run():
@@ -1,10 +1,12 @@
 #
 # Copyright (C) 2010-2013 Vinay Sajip. All rights reserved. Licensed under the new BSD license.
 #
-import ctypes
 import logging
 import os
 
+if os.name == 'nt':
+    import ctypes
+
 class ColorizingStreamHandler(logging.StreamHandler):
     # color names to indices
     color_map = {
@@ -21,23 +21,123 @@
 
 import datetime
 import os
+import re
 import ConfigParser
 
+from collections import OrderedDict
+
 from noiselabs.box import __prog__, __version__
 from noiselabs.box.utils import create_file
 
 BASEDIR = os.path.expanduser('~/.noiselabs/box')
 
+class ConfigError(Exception):
+    """An option in the configuration file has a value of the wrong type."""
+
+class ConfigSnapshot(object):
+    """
+    The configuration file as it was when it was last read, with every
+    option converted to its type (see L{BoxConfig.types}) and box_dir made
+    absolute. Options are attributes; C{raw} keeps the strings as written.
+    C{targets} maps the name of every [target:NAME] section to a snapshot
+    of its own. Snapshots are never modified, a reload creates a new one.
+    """
+    def __init__(self, values, raw, stamp=None, missing=(), targets=None):
+        self.__dict__.update(values)
+        self.raw = raw
+        self.stamp = stamp
+        self.missing = missing
+        self.targets = targets if targets is not None else OrderedDict()
+
+    def changed(self, other):
+        """Names of the options whose value differs in other, plus 'targets'
+        if a target was added, removed or moved. A target's own exclude
+        counts as a change to exclude."""
+        if other is None:
+            return sorted(self.raw) + ['targets'] * bool(self.targets)
+        names = sorted(o for o in self.raw if getattr(self, o) != getattr(other, o, None))
+        folders = lambda s: [(n, t.box_dir, t.dav_url) for n, t in s.targets.items()]
+        if folders(self) != folders(other):
+            names.append('targets')
+        elif 'exclude' not in names and any(t.exclude != other.targets[n].exclude
+                for n, t in self.targets.items()):
+            names.append('exclude')
+        return names
+
 class BoxConfig(object):
     """
     Handles noiselabs/box-linux-sync configuration file.
+
+    Besides [main], the file may hold any number of [target:NAME] sections,
+    each naming another folder to synchronize (box_dir), the server to
+    synchronize it with (dav_url) and what to leave out (exclude), the
+    last two defaulting to the ones in [main]. They are all served by
+    'box-sync daemon'.
+
+    The file is parsed in a single pass into a L{ConfigSnapshot}, which is
+    cached until the file's mtime, size or inode change. Long running
+    commands call L{reload} (on SIGHUP or when the file is rewritten) and
+    the callbacks registered with L{subscribe} apply the new values.
     """
     filepath = os.path.join(BASEDIR, 'box-sync.cfg')
-    options = {'main': ['box_dir', 'use_davfs']}
+    options = {'main': ['box_dir', 'use_davfs', 'dav_url', 'workers', 'max_workers',
+        'adaptive_workers',
+        'watch_delay', 'sync_interval', 'chunk_size', 'chunk_parallel',
+        'hash_processes', 'upload_limit', 'upload_burst', 'download_limit',
+        'download_burst', 'exclude', 'compress', 'compress_min_size']}
+    defaults = {'main': {
+        'box_dir': 'Box',
+        'use_davfs': 'true',
+        'dav_url': 'https://dav.box.com/dav',
+        'workers': '4',
+        'max_workers': '32',
+        'adaptive_workers': 'true',
+        'watch_delay': '2',
+        'sync_interval': '600',
+        'chunk_size': '8M',
+        'chunk_parallel': '4',
+        'hash_processes': '0',
+        'upload_limit': '0',
+        'upload_burst': '0',
+        'download_limit': '0',
+        'download_burst': '0',
+        'exclude': '',
+        'compress': '.txt .csv .tsv .log .json .xml .html .css .js .md .py .c .h .sql .svg '
+            'text/* application/json application/xml application/javascript',
+        'compress_min_size': '4K',
+    }}
+    types = {
+        'box_dir': 'path',
+        'use_davfs': 'boolean',
+        'workers': 'int',
+        'max_workers': 'int',
+        'adaptive_workers': 'boolean',
+        'watch_delay': 'float',
+        'sync_interval': 'int',
+        'chunk_size': 'size',
+        'chunk_parallel': 'int',
+        'hash_processes': 'int',
+        'upload_limit': 'size',
+        'upload_burst': 'size',
+        'download_limit': 'size',
+        'download_burst': 'size',
+        'exclude': 'patterns',
+        'compress': 'words',
+        'compress_min_size': 'size',
+    }
+    # Options a running box-sync applies on reload; the others need a restart.
+    live = frozenset(['workers', 'max_workers', 'adaptive_workers', 'watch_delay',
+        'sync_interval', 'chunk_parallel', 'upload_limit', 'upload_burst',
+        'download_limit', 'download_burst', 'exclude'])
+    target_prefix = 'target:'
+    target_name = re.compile(r'^[A-Za-z0-9_.-]+$')
+    size_units = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
 
     def __init__(self, box_console):
         self.out = box_console
         self.cfgparser = ConfigParser.SafeConfigParser()
+        self.snapshot = None
+        self._subscribers = []
 
     def check_file(self):
         """
@@ -52,24 +152,161 @@ class BoxConfig(object):
             self.out.info("Created example configuration file '%s'" % sample_filepath)
             self.write_default_config(sample_filepath)
 
-        # Add all configured sections
-        self.cfgparser = ConfigParser.SafeConfigParser()
-        for section, options in self.options.items():
-            self.cfgparser.add_section(section)
-        self.cfgparser.read(self.filepath)        
+        self.load()
 
     def check_config(self):
         """
         Check for sections and options available in the configuration file.
         """
+        return not self.load().missing
+
+    def _stamp(self):
+        try:
+            st = os.stat(self.filepath)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size, st.st_ino)
+
+    def load(self):
+        """
+        Return the current L{ConfigSnapshot}, parsing the file again only if
+        it changed since the last call. Raises L{ConfigError} if a value
+        cannot be converted.
+        """
+        stamp = self._stamp()
+        if self.snapshot is not None and stamp == self.snapshot.stamp:
+            return self.snapshot
+        parser = ConfigParser.SafeConfigParser()
+        for section in self.options:
+            parser.add_section(section)
+        if stamp is not None:
+            parser.read(self.filepath)
+        raw, values, missing = {}, {}, []
+        for option in self.options['main']:
+            if parser.has_option('main', option):
+                raw[option] = parser.get('main', option)
+            else:
+                raw[option] = self.defaults['main'][option]
+                missing.append(option)
+            try:
+                values[option] = self.convert(option, raw[option])
+            except ValueError as e:
+                raise ConfigError("Invalid value for '%s' in %s: %s" % (option, self.filepath, e))
+        targets = self._load_targets(parser, values, raw)
+        self.cfgparser = parser
+        self.snapshot = ConfigSnapshot(values, raw, stamp, tuple(missing), targets)
+        return self.snapshot
+
+    def _load_targets(self, parser, main, main_raw):
+        targets = OrderedDict()
+        seen = {main['box_dir']: 'main'}
+        for section in parser.sections():
+            if not section.startswith(self.target_prefix):
+                continue
+            name = section[len(self.target_prefix):]
+            if not self.target_name.match(name) or name == 'main':
+                raise ConfigError("Invalid target name '%s' in %s" % (name, self.filepath))
+            if not parser.has_option(section, 'box_dir'):
+                raise ConfigError("Target '%s' in %s has no box_dir" % (name, self.filepath))
+            raw = {'box_dir': parser.get(section, 'box_dir')}
+            for option in ('dav_url', 'exclude'):
+                raw[option] = parser.get(section, option) if parser.has_option(section, option) \
+                    else main_raw[option]
+            values = {'name': name, 'box_dir': self.to_path(raw['box_dir']), 'dav_url': raw['dav_url'],
+                'exclude': self.to_patterns(raw['exclude'])}
+            if values['box_dir'] in seen:
+                raise ConfigError("Targets '%s' and '%s' in %s share box_dir %s" % (
+                    seen[values['box_dir']], name, self.filepath, values['box_dir']))
+            seen[values['box_dir']] = name
+            targets[name] = ConfigSnapshot(values, raw)
+        return targets
+
+    def convert(self, option, value):
+        """Convert a raw value to the type declared for option in L{types}."""
+        kind = self.types.get(option)
+        return getattr(self, 'to_' + kind)(value) if kind else value
+
+    def to_path(self, value):
+        value = os.path.expanduser(value)
+        if not os.path.isabs(value):
+            value = os.path.join(os.path.expanduser('~'), value)
+        return os.path.normpath(value)
+
+    def to_boolean(self, value):
+        if value.lower() not in self.cfgparser._boolean_states:
+            raise ValueError("Not a boolean: %s" % value)
+        return self.cfgparser._boolean_states[value.lower()]
+
+    def to_int(self, value):
+        return int(value)
+
+    def to_float(self, value):
+        return float(value)
+
+    def to_patterns(self, value):
+        """One pattern per line, blank lines and comments left out."""
+        return tuple(line.strip() for line in value.splitlines()
+            if line.strip() and not line.strip().startswith('#'))
+
+    def to_words(self, value):
+        """Words separated by blanks or commas."""
+        return tuple(value.replace(',', ' ').split())
+
+    def to_size(self, value):
+        """Sizes are in bytes and may carry a K, M or G suffix."""
+        value = value.strip().lower().rstrip('b')
+        if value and value[-1] in self.size_units:
+            return int(float(value[:-1]) * self.size_units[value[-1]])
+        return int(value)
+
+    def subscribe(self, callback):
+        """Call callback(snapshot, previous) whenever L{reload} finds new values."""
+        self._subscribers.append(callback)
+
+    def reload(self):
+        """
+        Re-read the file if it changed and hand the new snapshot to the
+        subscribers. An invalid file is reported and the previous values are
+        kept. Returns the new snapshot, or None if nothing changed.
+        """
+        previous = self.snapshot
+        try:
+            snapshot = self.load()
+        except ConfigError as e:
+            self.out.error("%s. Keeping the previous configuration." % e)
+            return None
+        changed = snapshot.changed(previous)
+        if snapshot is previous or not changed:
+            return None
+        self.out.info("Reloaded %s (%s)" % (self.filepath, ', '.join(changed)))
+        restart = [o for o in changed if o not in self.live]
+        if previous is not None and restart:
+            self.out.warning("Restart %s to apply: %s" % (__prog__, ', '.join(restart)))
+        for callback in self._subscribers:
+            callback(snapshot, previous)
+        return snapshot
+
+    def get(self, option, section='main'):
+        """
+        Get an option value as written, falling back to the built-in default
+        if the option is missing from the configuration file.
+        """
+        return (self.snapshot or self.load()).raw[option]
+
+    def getint(self, option, section='main'):
+        return self.to_int(self.get(option, section))
+
+    def getfloat(self, option, section='main'):
+        return self.to_float(self.get(option, section))
+
+    def getsize(self, option, section='main'):
+        """
+        Get a size in bytes. Values may carry a K, M or G suffix.
+        """
+        return self.to_size(self.get(option, section))
 
-        self.cfgparser.read(self.filepath)
-        for section, options in self.options.items():
-            loaded_options = self.cfgparser.options(section)
-            for option in options:
-                if option not in loaded_options:
-                    return False
-        return True        
+    def getboolean(self, option, section='main'):
+        return self.to_boolean(self.get(option, section))
 
     def write_default_config(self, filepath):
         data = "; " + os.path.basename(filepath) + "\n" + \
@@ -79,7 +316,62 @@ class BoxConfig(object):
         "box_dir = Box\n\n" + \
         "; Wether to use a WebDAV filesystem to synchronize your local and\n" + \
         "; remote files. Default: true\n" + \
-        "use_davfs = true\n"
+        "use_davfs = true\n\n" + \
+        "; WebDAV endpoint used by the built-in sync engine (use_davfs = false).\n" + \
+        "; Default: https://dav.box.com/dav\n" + \
+        "dav_url = https://dav.box.com/dav\n\n" + \
+        "; Number of concurrent WebDAV requests issued by the built-in sync\n" + \
+        "; engine. Default: 4\n" + \
+        "workers = 4\n\n" + \
+        "; Grow the number of concurrent requests up to max_workers while the\n" + \
+        "; server keeps up, and shrink it when responses slow down or the\n" + \
+        "; server throttles (429/503). Default: true, 32\n" + \
+        "adaptive_workers = true\n" + \
+        "max_workers = 32\n\n" + \
+        "; Seconds a file must stay untouched before 'box-sync watch' uploads\n" + \
+        "; it. Default: 2\n" + \
+        "watch_delay = 2\n\n" + \
+        "; Seconds between full syncs in 'box-sync watch', which pick up remote\n" + \
+        "; changes. Use 0 to disable. Default: 600\n" + \
+        "sync_interval = 600\n\n" + \
+        "; Files of at least two chunks are downloaded with several concurrent\n" + \
+        "; range requests, and interrupted downloads resume from the last\n" + \
+        "; complete chunk. Sizes accept K, M and G suffixes. Default: 8M\n" + \
+        "chunk_size = 8M\n\n" + \
+        "; Maximum concurrent range requests per file. Default: 4\n" + \
+        "chunk_parallel = 4\n\n" + \
+        "; Processes used to hash file contents. Use 0 for one per CPU.\n" + \
+        "; Default: 0\n" + \
+        "hash_processes = 0\n\n" + \
+        "; Upload and download bandwidth caps in bytes per second, shared by\n" + \
+        "; all concurrent transfers. Sizes accept K, M and G suffixes. Bursts\n" + \
+        "; default to one second worth of traffic. Use 0 for no limit. Send\n" + \
+        "; SIGHUP to a running box-sync to apply changes. Default: 0\n" + \
+        "upload_limit = 0\n" + \
+        "upload_burst = 0\n" + \
+        "download_limit = 0\n" + \
+        "download_burst = 0\n\n" + \
+        "; Paths to leave out of the sync, one gitignore-style pattern per\n" + \
+        "; line (indent the lines after the first). A pattern without a slash\n" + \
+        "; matches a name anywhere, a leading slash anchors it to box_dir, a\n" + \
+        "; trailing slash only matches directories and a leading ! brings back\n" + \
+        "; what an earlier pattern excluded. Excluded directories are neither\n" + \
+        "; listed nor scanned on either side. Default: none\n" + \
+        "exclude =\n\n" + \
+        "; Files worth transferring gzip-compressed, by extension or MIME type\n" + \
+        "; (text/* for all text), and the size below which they are not\n" + \
+        "; compressed. Downloads are compressed if the server agrees to, uploads\n" + \
+        "; if it advertises support for them. Leave compress empty to never\n" + \
+        "; compress. Default: common text formats, 4K\n" + \
+        "compress = .txt .csv .tsv .log .json .xml .html .css .js .md .py .c .h\n" + \
+        "    .sql .svg text/* application/json application/xml application/javascript\n" + \
+        "compress_min_size = 4K\n\n" + \
+        "; More folders for 'box-sync daemon' to synchronize, one section each.\n" + \
+        "; dav_url and exclude default to the ones above. Credentials are\n" + \
+        "; looked up in ~/.davfs2/secrets by box_dir first, then by dav_url.\n" + \
+        "; [target:work]\n" + \
+        "; box_dir = Work\n" + \
+        "; dav_url = https://dav.box.com/dav\n"
         try:
             f = open(filepath, 'w')
             try:
@@ -19,21 +19,159 @@
 # License along with box-linux-sync; if not, see
 # <http://www.gnu.org/licenses/>.
 
-import csv
+
+import os
+import re
+import shlex
+import tempfile
+
+NEEDS_QUOTES = re.compile(r'[\s"\'\\#]')
+OCTAL_ESCAPE = re.compile(r'\\([0-7]{3})')
+NEEDS_ESCAPE = re.compile(r'[\s\\#]')
 
 class WhitespaceDelimitedConfigParser(object):
     """A really simple, stupid, class to parse whitespace delimited files
-    like /etc/fstab or /etc/davfs2/davfs.conf"""
+    like /etc/fstab, ~/.davfs2/secrets or /etc/davfs2/davfs2.conf.
+
+    The file is read once. Every line is kept, comments included, and rows
+    are indexed by the value of a field so any number of lookups can be
+    made. Rows may be changed, added and removed; L{write} replaces the
+    file atomically and leaves untouched lines as they were. Fields follow
+    davfs2's rules: double quotes or a backslash protect spaces and '#',
+    which otherwise starts a comment. Use L{FstabConfigParser} for
+    /etc/fstab."""
+
+    def __init__(self, filepath=None):
+        self.filepath = filepath
+        self.lines = []
+        self.changed = False
+        self._indices = {}
+        if filepath is not None:
+            self.read(filepath)
 
     def read(self, filepath):
-        self.f = open(filepath, 'rb')
-        self.reader = csv.reader(self.f, delimiter=' ', skipinitialspace=True)
-    
+        """Load filepath. Like ConfigParser.read, a missing file is not an
+        error: it is treated as empty and created by L{write}. Returns
+        whether the file was read."""
+        self.filepath = filepath
+        self.lines = []
+        self.changed = False
+        self._indices = {}
+        try:
+            with open(filepath, 'rb') as f:
+                text = f.read()
+        except IOError:
+            return False
+        for line in text.splitlines():
+            self.lines.append((line, self.split(line)))
+        return True
+
+    @staticmethod
+    def split(line):
+        """The fields of a line, empty for comments and blank lines."""
+        try:
+            return shlex.split(line, comments=True)
+        except ValueError:
+            # An unbalanced quote: fall back to plain whitespace.
+            return line.split('#', 1)[0].split()
+
+    @staticmethod
+    def join(fields):
+        return ' '.join('"%s"' % f.replace('\\', '\\\\').replace('"', '\\"')
+            if NEEDS_QUOTES.search(f) or not f else f for f in fields)
+
+    def _index(self, index):
+        """Map the values of field index to the first row holding them."""
+        if index not in self._indices:
+            rows = {}
+            for n, (line, fields) in enumerate(self.lines):
+                if len(fields) > index:
+                    rows.setdefault(fields[index], n)
+            self._indices[index] = rows
+        return self._indices[index]
+
     def get_option(self, option, index=0):
-        for row in self.reader:
-            if row and option == row[0]:
-                return row
-        return False
-            
+        """The fields of the first row whose field index is option (the
+        first field by default), or False."""
+        n = self._index(index).get(option)
+        return False if n is None else list(self.lines[n][1])
+
+    def options(self, index=0):
+        """The values of field index, in file order."""
+        return [fields[index] for line, fields in self.lines if len(fields) > index]
+
+    def set_option(self, fields, index=0):
+        """
+        Replace the row whose field index matches the one in fields, or
+        append fields as a new row. Returns whether anything changed.
+        """
+        fields = [str(f) for f in fields]
+        n = self._index(index).get(fields[index])
+        if n is not None:
+            if self.lines[n][1] == fields:
+                return False
+            self.lines[n] = (self.join(fields), fields)
+            self._indices = {}
+        else:
+            self.lines.append((self.join(fields), fields))
+            for i, rows in self._indices.items():
+                if len(fields) > i:
+                    rows.setdefault(fields[i], len(self.lines) - 1)
+        self.changed = True
+        return True
+
+    def remove_option(self, option, index=0):
+        """Remove every row whose field index is option. Returns how many
+        were removed."""
+        kept = [(line, fields) for line, fields in self.lines
+            if len(fields) <= index or fields[index] != option]
+        removed = len(self.lines) - len(kept)
+        if removed:
+            self.lines = kept
+            self._indices = {}
+            self.changed = True
+        return removed
+
+    def write(self, filepath=None, mode=None):
+        """
+        Write the rows back through a temporary file renamed over the
+        original, so readers never see a partial file. The original's
+        permissions are kept (mode, or 0644, for a new file).
+        """
+        filepath = filepath or self.filepath
+        try:
+            mode = os.stat(filepath).st_mode & 07777
+        except OSError:
+            mode = 0644 if mode is None else mode
+        fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(filepath),
+            dir=os.path.dirname(filepath) or os.curdir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(''.join(line + '\n' for line, fields in self.lines))
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, mode)
+            os.rename(tmp_path, filepath)
+        except:
+            os.unlink(tmp_path)
+            raise
+        self.changed = False
+
     def close(self):
-        self.f.close()
\ No newline at end of file
+        """Kept for compatibility: the file is not held open."""
+
+class FstabConfigParser(WhitespaceDelimitedConfigParser):
+    """Parses /etc/fstab, whose fields follow other rules than davfs2's:
+    only lines starting with '#' are comments, quotes are literal and
+    spaces, tabs and backslashes are written as octal escapes, so a mount
+    point like '/home/me/My Box' reads '/home/me/My\\040Box'."""
+
+    @staticmethod
+    def split(line):
+        if line.lstrip().startswith('#'):
+            return []
+        return [OCTAL_ESCAPE.sub(lambda m: chr(int(m.group(1), 8)), f) for f in line.split()]
+
+    @staticmethod
+    def join(fields):
+        return ' '.join(NEEDS_ESCAPE.sub(lambda m: '\\%03o' % ord(m.group(0)), f) for f in fields)
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import datetime
+import os
+import time
+
+from collections import OrderedDict
+
+from noiselabs.box import __prog__, __version__
+
+DEFAULTS = OrderedDict([
+    ('use_locks', 1),
+    ('cache_size', 50),
+    ('table_size', 1024),
+    ('dir_refresh', 60),
+    ('file_refresh', 1),
+    ('delay_upload', 10),
+    ('gui_optimize', 0),
+    ('buf_size', 16),
+])
+"""davfs2's own defaults for the options we tune."""
+
+PRESETS = OrderedDict([
+    ('laptop', OrderedDict([
+        ('use_locks', 0),
+        ('cache_size', 1024),
+        ('table_size', 4096),
+        ('dir_refresh', 120),
+        ('file_refresh', 30),
+        ('delay_upload', 30),
+        ('gui_optimize', 1),
+        ('buf_size', 64),
+    ])),
+    ('workstation', OrderedDict([
+        ('use_locks', 0),
+        ('cache_size', 4096),
+        ('table_size', 16384),
+        ('dir_refresh', 60),
+        ('file_refresh', 10),
+        ('delay_upload', 10),
+        ('gui_optimize', 1),
+        ('buf_size', 128),
+    ])),
+    ('server', OrderedDict([
+        ('use_locks', 0),
+        ('cache_size', 16384),
+        ('table_size', 65536),
+        ('dir_refresh', 300),
+        ('file_refresh', 60),
+        ('delay_upload', 5),
+        ('gui_optimize', 0),
+        ('buf_size', 256),
+    ])),
+])
+"""Starting points for tune(). Laptops trade freshness for fewer wakeups
+and less traffic, servers hold large trees and favour upload latency."""
+
+COMMENTS = {
+    'use_locks': "Box does not support WebDAV locks",
+    'cache_size': "MiB of local file cache",
+    'table_size': "hash buckets for the file table, about one per file",
+    'dir_refresh': "seconds a directory listing is trusted",
+    'file_refresh': "seconds an open file is trusted without revalidating",
+    'delay_upload': "seconds to wait before uploading a closed file",
+    'gui_optimize': "fetch every file's metadata with one PROPFIND per directory",
+    'buf_size': "KiB of I/O buffer",
+}
+
+def free_disk(path):
+    """Bytes available to unprivileged users on the filesystem holding
+    path (or its closest existing ancestor)."""
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize
+
+def total_ram():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError):
+        return None
+
+def on_battery_powered_machine():
+    import glob
+    return bool(glob.glob('/sys/class/power_supply/BAT*'))
+
+def sample_latency(url, samples=3, timeout=5):
+    """Median seconds an OPTIONS request to url takes, or None if the
+    server could not be reached. Credentials are not needed: an
+    authentication error comes back just as fast."""
+    from noiselabs.box.sync.webdav import WebDAVClient
+
+    client = WebDAVClient(url, pool_size=1, timeout=timeout)
+    client.retries = 0
+    timings = []
+    try:
+        for i in range(samples):
+            started = time.time()
+            with client.request('OPTIONS', '') as resp:
+                resp.read()
+            timings.append(time.time() - started)
+    except Exception:
+        return None
+    finally:
+        client.close()
+    # The first request also pays for the connection setup.
+    return sorted(timings)[len(timings) // 2]
+
+def tree_size(index_file=None):
+    """Entries known from the last built-in sync, or None without one."""
+    from noiselabs.box.sync.index import StateIndex
+
+    index_file = index_file or StateIndex.filepath
+    if not os.path.isfile(index_file):
+        return None
+    index = StateIndex(index_file)
+    try:
+        return index.count()
+    finally:
+        index.close()
+
+def probe(cache_dir, url=None):
+    """Gather the facts tune() looks at."""
+    facts = OrderedDict()
+    facts['free_disk'] = free_disk(cache_dir)
+    facts['ram'] = total_ram()
+    facts['battery'] = on_battery_powered_machine()
+    facts['latency'] = sample_latency(url) if url else None
+    facts['entries'] = tree_size()
+    return facts
+
+def guess_preset(facts):
+    return 'laptop' if facts.get('battery') else 'workstation'
+
+def tune(preset, facts):
+    """
+    Adjust a preset to the machine described by facts (see probe()).
+    Returns an ordered dict of davfs2 options.
+    """
+    options = OrderedDict(PRESETS[preset])
+    mib = 1024 * 1024
+    if facts.get('free_disk') is not None:
+        # Leave most of the disk to everything else.
+        options['cache_size'] = max(DEFAULTS['cache_size'],
+            min(options['cache_size'], facts['free_disk'] // 4 // mib))
+    if facts.get('entries'):
+        table_size = options['table_size']
+        while table_size < min(facts['entries'], 1 << 20):
+            table_size *= 2
+        options['table_size'] = table_size
+    if facts.get('ram') is not None and facts['ram'] < 2 * 1024 * mib:
+        options['buf_size'] = max(DEFAULTS['buf_size'], options['buf_size'] // 4)
+    latency = facts.get('latency')
+    if latency is not None and latency > 0.2:
+        # Every refresh costs at least a round trip, so revalidate less
+        # often when round trips are slow.
+        factor = min(4, int(latency / 0.1))
+        options['dir_refresh'] *= factor
+        options['file_refresh'] *= factor
+    return options
+
+def render(options, preset, existing=''):
+    """
+    Build a davfs2.conf holding options. Global settings of an existing
+    file that are not tuned here are kept, and so is everything from its
+    first mount point section on, since those only apply to one mount.
+    """
+    lines = ["# davfs2 configuration file",
+        "# version 9",
+        "# Created by %s-%s in %s using the '%s' preset" % (__prog__, __version__,
+            datetime.date.today(), preset),
+        ""]
+    for name, value in options.items():
+        comment = COMMENTS.get(name)
+        if comment:
+            lines.append("# %s (davfs2 default: %s)" % (comment, DEFAULTS[name]))
+        lines.append("%s %s" % (name, value))
+    kept = []
+    existing = existing.splitlines()
+    for i, line in enumerate(existing):
+        fields = line.split()
+        if fields and fields[0].startswith('['):
+            kept.extend([''] * bool(kept) + existing[i:])
+            break
+        if fields and not fields[0].startswith('#') and fields[0] not in options:
+            kept.append(line)
+    if kept:
+        lines += ["", "# Kept from the previous configuration"] + kept
+    return "\n".join(lines) + "\n"
+
+def diff(old, new, filepath):
+    """A unified diff between two versions of filepath, ignoring the
+    'Created by' header line."""
+    import difflib
+
+    strip = lambda text: [line for line in text.splitlines(True) if not line.startswith('# Created by')]
+    return ''.join(difflib.unified_diff(strip(old), strip(new), filepath, filepath + ' (tuned)'))
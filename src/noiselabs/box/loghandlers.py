@@ -0,0 +1,130 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import logging
+import Queue
+import threading
+
+class BatchFlushMixin(object):
+    """
+    For stream handlers fed by a L{QueueListener}: while C{batched} is set
+    flush() does nothing and the listener calls flush_batch() once per
+    batch of records instead of the stream being flushed after each one.
+    """
+    batched = False
+
+    def flush(self):
+        if not self.batched:
+            self.flush_batch()
+
+    def flush_batch(self):
+        logging.StreamHandler.flush(self)
+
+class QueueHandler(logging.Handler):
+    """
+    Hands records over to a queue instead of writing them, so the thread
+    logging never waits for a terminal or a disk. The message is formatted
+    right away since its arguments may change once the caller moves on.
+    (A backport of the Python 3.2 class of the same name.)
+    """
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+
+    def prepare(self, record):
+        record.msg = record.message = self.format(record)
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+class QueueListener(object):
+    """
+    Drains a queue fed by L{QueueHandler} on a background thread, passing
+    every record to the handlers whose level allows it. Records that piled
+    up are handled as one batch, after which each handler is flushed once.
+    """
+    _sentinel = None
+    batch_size = 512
+
+    def __init__(self, queue, *handlers):
+        self.queue = queue
+        self.handlers = handlers
+        for handler in handlers:
+            if isinstance(handler, BatchFlushMixin):
+                handler.batched = True
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor, name='box-sync-log')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _monitor(self):
+        while True:
+            # No timeout: Python 2 implements those by polling, which would
+            # delay every record (and exiting) by up to 50ms. Signals are
+            # only delivered to the main thread anyway.
+            records = [self.queue.get()]
+            try:
+                while len(records) < self.batch_size:
+                    records.append(self.queue.get_nowait())
+            except Queue.Empty:
+                pass
+            stop = False
+            for record in records:
+                if record is self._sentinel:
+                    stop = True
+                else:
+                    self.handle(record)
+            for handler in self.handlers:
+                getattr(handler, 'flush_batch', handler.flush)()
+            for record in records:
+                self.queue.task_done()
+            if stop:
+                return
+
+    def flush(self):
+        """Block until every record queued so far has been written."""
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks and self._thread is not None \
+                    and self._thread.is_alive():
+                self.queue.all_tasks_done.wait(0.5)
+
+    def stop(self):
+        """Write whatever is queued and stop the thread."""
+        if self._thread is not None:
+            self.queue.put_nowait(self._sentinel)
+            self._thread.join()
+            self._thread = None
@@ -21,13 +21,14 @@
 
 from __future__ import print_function
 
-import subprocess
+import os
+import signal
 import sys
+import time
 
 from optparse import OptionParser
 from noiselabs.box import __prog__, __version__
-from noiselabs.box.output import BoxConsole
-from noiselabs.box.setup import BoxSetup
+from noiselabs.box.davfs import PRESETS
 
 class NoiselabsOptionParser(OptionParser):
     """
@@ -37,6 +38,177 @@ class NoiselabsOptionParser(OptionParser):
     def format_epilog(self, formatter):
         return self.epilog
 
+def get_client(bc, setup, opts):
+    """
+    Build a WebDAV client for the configured server. Returns None if the
+    built-in engine is disabled.
+    """
+    from noiselabs.box.sync.compression import Compression
+    from noiselabs.box.sync.concurrency import AdaptiveConcurrency, configured_bounds
+    from noiselabs.box.sync.throttle import BandwidthLimiter
+    from noiselabs.box.sync.webdav import WebDAVClient
+
+    config = setup.config.load()
+    if config.use_davfs:
+        bc.error("'use_davfs' is enabled in %s. Set 'use_davfs = false' to use the built-in sync engine." % setup.config.filepath)
+        return None
+    username, password = setup.get_credentials(config.dav_url)
+    limiter = BandwidthLimiter()
+    limiter.configure(config)
+    initial, maximum, adaptive = configured_bounds(config, opts.jobs)
+    concurrency = AdaptiveConcurrency(initial, maximum, adaptive=adaptive)
+    return WebDAVClient(config.dav_url, username, password, limiter=limiter,
+        concurrency=concurrency, metrics=bc.metrics,
+        compression=Compression(config.compress, config.compress_min_size))
+
+def sync(bc, setup, opts, watch=False):
+    """
+    Run the built-in WebDAV sync engine. With watch=True keep running
+    afterwards, pushing local changes as they happen. Changes to the
+    configuration file are applied on SIGHUP, and as soon as the file is
+    saved while watching.
+    """
+    from noiselabs.box.sync.concurrency import configured_bounds
+    from noiselabs.box.sync.engine import SyncEngine
+    from noiselabs.box.sync.filters import PathFilter
+    from noiselabs.box.sync.hashing import Hasher, HashCache
+    from noiselabs.box.sync.index import StateIndex
+    from noiselabs.box.sync.journal import Journal
+    from noiselabs.box.sync.transfer import Downloader
+
+    client = get_client(bc, setup, opts)
+    if client is None:
+        return False
+    config = setup.config.load()
+    box_dir = config.box_dir
+    if not os.path.isdir(box_dir):
+        os.makedirs(box_dir, 0775)
+    workers = client.pool.size
+    bc.debug("Syncing '%s' with '%s' using up to %d workers..." % (box_dir, client.url, workers))
+
+    index = StateIndex()
+    downloader = Downloader(client, config.chunk_size, config.chunk_parallel)
+    hash_cache = HashCache()
+    hasher = Hasher(bc, hash_cache, config.hash_processes or None)
+    journal = Journal(metrics=bc.metrics)
+    engine = SyncEngine(bc, client, box_dir, workers, index, downloader, hasher, journal,
+        PathFilter(config.exclude))
+
+    def apply(snapshot, previous):
+        initial, maximum, adaptive = configured_bounds(snapshot, opts.jobs)
+        client.pool.concurrency.configure(initial, maximum, adaptive)
+        client.limiter.configure(snapshot)
+        engine.pool.resize(maximum)
+        downloader.parallel = snapshot.chunk_parallel
+        if snapshot.exclude != previous.exclude:
+            engine.filter = PathFilter(snapshot.exclude)
+    setup.config.subscribe(apply)
+    signal.signal(signal.SIGHUP, lambda signum, frame: setup.config.reload())
+    try:
+        if not engine.run():
+            return False
+        if watch:
+            from noiselabs.box.sync.watcher import Watcher
+            Watcher(bc, engine, config.watch_delay, config.sync_interval, setup.config).run()
+        return True
+    finally:
+        engine.close()
+        journal.close()
+        hash_cache.close()
+        index.close()
+        client.close()
+
+def daemon(bc, setup, opts):
+    """
+    Sync and watch every configured folder from this one process.
+    """
+    from noiselabs.box.sync.daemon import SyncDaemon
+
+    return SyncDaemon(bc, setup, opts.jobs).run()
+
+def list_remote(bc, setup, opts):
+    """
+    Stream the remote listing and report its throughput. If box_dir is a
+    davfs2 mount, walking it is timed as well for comparison.
+    """
+    from noiselabs.box.sync.listing import RemoteWalker, walk_mount
+
+    client = get_client(bc, setup, opts)
+    if client is None:
+        return False
+    walker = RemoteWalker(client, client.pool.size)
+    try:
+        for entry in walker.walk():
+            bc.debug(entry.path + ('/' if entry.is_dir else ''))
+    finally:
+        client.close()
+    for path, e in walker.errors:
+        bc.error("Failed to list '%s': %s" % (path, e))
+    bc.info("WebDAV: %s" % walker.report())
+
+    box_dir = setup.get_box_dir()
+    if os.path.ismount(box_dir):
+        entries, elapsed = walk_mount(box_dir)
+        bc.info("Mount: %d entries in %.1fs (%.0f entries/s)" %
+            (entries, elapsed, entries / elapsed if elapsed else 0.0))
+    return not walker.errors
+
+def status(bc, setup, opts):
+    """
+    Probe the davfs2 mount of box_dir. With --interval keep probing every
+    that many seconds; with --textfile write every sample there for the
+    Prometheus node_exporter textfile collector.
+    """
+    from noiselabs.box.status import MountProbe, render_textfile, write_textfile
+
+    box_dir = setup.get_box_dir()
+    davfs_dir = os.path.join(setup.home_dir, '.davfs2')
+    probe = MountProbe(box_dir, os.path.join(davfs_dir, 'cache'),
+        os.path.join(davfs_dir, 'davfs2.conf'))
+    mb = 1024.0 * 1024
+    while True:
+        metrics = probe.sample()
+        if opts.textfile:
+            write_textfile(opts.textfile, render_textfile(metrics, box_dir))
+        if metrics['up']:
+            timings = ["stat %.1f ms" % (metrics['stat_seconds'] * 1000),
+                "readdir %.1f ms (%d entries)" % (metrics['readdir_seconds'] * 1000, metrics['entries'])]
+            if 'read_seconds' in metrics:
+                timings.append("read %.1f ms (%d bytes)" % (metrics['read_seconds'] * 1000,
+                    metrics['read_bytes']))
+            bc.info("%s: %s" % (box_dir, ', '.join(timings)))
+        else:
+            bc.error("%s: %s" % (box_dir, metrics['error']))
+        if 'cache_bytes' in metrics:
+            bc.info("davfs2 cache: %.0f MB of %.0f MB" % (metrics['cache_bytes'] / mb,
+                metrics['cache_limit_bytes'] / mb))
+        if not opts.interval:
+            return bool(metrics['up'])
+        time.sleep(max(0, metrics['timestamp'] + opts.interval - time.time()))
+
+def bench(bc, opts, names):
+    """
+    Benchmark the sync engine against a local WebDAV server and print the
+    results as JSON.
+    """
+    import json
+    from noiselabs.box.sync.bench import SCENARIOS, Benchmark, measure_scan, measure_startup
+
+    if names == ['startup']:
+        print(json.dumps(measure_startup(), indent=2))
+        return True
+    if names == ['scan']:
+        print(json.dumps(measure_scan(bc, opts.scale, opts.jobs or 8), indent=2))
+        return True
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        bc.error("Unknown benchmark '%s'. Choose from: %s" % (unknown[0], ', '.join(SCENARIOS)))
+        return False
+    results = Benchmark(bc, opts.jobs or 4, opts.latency, opts.scale).run(names)
+    print(json.dumps(results, indent=2))
+    return all(phase['ok'] for scenario in results['scenarios'].values()
+        for phase in scenario.values() if isinstance(phase, dict))
+
 def box_main(args=None):
     """
     @param args: command arguments (default: sys.argv[1:])
@@ -54,6 +226,16 @@ def box_main(args=None):
     force_help = "forces the execution of every procedure even if the component " +\
     "is already installed and/or configured"
     log_help = "log output to ~/.noiselabs/box/box-sync.log"
+    jobs_help = "number of concurrent WebDAV requests (overrides 'workers')"
+    scale_help = "scale the size of the benchmark trees by this factor"
+    latency_help = "seconds of latency to add to every benchmark request"
+    interval_help = "with status, keep probing the mount every that many seconds"
+    textfile_help = "with status, write metrics to this Prometheus textfile " +\
+    "(e.g. /var/lib/node_exporter/textfile/box-sync.prom)"
+    metrics_json_help = "write the timings and counters collected during the run to " +\
+    "this file as JSON"
+    preset_help = "davfs2 tuning preset used by setup: laptop, workstation or server " +\
+    "(default: guessed from this machine)"
 
     parser = NoiselabsOptionParser(
         usage=usage,
@@ -67,6 +249,14 @@ Commands:
   setup       launch a setup wizard
   start       start sync service
   stop        stop sync service
+  sync        synchronize now using the built-in WebDAV engine (use_davfs = false)
+  watch       sync, then keep uploading local changes as they happen
+  daemon      sync and watch [main] and every [target:NAME] folder in one process
+  list        list remote files and report listing throughput
+  status      time stat, readdir and read calls on the mounted sync dir
+  bench       benchmark the sync engine on synthetic trees [small huge deep wide
+              copies text], the start up time of every command [startup] or
+              the local scanner on a million-file tree [scan]
   help        show this help message and exit
   uninstall   removes all configuration and cache files installed by box-sync
 
@@ -80,12 +270,25 @@ Workflow:
         dest="force")
     parser.add_option("-l", "--log", help=log_help, action="store_true",
         dest="log")
+    parser.add_option("-j", "--jobs", help=jobs_help, type="int",
+        dest="jobs")
+    parser.add_option("--scale", help=scale_help, type="float", default=1.0,
+        dest="scale")
+    parser.add_option("--latency", help=latency_help, type="float", default=0.0,
+        dest="latency")
+    parser.add_option("--preset", help=preset_help, type="choice",
+        choices=list(PRESETS), dest="preset")
+    parser.add_option("--interval", help=interval_help, type="float", default=0,
+        dest="interval")
+    parser.add_option("--textfile", help=textfile_help, dest="textfile")
+    parser.add_option("--metrics-json", help=metrics_json_help, dest="metrics_json")
     parser.add_option("-v", "--verbose", help="be verbose", action="store_true",
         dest="verbose")
 
     opts, pargs = parser.parse_args(args=args)
 
-    commands = ['check', 'help', 'start', 'stop', 'setup', 'uninstall']
+    commands = ['check', 'help', 'start', 'stop', 'setup', 'sync', 'watch',
+        'daemon', 'list', 'status', 'bench', 'uninstall']
 
     nargs = len(pargs)
     # Parse commands
@@ -99,27 +302,54 @@ Workflow:
             parser.print_help()
             sys.exit(0)
 
+    # Commands are often run from login scripts, so only what they use is
+    # imported.
+    from noiselabs.box.config import ConfigError
+    from noiselabs.box.output import BoxConsole
+    from noiselabs.box.setup import BoxSetup
+
     bc = BoxConsole(opts, __prog__)
     setup = BoxSetup(bc)
 
-    if command == 'check':
-        setup.check()
-    elif command == 'setup':
-        setup.wizard()
-    elif command == 'start':
-        box_dir = setup.get_box_dir()
-        bc.debug("Mounting '%s'..." % box_dir)
-        cmd = "mount %s" % box_dir
-        if subprocess.call(cmd, shell=True) != 0:
-            bc.error("Failed to mount sync dir.")
-            sys.exit(-1)
-    elif command == 'stop':
-        box_dir = setup.get_box_dir()
-        bc.debug("Unmounting '%s'..." % box_dir)
-        cmd = "umount %s" % box_dir
-        if subprocess.call(cmd, shell=True) != 0:
-            bc.error("Failed to unmount sync dir.")
-            sys.exit(-1)
-    elif command == 'uninstall':
-        setup = BoxSetup(bc)
-        setup.uninstall()
+    try:
+        if command == 'check':
+            setup.check()
+        elif command == 'setup':
+            setup.wizard(opts.preset, opts.force)
+        elif command == 'start':
+            import subprocess
+            box_dir = setup.get_box_dir()
+            bc.debug("Mounting '%s'..." % box_dir)
+            if subprocess.call(['mount', box_dir]) != 0:
+                bc.error("Failed to mount sync dir.")
+                sys.exit(-1)
+        elif command == 'stop':
+            import subprocess
+            box_dir = setup.get_box_dir()
+            bc.debug("Unmounting '%s'..." % box_dir)
+            if subprocess.call(['umount', box_dir]) != 0:
+                bc.error("Failed to unmount sync dir.")
+                sys.exit(-1)
+        elif command in ('sync', 'watch'):
+            if not sync(bc, setup, opts, watch=(command == 'watch')):
+                sys.exit(-1)
+        elif command == 'daemon':
+            if not daemon(bc, setup, opts):
+                sys.exit(-1)
+        elif command == 'list':
+            if not list_remote(bc, setup, opts):
+                sys.exit(-1)
+        elif command == 'status':
+            if not status(bc, setup, opts):
+                sys.exit(-1)
+        elif command == 'bench':
+            if not bench(bc, opts, pargs[1:]):
+                sys.exit(-1)
+        elif command == 'uninstall':
+            setup = BoxSetup(bc)
+            setup.uninstall()
+    except ConfigError as e:
+        bc.error(str(e))
+        sys.exit(-1)
+    finally:
+        bc.report_metrics()
@@ -0,0 +1,183 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import math
+import threading
+import time
+
+class Histogram(object):
+    """
+    Counts observations in logarithmic buckets, four per power of two, so
+    percentiles are known within about 20% whatever their magnitude while
+    memory stays constant.
+    """
+    resolution = 4
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = {}
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        bucket = int(math.ceil(math.log(value, 2) * self.resolution)) if value > 0 else None
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def upper_bound(self, bucket):
+        return 0.0 if bucket is None else 2 ** (float(bucket) / self.resolution)
+
+    def percentile(self, p):
+        """The upper bound of the bucket holding the p-th percentile,
+        capped by the largest value seen."""
+        if not self.count:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets, key=lambda b: float('-inf') if b is None else b):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self.upper_bound(bucket), self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': dict(('%g' % self.upper_bound(b), n) for b, n in self.buckets.items()),
+        }
+
+class Span(object):
+    """Times a with block into a histogram of its metrics object."""
+    __slots__ = ('metrics', 'name', 'started')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe(self.name, time.time() - self.started)
+
+class Metrics(object):
+    """
+    Thread-safe counters and latency histograms, aggregated in memory
+    for the lifetime of the process. Names are dotted, like C{http.GET}.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(value)
+
+    def span(self, name):
+        """
+        Returns a context manager timing its block::
+
+            with metrics.span('hash.file'):
+                ...
+        """
+        return Span(self, name)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': dict((name, h.as_dict()) for name, h in self.histograms.items()),
+            }
+
+    def dump(self, filepath):
+        import json
+
+        with open(filepath, 'wb') as f:
+            json.dump(self.as_dict(), f, indent=2, sort_keys=True)
+
+    def table(self):
+        """A plain text summary, one line per metric."""
+        data = self.as_dict()
+        lines = []
+        if data['histograms']:
+            lines.append("%-28s %8s %10s %10s %10s %10s %10s" % ('timing', 'count', 'total',
+                'mean', 'p50', 'p99', 'max'))
+            ms = lambda seconds: "%.1fms" % (seconds * 1000)
+            for name in sorted(data['histograms']):
+                h = data['histograms'][name]
+                lines.append("%-28s %8d %9.2fs %10s %10s %10s %10s" % (name, h['count'],
+                    h['sum'], ms(h['sum'] / h['count']), ms(h['p50']), ms(h['p99']), ms(h['max'])))
+        if data['counters']:
+            lines.append("%-28s %8s" % ('counter', 'value'))
+            for name in sorted(data['counters']):
+                lines.append("%-28s %8d" % (name, data['counters'][name]))
+        return "\n".join(lines)
+
+class _NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class NullMetrics(object):
+    """Accepts the L{Metrics} calls and does nothing, for when nobody is
+    going to look at the numbers."""
+    enabled = False
+
+    def count(self, name, amount=1):
+        pass
+
+    def observe(self, name, value):
+        pass
+
+    def span(self, name):
+        return _NULL_SPAN
+
+NULL_METRICS = NullMetrics()
@@ -21,16 +21,18 @@
 
 from __future__ import print_function
 
-import curses
+import atexit
 import logging
 import os
+import Queue
 import time
 import sys
-import types
 
 from noiselabs.box.config import BASEDIR
+from noiselabs.box.metrics import NULL_METRICS, Metrics
 from noiselabs.box.utils import create_file
 from noiselabs.box.ansistrm import ColorizingStreamHandler
+from noiselabs.box.loghandlers import BatchFlushMixin, QueueHandler, QueueListener
 
 ################################################################################
 ##
@@ -154,11 +156,26 @@ def colorize(color_key, text):
     else:
         return text
 
+class ConsoleHandler(BatchFlushMixin, ColorizingStreamHandler):
+    pass
+
 class BoxConsole():
     """
     A class that performs fancy terminal formatting for status and informational
     messages built upon the logging module.
+
+    Records are queued and written by a background thread, so logging
+    never blocks the threads doing the work. With --log they also go to
+    box-sync.log, which is rotated once it grows past log_max_bytes.
+
+    It also collects timings and counters from the operations it is handed
+    to (see L{Metrics}). They are only aggregated with --verbose, which
+    prints a summary at the end of the run, or --metrics-json, which dumps
+    them to a file; otherwise every call is a no-op.
     """
+    log_max_bytes = 10 * 1024 * 1024
+    log_backups = 5
+
     def __init__(self, opts, name):
         self.name = name
         self.opts = opts
@@ -167,21 +184,43 @@ class BoxConsole():
         self.level = logging.DEBUG if self.opts.verbose else logging.INFO
         self.logger.setLevel(self.level)
 
+        self.metrics_json = getattr(self.opts, 'metrics_json', None)
+        if self.opts.verbose or self.metrics_json:
+            self.metrics = Metrics()
+        else:
+            self.metrics = NULL_METRICS
+
         # create console handler
-        ch = ColorizingStreamHandler()
+        ch = ConsoleHandler()
         ch.setLevel(self.level)
         # create formatter and add it to the handlers
         #ch.setFormatter(logging.Formatter('%(message)s'))
-        self.logger.addHandler(ch)
+        handlers = [ch]
 
         # create file handler
         if self.opts.log:
+            from noiselabs.box.logfile import RotatingFileHandler
             logfile = os.path.join(BASEDIR, 'box-sync.log')
             create_file(logfile)
-            fh = logging.FileHandler(logfile)
+            fh = RotatingFileHandler(logfile, maxBytes=self.log_max_bytes,
+                backupCount=self.log_backups)
             fh.setLevel(logging.DEBUG)
             fh.setFormatter(logging.Formatter('[%(asctime)s] [%(name)s] [%(levelname)s] %(message)s'))
-            self.logger.addHandler(fh)
+            handlers.append(fh)
+
+        queue = Queue.Queue()
+        self.logger.addHandler(QueueHandler(queue))
+        self.listener = QueueListener(queue, *handlers)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def flush(self):
+        """Wait until everything logged so far has been written, before
+        printing to the terminal directly."""
+        self.listener.flush()
+
+    def close(self):
+        self.listener.stop()
 
     def debug(self, msg):
         self.logger.debug(msg)
@@ -201,10 +240,32 @@ class BoxConsole():
     def log(self, lvl, msg):
         self.logger.log(lvl, msg)
 
+    def span(self, name):
+        return self.metrics.span(name)
+
+    def count(self, name, amount=1):
+        self.metrics.count(name, amount)
+
+    def observe(self, name, value):
+        self.metrics.observe(name, value)
+
+    def report_metrics(self):
+        """Print the collected metrics if verbose and dump them as JSON if
+        asked to."""
+        if not self.metrics.enabled:
+            return
+        if self.opts.verbose:
+            table = self.metrics.table()
+            if table:
+                self.debug("Metrics:\n" + table)
+        if self.metrics_json:
+            self.metrics.dump(self.metrics_json)
+
     def countdown(self, secs=5, doing="Starting"):
         """ This method is based on Portage's _emerge.countdown
         Copyright 1999-2009 Gentoo Foundation"""
         if secs:
+            self.flush()
             print("Waiting",secs,"seconds before starting (Control-C to abort)...")
             print(doing+" in: ", end=' ')
             ticks=list(range(secs))
@@ -214,3 +275,34 @@ class BoxConsole():
                 sys.stdout.flush()
                 time.sleep(1)
             print()
+
+class PrefixedConsole(object):
+    """
+    Passes messages on to a L{BoxConsole} with a prefix, so the output of
+    several sync targets sharing one process can be told apart. Everything
+    else, metrics included, goes to the shared console.
+    """
+    def __init__(self, box_console, prefix):
+        self.out = box_console
+        self.prefix = prefix
+
+    def __getattr__(self, name):
+        return getattr(self.out, name)
+
+    def log(self, lvl, msg):
+        self.out.log(lvl, self.prefix + msg)
+
+    def debug(self, msg):
+        self.out.debug(self.prefix + msg)
+
+    def info(self, msg):
+        self.out.info(self.prefix + msg)
+
+    def warning(self, msg):
+        self.out.warning(self.prefix + msg)
+
+    def error(self, msg):
+        self.out.error(self.prefix + msg)
+
+    def critical(self, msg):
+        self.out.critical(self.prefix + msg)
@@ -24,14 +24,10 @@ from __future__ import print_function
 import datetime
 import grp
 import os
-import shutil
-import subprocess
-import ConfigParser
 
 from noiselabs.box import __prog__, __version__
 from noiselabs.box.config import BoxConfig, BASEDIR
-from noiselabs.box.configparser import WhitespaceDelimitedConfigParser
-from noiselabs.box.pms.pms import get_pms
+from noiselabs.box.configparser import FstabConfigParser, WhitespaceDelimitedConfigParser
 from noiselabs.box.utils import get_username
 
 class BoxSetup(object):
@@ -61,6 +57,7 @@ class BoxSetup(object):
         self.out.info("* Checking davfs installation...")
         for davfs_file in ['/usr/sbin/mount.davfs', '/sbin/umount.davfs', '/etc/davfs2/davfs2.conf']:
             if not os.path.isfile(davfs_file):
+                from noiselabs.box.pms.pms import get_pms
                 self.out.error("! Davfs is not installed in your system. Please install it and re-run this application.")
                 pms = get_pms()
                 if pms == False: return False
@@ -81,7 +78,9 @@ class BoxSetup(object):
         *    $ mount ~/dav
         """
 
-    def setup_davfs(self):
+    def setup_davfs(self, preset=None, force=False):
+        import subprocess
+
         self.out.info("* Setting up davfs...")
         box_dir = self.get_box_dir()
         if not os.path.isdir(box_dir):
@@ -134,79 +133,131 @@ class BoxSetup(object):
                 os.chmod(secrets_file, 0600)
             self.out.info("* Created a new secrets file in '%s'" % secrets_file)
 
-        # Check for a davfs2.conf file in the home dir
+        # Tune the davfs2.conf file in the home dir
         davfs_conf_file = os.path.join(home_davfs_dir, 'davfs2.conf')
-        try:
-            with open(davfs_conf_file, 'r') as f: pass
-            self.out.debug("* Found personal config file in '%s'" % secrets_file)
-        except IOError as e:
-            # Create a davfs.conf file if needed
-            with open(davfs_conf_file, 'wb') as f:
-                f.write("# davfs2 configuration file\n"+
-                "# version 9\n"+
-                "# Created by %s-%s in %s" % (__prog__, __version__, str(datetime.date.today())+"\n"+
-                "\n"+
-                "use_locks 0\n"))
-            os.chmod(davfs_conf_file, 0600)
-            self.out.info("* Installed a new davfs config file in '%s'" % davfs_conf_file)
+        self.setup_davfs_conf(davfs_conf_file, davfs_cache_dir, preset, force)
 
-        cp = WhitespaceDelimitedConfigParser()
+        dav_url = self.config.load().dav_url
 
         #print()
         #self.out.warning("The remaining procedures may require human intervention.")
         #self.out.warning("Please follow them carefully. Thanks for your patience!")
         #print()
 
-        cp.read(secrets_file)
-        line = cp.get_option('https://dav.box.com/dav')
-        if line:
+        secrets = WhitespaceDelimitedConfigParser(secrets_file)
+        line = secrets.get_option(dav_url)
+        if line and len(line) > 2:
             self.out.info("* '%s' looks good ;)" % secrets_file)
             line[2] = '<HIDDEN>'
             self.out.debug('  Read: "' + ' '.join(line) + '"')
         else:
             self.out.warning("* Credentials are missing from %s. Please add them:" % secrets_file)
-            print("  $ echo \"https://dav.box.com/dav MYEMAIL MYPASSWORD\" >> %s" % secrets_file)
+            self.out.flush()
+            print("  $ echo \"%s MYEMAIL MYPASSWORD\" >> %s" % (dav_url, secrets_file))
             print()
-        cp.close()
 
+        # Look for the URL first so an existing mount point elsewhere is
+        # respected, then for box_dir, which may still point to an old URL.
         fstab_file = '/etc/fstab'
-        cp.read(fstab_file)
-        line = cp.get_option('https://dav.box.com/dav')
+        fstab = FstabConfigParser(fstab_file)
+        line = fstab.get_option(dav_url)
         if line:
             self.out.info("* '%s' looks good ;)" % fstab_file)
             self.out.debug('  Read: "' + ' '.join(line) + '"')
         else:
-            self.out.warning("* Box mount point is missing. Please add this line to your /etc/fstab:")
-            print("  $ sudo sh -c 'echo \"https://dav.box.com/dav %s davfs rw,user,noauto 0 0\" >> /etc/fstab'" % box_dir)
-            print()
-        cp.close()
+            mount = [dav_url, box_dir, 'davfs', 'rw,user,noauto', '0', '0']
+            if force and os.access(fstab_file, os.W_OK):
+                fstab.set_option(mount, index=1)
+                fstab.write()
+                self.out.info("* Added the Box mount point to '%s'" % fstab_file)
+            else:
+                self.out.warning("* Box mount point is missing. Please add this line to your %s "
+                    "(or run '%s --force setup' as root):" % (fstab_file, __prog__))
+                self.out.flush()
+                print("  $ sudo sh -c 'echo \"%s\" >> %s'" % (fstab.join(mount), fstab_file))
+                print()
 
-        cp.read(davfs_conf_file)
-        line = cp.get_option('use_locks')
+        davfs_conf = WhitespaceDelimitedConfigParser(davfs_conf_file)
+        line = davfs_conf.get_option('use_locks')
         if line and line[1] == '0':
             self.out.info("* '%s' looks good ;)" % davfs_conf_file)
             self.out.debug('  Read: "' + ' '.join(line) + '"')
         else:
-            self.out.warning("* Please set 'use_locks 0' in /etc/davfs2/davfs2.conf")
-            editor = os.getenv('EDITOR')
-            print("  $ sudo %s /etc/davfs2/davfs2.conf" % editor)
+            self.out.warning("* Please set 'use_locks 0' in %s" % davfs_conf_file)
+            editor = os.getenv('EDITOR', 'vi')
+            self.out.flush()
+            print("  $ %s %s" % (editor, davfs_conf_file))
             print()
-        cp.close()
 
-    def wizard(self):
-        self.setup_davfs()
+    def setup_davfs_conf(self, davfs_conf_file, davfs_cache_dir, preset=None, force=False):
+        """
+        Write a davfs2.conf tuned for this machine, starting from the given
+        preset (guessed if None). An existing file that differs is only
+        replaced when forced, after showing what would change.
+        """
+        import shutil
+        from noiselabs.box import davfs
+
+        self.out.info("* Probing this machine to tune davfs...")
+        facts = davfs.probe(davfs_cache_dir, self.config.get('dav_url'))
+        mb = 1024.0 * 1024
+        self.out.info("  %s free for the cache, %s of RAM, %s round trips, %s entries" % (
+            "%.0f MB" % (facts['free_disk'] / mb),
+            "unknown amount" if facts['ram'] is None else "%.0f MB" % (facts['ram'] / mb),
+            "unknown" if facts['latency'] is None else "%.0f ms" % (facts['latency'] * 1000),
+            "unknown number of" if facts['entries'] is None else facts['entries']))
+        preset = preset or davfs.guess_preset(facts)
 
-    def get_box_dir(self):
         try:
-            box_dir = self.config.cfgparser.get("main", "box_dir")
-        except ConfigParser.NoSectionError:
-            self.check_config()
-        box_dir = self.config.cfgparser.get("main", "box_dir")
-        if not os.path.isabs(box_dir):
-            box_dir = os.path.join(self.home_dir, box_dir)
-        return box_dir
+            with open(davfs_conf_file, 'r') as f:
+                current = f.read()
+        except IOError:
+            current = None
+        tuned = davfs.render(davfs.tune(preset, facts), preset, current or '')
+        if current is None:
+            self.out.info("* Installing a new davfs config file in '%s' (%s preset)" % (davfs_conf_file, preset))
+        else:
+            changes = davfs.diff(current, tuned, davfs_conf_file)
+            if not changes:
+                self.out.debug("* Personal config file '%s' is already tuned" % davfs_conf_file)
+                return
+            self.out.info("* Tuning '%s' (%s preset) would change:" % (davfs_conf_file, preset))
+            self.out.flush()
+            print(changes)
+            if not force:
+                self.out.warning("* Run '%s --force setup' to apply these changes" % __prog__)
+                return
+            shutil.copy2(davfs_conf_file, davfs_conf_file + '.bak')
+            self.out.info("* Saved the previous config file as '%s.bak'" % davfs_conf_file)
+        tmp_file = davfs_conf_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(tuned)
+        os.chmod(tmp_file, 0600)
+        os.rename(tmp_file, davfs_conf_file)
+
+    def wizard(self, preset=None, force=False):
+        self.setup_davfs(preset, force)
+
+    def get_box_dir(self):
+        return self.config.load().box_dir
+
+    def get_credentials(self, url, box_dir=None):
+        """
+        Look up the username and password for url in the personal davfs2
+        secrets file. Like davfs2, a line for the mount point box_dir wins
+        over one for the URL, which lets several accounts share a server.
+        Returns (None, None) if there is no matching line.
+        """
+        secrets_file = os.path.join(self.home_dir, '.davfs2', 'secrets')
+        secrets = WhitespaceDelimitedConfigParser(secrets_file)
+        line = (box_dir and secrets.get_option(box_dir)) or secrets.get_option(url)
+        if not line or len(line) < 3:
+            return (None, None)
+        return (line[1], line[2])
 
     def uninstall(self):
+        import shutil
+
         if not os.path.isdir(BASEDIR):
             self.out.info("Directory %s was already removed." % BASEDIR)
             return False
@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+from noiselabs.box.configparser import WhitespaceDelimitedConfigParser
+
+class ProbeTimeout(Exception):
+    pass
+
+class MountProbe(object):
+    """
+    Times a stat, a readdir and a small read against the mounted box_dir,
+    and measures how much of the davfs2 cache is in use.
+
+    A davfs2 mount whose server stopped answering can block file system
+    calls for minutes, so every call touching box_dir, down to checking
+    that it is a mount point, runs on a helper thread and is abandoned
+    after C{timeout} seconds. No new sample is taken while an abandoned one
+    is still stuck. One sample costs a few system calls on the mount plus a
+    walk of the cache directory, which davfs2 keeps bounded by its
+    cache_size.
+    """
+    read_size = 4096
+
+    def __init__(self, box_dir, cache_dir, conf_file=None, timeout=10):
+        self.box_dir = box_dir
+        self.cache_dir = cache_dir
+        self.conf_file = conf_file
+        self.timeout = timeout
+        self.sample_file = None
+        self._no_sample = None
+        self._stuck = None
+
+    def _call(self, func, *args):
+        if self._stuck is not None and self._stuck.is_alive():
+            raise ProbeTimeout("a previous probe of '%s' is still blocked" % self.box_dir)
+        result = []
+        def target():
+            started = time.time()
+            try:
+                value = func(*args)
+            except Exception as e:
+                result.append((e, None))
+            else:
+                result.append((value, time.time() - started))
+        t = threading.Thread(target=target, name='mount-probe')
+        t.daemon = True
+        t.start()
+        t.join(self.timeout)
+        if t.is_alive():
+            self._stuck = t
+            raise ProbeTimeout("'%s' did not answer within %ds" % (self.box_dir, self.timeout))
+        value, elapsed = result[0]
+        if elapsed is None:
+            raise value
+        return value, elapsed
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return len(f.read(self.read_size))
+
+    def _pick_sample_file(self, names):
+        """The first small regular file at the top of box_dir, remembered
+        so every sample reads the same one. Finding none is remembered too,
+        until the entries looked at change."""
+        if self.sample_file is not None and os.path.basename(self.sample_file) in names:
+            return self.sample_file
+        candidates = sorted(names)[:100]
+        if self.sample_file is None and candidates == self._no_sample:
+            return None
+        self.sample_file = self._call(self._find_sample_file, candidates)[0]
+        self._no_sample = candidates if self.sample_file is None else None
+        return self.sample_file
+
+    def _find_sample_file(self, names):
+        for name in names:
+            path = os.path.join(self.box_dir, name)
+            try:
+                if os.path.isfile(path) and os.path.getsize(path) <= 1024 * 1024:
+                    return path
+            except OSError:
+                continue
+        return None
+
+    def cache_usage(self):
+        used = 0
+        for dirpath, dirnames, filenames in os.walk(self.cache_dir):
+            for name in filenames:
+                try:
+                    used += os.lstat(os.path.join(dirpath, name)).st_size
+                except OSError:
+                    continue
+        return used
+
+    def cache_limit(self):
+        """davfs2's cache_size in bytes (50 MiB unless configured)."""
+        limit = 50
+        if self.conf_file and os.path.isfile(self.conf_file):
+            line = WhitespaceDelimitedConfigParser(self.conf_file).get_option('cache_size')
+            if line and len(line) > 1 and line[1].isdigit():
+                limit = int(line[1])
+        return limit * 1024 * 1024
+
+    def sample(self):
+        """
+        Returns an ordered dict of metrics. C{up} is 0 if box_dir is not
+        mounted or an operation failed, in which case C{error} says why and
+        the values that could not be taken are missing.
+        """
+        metrics = OrderedDict()
+        metrics['timestamp'] = time.time()
+        metrics['up'] = 0
+        try:
+            metrics['mounted'] = int(self._call(os.path.ismount, self.box_dir)[0])
+            if not metrics['mounted']:
+                raise OSError("'%s' is not mounted" % self.box_dir)
+            st, metrics['stat_seconds'] = self._call(os.stat, self.box_dir)
+            names, metrics['readdir_seconds'] = self._call(os.listdir, self.box_dir)
+            metrics['entries'] = len(names)
+            path = self._pick_sample_file(names)
+            if path is not None:
+                metrics['read_bytes'], metrics['read_seconds'] = self._call(self._read, path)
+            metrics['up'] = 1
+        except (OSError, IOError, ProbeTimeout) as e:
+            metrics['error'] = str(e)
+        if os.path.isdir(self.cache_dir):
+            metrics['cache_bytes'] = self.cache_usage()
+        metrics['cache_limit_bytes'] = self.cache_limit()
+        return metrics
+
+PROMETHEUS_METRICS = [
+    ('up', 'box_sync_mount_up', 'gauge', "Whether box_dir is mounted and answered every probe."),
+    ('mounted', 'box_sync_mount_mounted', 'gauge', "Whether box_dir is a mount point."),
+    ('stat_seconds', 'box_sync_mount_probe_seconds{op="stat"}', 'gauge',
+        "Seconds taken by a file system operation on box_dir."),
+    ('readdir_seconds', 'box_sync_mount_probe_seconds{op="readdir"}', 'gauge', None),
+    ('read_seconds', 'box_sync_mount_probe_seconds{op="read"}', 'gauge', None),
+    ('entries', 'box_sync_mount_entries', 'gauge', "Entries at the top of box_dir."),
+    ('cache_bytes', 'box_sync_davfs_cache_bytes', 'gauge', "Bytes used by the davfs2 cache."),
+    ('cache_limit_bytes', 'box_sync_davfs_cache_limit_bytes', 'gauge',
+        "davfs2 cache_size, in bytes."),
+    ('timestamp', 'box_sync_mount_probe_timestamp_seconds', 'gauge',
+        "When the last probe was taken."),
+]
+
+def render_textfile(metrics, box_dir):
+    """Format a sample in the Prometheus text exposition format."""
+    label = 'box_dir="%s"' % box_dir.replace('\\', '\\\\').replace('"', '\\"')
+    lines = []
+    for key, name, kind, help in PROMETHEUS_METRICS:
+        base = name.split('{')[0]
+        if help is not None:
+            lines.append("# HELP %s %s" % (base, help))
+            lines.append("# TYPE %s %s" % (base, kind))
+        if key not in metrics:
+            continue
+        if '{' in name:
+            name = name[:-1] + ',' + label + '}'
+        else:
+            name = name + '{' + label + '}'
+        lines.append("%s %r" % (name, float(metrics[key])))
+    return "\n".join(lines) + "\n"
+
+def write_textfile(filepath, text):
+    """Replace filepath atomically so node_exporter never reads half of it."""
+    tmp_path = '%s.%d.tmp' % (filepath, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(text)
+    os.chmod(tmp_path, 0644)
+    os.rename(tmp_path, filepath)
@@ -0,0 +1,328 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from collections import OrderedDict
+
+from noiselabs.box import __version__
+from noiselabs.box.config import BoxConfig
+from noiselabs.box.sync.compression import Compression
+from noiselabs.box.sync.davserver import DAVServer
+from noiselabs.box.sync.engine import SyncEngine
+from noiselabs.box.sync.hashing import Hasher
+from noiselabs.box.sync.index import StateIndex
+from noiselabs.box.sync.listing import peak_rss, reset_peak_rss, walk_mount
+from noiselabs.box.sync.scanner import LocalScanner, scandir
+from noiselabs.box.sync.webdav import WebDAVClient
+
+BLOCK = os.urandom(1024 * 1024)
+
+def write_file(path, size, seed=0):
+    """Files written with different seeds have different content."""
+    block = BLOCK[seed:] + BLOCK[:seed]
+    with open(path, 'wb') as f:
+        while size > 0:
+            f.write(block[:size])
+            size -= len(block)
+
+def make_small(root, scale):
+    """Many small files spread over a few directories."""
+    for i in range(int(2000 * scale)):
+        folder = os.path.join(root, 'd%02d' % (i % 20))
+        if not os.path.isdir(folder):
+            os.mkdir(folder)
+        write_file(os.path.join(folder, 'f%05d.txt' % i), 4096)
+
+def make_huge(root, scale):
+    """A few distinct files big enough to use ranged downloads."""
+    for i in range(4):
+        write_file(os.path.join(root, 'huge%d.bin' % i), int(32 * 1024 * 1024 * scale), i + 1)
+
+def make_deep(root, scale):
+    """A single chain of nested directories with a few files at each level."""
+    folder = root
+    for level in range(int(50 * scale) or 1):
+        folder = os.path.join(folder, 'level%03d' % level)
+        os.mkdir(folder)
+        for i in range(5):
+            write_file(os.path.join(folder, 'f%d' % i), 1024)
+
+def make_wide(root, scale):
+    """One directory holding thousands of entries."""
+    folder = os.path.join(root, 'wide')
+    os.mkdir(folder)
+    for i in range(int(5000 * scale)):
+        write_file(os.path.join(folder, 'f%05d' % i), 512)
+
+def make_copies(root, scale):
+    """A few assets duplicated into many directories."""
+    assets = [BLOCK[i * 4096:] + BLOCK[:i * 4096] for i in range(4)]
+    for i in range(int(20 * scale) or 1):
+        folder = os.path.join(root, 'copy%02d' % i)
+        os.mkdir(folder)
+        for j, data in enumerate(assets):
+            with open(os.path.join(folder, 'asset%d.bin' % j), 'wb') as f:
+                f.write(data)
+
+def make_text(root, scale):
+    """Log and CSV files, which compress well in transit."""
+    for i in range(int(40 * scale) or 1):
+        with open(os.path.join(root, 'server%02d.log' % i), 'wb') as f:
+            for j in range(5000):
+                f.write('2013-11-15 10:%02d:%02d INFO worker-%d handled request %d in %d ms\n'
+                    % (j // 60 % 60, j % 60, j % 8, i * 5000 + j, (j * 37) % 500))
+        with open(os.path.join(root, 'report%02d.csv' % i), 'wb') as f:
+            f.write('id,name,quantity,price\n')
+            for j in range(5000):
+                f.write('%d,item-%d,%d,%d.%02d\n' % (i * 5000 + j, j % 97, j % 13, j % 100, j % 100))
+
+SCENARIOS = OrderedDict([
+    ('small', make_small),
+    ('huge', make_huge),
+    ('deep', make_deep),
+    ('wide', make_wide),
+    ('copies', make_copies),
+    ('text', make_text),
+])
+
+STARTUP_COMMANDS = ['--version', 'help', 'start', 'stop', 'status', 'check']
+"""Commands whose cold start is measured by measure_startup(). start and
+stop are run against a directory that is not in fstab, so mount fails
+right away."""
+
+STARTUP_SCRIPT = "import sys; from noiselabs.box.main import box_main; box_main(sys.argv[1:])"
+
+def measure_startup(commands=STARTUP_COMMANDS, runs=5):
+    """
+    Run every command in a fresh interpreter, with HOME pointing to an
+    empty directory, and return the wall clock times in milliseconds.
+    """
+    import noiselabs
+
+    home = tempfile.mkdtemp(prefix='box-sync-bench-')
+    env = dict(os.environ, HOME=home,
+        PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(noiselabs.__file__))))
+    results = OrderedDict()
+    try:
+        with open(os.devnull, 'wb') as devnull:
+            # The first run creates the configuration files, and .pyc files
+            # if they are missing.
+            subprocess.call([sys.executable, '-c', STARTUP_SCRIPT, 'help'], env=env,
+                stdout=devnull, stderr=devnull)
+            for command in commands:
+                timings = []
+                for i in range(runs):
+                    started = time.time()
+                    subprocess.call([sys.executable, '-c', STARTUP_SCRIPT, command], env=env,
+                        stdout=devnull, stderr=devnull)
+                    timings.append((time.time() - started) * 1000)
+                timings.sort()
+                results[command] = OrderedDict([('min_ms', round(timings[0], 1)),
+                    ('median_ms', round(percentile(timings, 50), 1))])
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+    return OrderedDict([
+        ('version', __version__),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('runs', runs),
+        ('startup', results),
+    ])
+
+def make_scan_tree(root, scale):
+    """
+    Empty files, a hundred per directory, in directories nested two levels
+    deep: a million files at scale 1. Returns the number of directories
+    and files created.
+    """
+    files = int(1000000 * scale) or 1
+    folders = (files + 99) // 100
+    for i in range(folders):
+        parent = os.path.join(root, 'd%03d' % (i // 100))
+        if not i % 100:
+            os.mkdir(parent)
+        folder = os.path.join(parent, 'd%03d' % (i % 100))
+        os.mkdir(folder)
+        for j in range(min(100, files - i * 100)):
+            open(os.path.join(folder, 'f%03d' % j), 'wb').close()
+    return folders + (folders + 99) // 100, files
+
+def measure_scan(box_console, scale=1.0, threads=8, runs=3):
+    """
+    Scan a synthetic tree (see L{make_scan_tree}) with os.walk() and
+    stat(), and with L{LocalScanner} on one and on several threads.
+    Returns the best of runs for each, after a first walk that warms the
+    kernel caches.
+    """
+    tmpdir = tempfile.mkdtemp(prefix='box-sync-bench-')
+    try:
+        started = time.time()
+        dirs, files = make_scan_tree(tmpdir, scale)
+        box_console.info("Created %d directories and %d files in %.1fs" % (dirs, files,
+            time.time() - started))
+        walk_mount(tmpdir)
+
+        def scan(threads):
+            scanner = LocalScanner(tmpdir, threads)
+            scanner.scan()
+            return scanner.elapsed
+
+        methods = OrderedDict([
+            ('os.walk', lambda: walk_mount(tmpdir)[1]),
+            ('scanner_1', lambda: scan(1)),
+            ('scanner_%d' % threads, lambda: scan(threads)),
+        ])
+        results = OrderedDict()
+        for name, method in methods.items():
+            elapsed = min(method() for i in range(runs))
+            results[name] = OrderedDict([
+                ('seconds', round(elapsed, 3)),
+                ('dirs_per_sec', round(dirs / elapsed, 1)),
+                ('files_per_sec', round(files / elapsed, 1)),
+            ])
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return OrderedDict([
+        ('version', __version__),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('scandir', scandir is not None),
+        ('dirs', dirs),
+        ('files', files),
+        ('peak_rss', peak_rss()),
+        ('scan', results),
+    ])
+
+def percentile(values, p):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def tree_size(root):
+    files = size = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            files += 1
+            size += os.path.getsize(os.path.join(dirpath, name))
+    return files, size
+
+class Benchmark(object):
+    """
+    Measures the sync engine against a local L{DAVServer} on synthetic trees.
+    Every scenario is run in three phases: uploading the tree to an empty
+    server, a second sync with nothing to do, and downloading it again into
+    an empty directory. latency is added to every request the server
+    serves, to mimic a remote one.
+    """
+    phases = ['upload', 'rescan', 'download']
+
+    def __init__(self, box_console, workers=4, latency=0, scale=1.0):
+        self.out = box_console
+        self.workers = workers
+        self.latency = latency
+        self.scale = scale
+        config, defaults = BoxConfig(box_console), BoxConfig.defaults['main']
+        self.compression = Compression(config.to_words(defaults['compress']),
+            config.to_size(defaults['compress_min_size']))
+
+    def run(self, names=None):
+        """Run the named scenarios (default: all) and return the results
+        as a dict ready to be dumped as JSON."""
+        scenarios = OrderedDict()
+        for name in names or SCENARIOS:
+            scenarios[name] = self.run_scenario(name)
+        return OrderedDict([
+            ('version', __version__),
+            ('python', platform.python_version()),
+            ('platform', platform.platform()),
+            ('workers', self.workers),
+            ('latency', self.latency),
+            ('scale', self.scale),
+            ('peak_rss', peak_rss()),
+            ('scenarios', scenarios),
+        ])
+
+    def run_scenario(self, name):
+        tmpdir = tempfile.mkdtemp(prefix='box-sync-bench-')
+        try:
+            dirs = dict((d, os.path.join(tmpdir, d)) for d in ('remote', 'local', 'copy'))
+            for path in dirs.values():
+                os.mkdir(path)
+            SCENARIOS[name](dirs['local'], self.scale)
+            files, size = tree_size(dirs['local'])
+            self.out.info("Benchmarking '%s': %d files, %d bytes" % (name, files, size))
+            server = DAVServer(dirs['remote'], latency=self.latency).start()
+            try:
+                index = StateIndex(':memory:')
+                result = OrderedDict([('files', files), ('bytes', size)])
+                result['upload'] = self.measure(server, dirs['local'], index, files)
+                result['rescan'] = self.measure(server, dirs['local'], index, files)
+                result['download'] = self.measure(server, dirs['copy'],
+                    StateIndex(':memory:'), files)
+            finally:
+                server.stop()
+            return result
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def measure(self, server, box_dir, index, files):
+        """Sync box_dir with the server once and return its figures."""
+        client = WebDAVClient(server.url, pool_size=self.workers, metrics=self.out.metrics,
+            compression=self.compression)
+        engine = SyncEngine(self.out, client, box_dir, self.workers, index,
+            hasher=Hasher(self.out))
+        server.reset_stats()
+        server.reset_traffic()
+        rss_reset = reset_peak_rss()
+        started = time.time()
+        try:
+            ok = engine.run()
+        finally:
+            elapsed = time.time() - started
+            engine.close()
+            client.close()
+        timings = server.reset_stats()
+        traffic = server.reset_traffic()
+        latencies = sorted(t for values in timings.values() for t in values)
+        transferred = engine.stats['bytes_up'] + engine.stats['bytes_down']
+        return OrderedDict([
+            ('ok', ok),
+            ('seconds', round(elapsed, 3)),
+            ('files_per_sec', round(files / elapsed, 1) if elapsed else None),
+            ('mb_per_sec', round(transferred / 1048576.0 / elapsed, 2) if elapsed else None),
+            ('bytes_copied', engine.stats['bytes_copied']),
+            ('wire_bytes', traffic['received'] + traffic['sent']),
+            # The server runs in this process too.
+            ('peak_rss', peak_rss() if rss_reset else None),
+            ('requests', OrderedDict((method, len(timings[method])) for method in sorted(timings))),
+            ('p50_ms', round(percentile(latencies, 50) * 1000, 2) if latencies else None),
+            ('p99_ms', round(percentile(latencies, 99) * 1000, 2) if latencies else None),
+        ])
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import fnmatch
+import mimetypes
+import os
+import tempfile
+import zlib
+
+SPOOL_SIZE = 4 * 1024 * 1024
+"""Compressed uploads up to this size are held in memory, larger ones in
+a temporary file."""
+
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+class Compression(object):
+    """
+    Decides which files are worth transferring gzip-compressed: those of at
+    least C{min_size} bytes whose extension (C{.csv}) or MIME type
+    (C{text/plain}, or C{text/*} for all text) is listed in C{types}.
+    Without types nothing is compressed.
+    """
+    def __init__(self, types=(), min_size=0):
+        self.extensions = frozenset(t.lower() for t in types if t.startswith('.'))
+        self.mimetypes = tuple(t.lower() for t in types if '/' in t)
+        self.min_size = min_size
+        if self.mimetypes and not mimetypes.inited:
+            # Loading the MIME types is not thread safe, transfers are.
+            mimetypes.init()
+
+    def __nonzero__(self):
+        return bool(self.extensions or self.mimetypes)
+
+    def worth(self, path, size=None):
+        if size is not None and size < self.min_size:
+            return False
+        if os.path.splitext(path)[1].lower() in self.extensions:
+            return True
+        if not self.mimetypes:
+            return False
+        mimetype = mimetypes.guess_type(path, strict=False)[0]
+        return mimetype is not None and any(fnmatch.fnmatchcase(mimetype, pattern)
+            for pattern in self.mimetypes)
+
+def gzip_file(f, blocksize=64 * 1024, level=6):
+    """
+    Compress what is left of the file object f into a gzip stream. Returns
+    a temporary file holding it, rewound, and its size.
+    """
+    out = tempfile.SpooledTemporaryFile(SPOOL_SIZE, prefix='box-sync-')
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    while True:
+        data = f.read(blocksize)
+        if not data:
+            break
+        out.write(compressor.compress(data))
+    out.write(compressor.flush())
+    size = out.tell()
+    out.seek(0)
+    return out, size
+
+def gunzip():
+    """A decompressor object for a gzip stream."""
+    return zlib.decompressobj(GZIP_WBITS)
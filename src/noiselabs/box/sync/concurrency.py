@@ -0,0 +1,179 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import threading
+import time
+
+THROTTLE_STATUSES = (429, 503)
+
+def configured_bounds(config, jobs=None):
+    """
+    The initial and maximum number of requests in flight, and whether the
+    limit adapts, for a L{ConfigSnapshot}. --jobs overrides 'workers'.
+    """
+    workers = jobs or config.workers
+    if config.adaptive_workers:
+        return workers, max(workers, config.max_workers), True
+    return workers, workers, False
+
+class AdaptiveConcurrency(object):
+    """
+    Bounds the number of requests in flight and adapts the bound with AIMD
+    (additive increase, multiplicative decrease).
+
+    Every answered request that came back about as fast as the quickest
+    ones seen so far raises the limit by 1/limit, i.e. by one per round of
+    requests. A response much slower than that baseline cuts the limit by
+    a quarter and a 429 or 503 halves it, at most once per C{cooldown}
+    seconds. A Retry-After header holds back every new request until it
+    expires. With adaptive=False the limit stays put and only Retry-After
+    is honoured.
+
+    Requests may carry a key (the account they are made for) when one
+    controller is shared. A free slot then goes to a waiting key with the
+    fewest requests in flight, so a busy account cannot starve the others.
+    """
+    cooldown = 1.0
+    tolerance = 2.0
+    slack = 0.01
+    history_size = 100
+
+    def __init__(self, initial=4, maximum=None, minimum=1, adaptive=True):
+        self.minimum = minimum
+        self.maximum = maximum or initial
+        self.adaptive = adaptive
+        self.limit = float(max(minimum, min(initial, self.maximum)))
+        self.inflight = 0
+        self.active = {}
+        self.waiting = {}
+        self.baseline = None
+        self.paused_until = 0
+        self.history = [(time.time(), int(self.limit), 'initial')]
+        self._last_decrease = 0
+        self._cond = threading.Condition()
+
+    @property
+    def size(self):
+        return int(self.limit)
+
+    def configure(self, initial, maximum=None, adaptive=True):
+        """
+        Change the bounds while requests are running. A fixed limit is set
+        right away; an adaptive one is only clamped to the new bounds and
+        keeps growing or shrinking from where it was.
+        """
+        with self._cond:
+            self.maximum = maximum or initial
+            self.adaptive = adaptive
+            limit = self.limit if adaptive else initial
+            self._set(float(max(self.minimum, min(limit, self.maximum))), time.time(), 'reconfigured')
+            self._cond.notify_all()
+
+    def acquire(self, key=None):
+        with self._cond:
+            self.waiting[key] = self.waiting.get(key, 0) + 1
+            try:
+                while True:
+                    wait = self.paused_until - time.time()
+                    if wait > 0:
+                        self._cond.wait(wait)
+                    elif self.inflight >= int(self.limit) or not self._turn(key):
+                        self._cond.wait()
+                    else:
+                        break
+            finally:
+                self.waiting[key] -= 1
+                if not self.waiting[key]:
+                    del self.waiting[key]
+            self.inflight += 1
+            self.active[key] = self.active.get(key, 0) + 1
+
+    def _turn(self, key):
+        mine = self.active.get(key, 0)
+        return all(self.active.get(other, 0) >= mine for other in self.waiting)
+
+    def release(self, latency=None, status=None, retry_after=None, key=None):
+        """
+        @param latency: seconds until the response headers arrived, or None
+            if that says nothing about the server's load (uploads)
+        @param status: the response status, or None if the request failed
+            without a response
+        @param key: the key given to L{acquire}
+        """
+        with self._cond:
+            self.inflight -= 1
+            self.active[key] -= 1
+            if not self.active[key]:
+                del self.active[key]
+            now = time.time()
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            if self.adaptive:
+                if status in THROTTLE_STATUSES:
+                    self._decrease(now, 0.5, 'throttled (%d)' % status)
+                elif status is not None:
+                    self._observe(now, latency)
+            self._cond.notify_all()
+
+    def _observe(self, now, latency):
+        if latency is None:
+            self._increase(now)
+            return
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        else:
+            # Let the baseline drift up so a permanently slower route does
+            # not look like congestion forever.
+            self.baseline *= 1.01
+        if latency > self.baseline * self.tolerance + self.slack:
+            self._decrease(now, 0.75, 'latency %.0fms' % (latency * 1000))
+        else:
+            self._increase(now)
+
+    def _increase(self, now):
+        if self.limit < self.maximum:
+            self._set(min(self.maximum, self.limit + 1.0 / self.limit), now, 'increase')
+
+    def _decrease(self, now, factor, reason):
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self._set(max(self.minimum, self.limit * factor), now, reason)
+
+    def _set(self, limit, now, reason):
+        changed = int(limit) != int(self.limit)
+        self.limit = limit
+        if changed:
+            self.history.append((now, int(limit), reason))
+            del self.history[:-self.history_size]
+
+    def summary(self):
+        """A one-line account of how the limit evolved."""
+        steps = []
+        for stamp, limit, reason in self.history:
+            if reason == 'increase' and steps and steps[-1][1] == 'increase':
+                steps[-1] = (limit, reason)
+            else:
+                steps.append((limit, reason))
+        return "limit %d (%s)" % (int(self.limit), ' -> '.join(
+            "%d" % limit if reason in ('increase', 'initial') else "%d [%s]" % (limit, reason)
+            for limit, reason in steps))
@@ -0,0 +1,230 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+
+import os
+import signal
+import threading
+import urlparse
+
+from noiselabs.box.config import BASEDIR
+from noiselabs.box.output import PrefixedConsole
+from noiselabs.box.sync.compression import Compression
+from noiselabs.box.sync.concurrency import AdaptiveConcurrency, configured_bounds
+from noiselabs.box.sync.engine import Cancelled, SyncEngine
+from noiselabs.box.sync.filters import PathFilter
+from noiselabs.box.sync.hashing import Hasher, HashCache
+from noiselabs.box.sync.index import StateIndex
+from noiselabs.box.sync.journal import Journal
+from noiselabs.box.sync.throttle import BandwidthLimiter
+from noiselabs.box.sync.transfer import Downloader
+from noiselabs.box.sync.watcher import IN_CLOSE_WRITE, IN_MOVED_TO, IN_ONLYDIR, Inotify, Watcher
+from noiselabs.box.sync.webdav import ConnectionPool, WebDAVClient
+
+class SyncTarget(object):
+    """
+    One folder served by a L{SyncDaemon}: a full sync followed by watching
+    for local changes, as 'box-sync watch' does, on a thread of its own.
+    The index and journal are opened on that thread and kept in statedir,
+    or in the default locations for the [main] folder.
+    """
+    def __init__(self, daemon, name, box_dir, client, statedir=None, exclude=()):
+        self.daemon = daemon
+        self.name = name
+        self.box_dir = box_dir
+        self.client = client
+        self.statedir = statedir
+        self.exclude = exclude
+        self.out = PrefixedConsole(daemon.out, '[%s] ' % name)
+        self.engine = None
+        self.downloader = None
+        self.watcher = None
+        self.stopped = False
+        self.failed = False
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name='box-sync-' + name)
+        self.thread.daemon = True
+
+    def path(self, filename):
+        return None if self.statedir is None else os.path.join(self.statedir, filename)
+
+    def run(self):
+        config = self.daemon.snapshot
+        index = journal = None
+        try:
+            if not os.path.isdir(self.box_dir):
+                os.makedirs(self.box_dir, 0775)
+            index = StateIndex(self.path('index.db'))
+            journal = Journal(self.path('journal.log'), metrics=self.out.metrics)
+            self.downloader = Downloader(self.client, config.chunk_size, config.chunk_parallel)
+            engine = SyncEngine(self.out, self.client, self.box_dir, self.client.pool.size,
+                index, self.downloader, self.daemon.hasher, journal, PathFilter(self.exclude))
+            with self._lock:
+                self.engine = engine
+                if self.stopped:
+                    return
+            if not self.engine.run():
+                self.out.warning("Sync incomplete, the next full sync will try again")
+            with self._lock:
+                if self.stopped:
+                    return
+                self.watcher = Watcher(self.out, self.engine, config.watch_delay,
+                    config.sync_interval)
+            self.watcher.run()
+        except Cancelled:
+            self.out.info("Stopped syncing '%s'" % self.box_dir)
+        except Exception as e:
+            self.failed = True
+            self.out.error("Stopped syncing '%s': %s" % (self.box_dir, e))
+        finally:
+            for resource in (self.engine, journal, index):
+                if resource is not None:
+                    resource.close()
+
+    def configure(self, snapshot):
+        """Apply the live options of a new L{ConfigSnapshot}."""
+        target = snapshot.targets.get(self.name, snapshot)
+        if target.exclude != self.exclude:
+            self.exclude = target.exclude
+            if self.engine is not None:
+                self.engine.filter = PathFilter(self.exclude)
+        if self.engine is not None:
+            self.engine.pool.resize(self.client.pool.size)
+        if self.downloader is not None:
+            self.downloader.parallel = snapshot.chunk_parallel
+        if self.watcher is not None:
+            self.watcher.configure(snapshot)
+
+    def stop(self):
+        """Stop watching and cancel the sync or push in progress, letting
+        the operations in flight finish."""
+        with self._lock:
+            self.stopped = True
+            if self.watcher is not None:
+                self.watcher.stop()
+            if self.engine is not None:
+                self.engine.cancel()
+
+class SyncDaemon(object):
+    """
+    Serves every folder of the configuration from one process: the one in
+    [main] (unless use_davfs is set) and one per [target:NAME] section.
+
+    Targets share what separate processes would compete for: one bandwidth
+    budget, one connection pool per server host, whose concurrency limit
+    hands free request slots to the targets with the fewest requests in
+    flight, and the hashing processes and cache.
+    """
+    def __init__(self, box_console, setup, jobs=None):
+        self.out = box_console
+        self.setup = setup
+        self.config = setup.config
+        self.jobs = jobs
+        self.snapshot = self.config.load()
+        self.limiter = BandwidthLimiter()
+        self.limiter.configure(self.snapshot)
+        self.pools = {}
+        self.hash_cache = HashCache()
+        self.hasher = Hasher(box_console, self.hash_cache, self.snapshot.hash_processes or None)
+        self.compression = Compression(self.snapshot.compress, self.snapshot.compress_min_size)
+        self.targets = []
+        folders = [(t, os.path.join(BASEDIR, 'targets', t.name)) for t in self.snapshot.targets.values()]
+        if not self.snapshot.use_davfs:
+            folders.insert(0, (self.snapshot, None))
+        for folder, statedir in folders:
+            name = getattr(folder, 'name', 'main')
+            username, password = setup.get_credentials(folder.dav_url, folder.box_dir)
+            client = WebDAVClient(folder.dav_url, username, password, limiter=self.limiter,
+                metrics=box_console.metrics, pool=self.pool_for(folder.dav_url), name=name,
+                compression=self.compression)
+            self.targets.append(SyncTarget(self, name, folder.box_dir, client, statedir,
+                folder.exclude))
+
+    def pool_for(self, url):
+        """The connection pool shared by every target on url's host."""
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        if key not in self.pools:
+            initial, maximum, adaptive = configured_bounds(self.snapshot, self.jobs)
+            self.pools[key] = ConnectionPool(url, AdaptiveConcurrency(initial, maximum,
+                adaptive=adaptive))
+        return self.pools[key]
+
+    def configure(self, snapshot, previous=None):
+        self.snapshot = snapshot
+        initial, maximum, adaptive = configured_bounds(snapshot, self.jobs)
+        for pool in self.pools.values():
+            pool.concurrency.configure(initial, maximum, adaptive)
+        self.limiter.configure(snapshot)
+        for target in self.targets:
+            target.configure(snapshot)
+
+    def run(self):
+        """
+        Run every target until interrupted. On SIGINT or SIGTERM the
+        operations in flight are finished first and the rest of the syncs
+        dropped; a second signal quits right away and the journal takes
+        care of what was left half done. Returns
+        False if a target stopped because of an error.
+        """
+        if not self.targets:
+            self.out.error("Nothing to serve: set 'use_davfs = false' or add [target:NAME] "
+                "sections to %s." % self.config.filepath)
+            return False
+        self.config.subscribe(self.configure)
+        signal.signal(signal.SIGHUP, lambda signum, frame: self.config.reload())
+        inotify = Inotify()
+        inotify.add_watch(os.path.dirname(self.config.filepath),
+            IN_CLOSE_WRITE | IN_MOVED_TO | IN_ONLYDIR)
+        filename = os.path.basename(self.config.filepath)
+        self.out.info("Serving %d folders: %s" % (len(self.targets),
+            ', '.join("%s (%s)" % (t.name, t.box_dir) for t in self.targets)))
+        for target in self.targets:
+            target.thread.start()
+        try:
+            while any(t.thread.is_alive() for t in self.targets):
+                if any(name == filename for wd, mask, cookie, name in inotify.read(1.0)):
+                    self.config.reload()
+        except SystemExit:
+            self.out.info("Finishing the operations in flight, press Control-C again to quit now...")
+            self.stop()
+            raise
+        finally:
+            inotify.close()
+        self.close()
+        return not any(t.failed for t in self.targets)
+
+    def stop(self):
+        for target in self.targets:
+            target.stop()
+        for target in self.targets:
+            while target.thread.is_alive():
+                target.thread.join(0.5)
+        self.close()
+
+    def close(self):
+        for target in self.targets:
+            target.client.close()
+        for pool in self.pools.values():
+            pool.close()
+        self.hasher.close()
+        self.hash_cache.close()
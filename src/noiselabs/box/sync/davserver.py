@@ -0,0 +1,492 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+A small, self-contained WebDAV server serving a local directory. It stands
+in for the Box.com WebDAV endpoint so the sync engine can be exercised end
+to end without network access:
+
+    $ python -m noiselabs.box.sync.davserver /tmp/remote 8080
+"""
+
+from __future__ import print_function
+
+import BaseHTTPServer
+import email.utils
+import os
+import re
+import shutil
+import socket
+import SocketServer
+import sys
+import threading
+import time
+import urllib
+import urlparse
+import zlib
+
+from xml.sax.saxutils import escape
+
+class DAVRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Implements the subset of RFC 4918 used by box-sync."""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    blocksize = 64 * 1024
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def parse_request(self):
+        self.admitted = False
+        self.started = time.time()
+        self.server.begin()
+        if not BaseHTTPServer.BaseHTTPRequestHandler.parse_request(self):
+            return False
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if not self.server.admit():
+            self.read_body()
+            self.send_status(503, headers={'Retry-After': '1'})
+            return False
+        self.admitted = True
+        return True
+
+    def handle_one_request(self):
+        self.started = None
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.handle_one_request(self)
+        finally:
+            if getattr(self, 'admitted', False):
+                self.admitted = False
+                self.server.leave()
+            if self.started is not None:
+                self.server.record(getattr(self, 'command', None), time.time() - self.started)
+
+    def fs_path(self, uri=None):
+        path = urllib.unquote(urlparse.urlsplit(uri or self.path).path)
+        prefix = self.server.prefix
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+        parts = [p for p in path.split('/') if p and p not in ('.', '..')]
+        return os.path.join(self.server.root, *parts)
+
+    def href(self, fs_path):
+        rel = os.path.relpath(fs_path, self.server.root)
+        rel = '' if rel == os.curdir else rel.replace(os.sep, '/')
+        href = self.server.prefix + '/' + rel
+        if os.path.isdir(fs_path) and not href.endswith('/'):
+            href += '/'
+        return urllib.quote(href)
+
+    def etag(self, st):
+        return '"%x-%x"' % (st.st_size, int(st.st_mtime * 1000000))
+
+    def etag_matches(self, header, etag, weak=False):
+        """Whether an If-Match/If-None-Match header value matches etag."""
+        if etag is None:
+            return False
+        if header.strip() == '*':
+            return True
+        tags = [tag.strip() for tag in header.split(',')]
+        if weak:
+            tags = [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+        return etag in tags
+
+    def not_modified(self, st, etag):
+        """Evaluates If-None-Match or, without it, If-Modified-Since."""
+        value = self.headers.get('If-None-Match')
+        if value is not None:
+            return self.etag_matches(value, etag, weak=True)
+        since = email.utils.parsedate_tz(self.headers.get('If-Modified-Since') or '')
+        return since is not None and int(st.st_mtime) <= email.utils.mktime_tz(since)
+
+    def send_status(self, code, body='', headers=None):
+        self.send_response(code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+            self.server.count('sent', len(body))
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.server.count('received', length)
+        return self.rfile.read(length) if length else ''
+
+    def wants_gzip(self):
+        """Whether the client accepts a gzip-compressed response."""
+        codings = [c.split(';')[0].strip().lower()
+            for c in (self.headers.get('Accept-Encoding') or '').split(',')]
+        return self.server.gzip and 'gzip' in codings
+
+    def do_OPTIONS(self):
+        headers = {'DAV': '1', 'Allow': ', '.join(self.server.methods)}
+        if self.server.gzip:
+            headers['Accept-Encoding'] = 'gzip'
+        self.send_status(200, headers=headers)
+
+    def do_PROPFIND(self):
+        self.read_body()
+        path = self.fs_path()
+        if not os.path.exists(path):
+            return self.send_status(404)
+        depth = self.headers.get('Depth', '1')
+        paths = [path]
+        if depth != '0' and os.path.isdir(path):
+            paths += [os.path.join(path, name) for name in sorted(os.listdir(path))]
+        body = ['<?xml version="1.0" encoding="utf-8"?>\n<D:multistatus xmlns:D="DAV:">']
+        for p in paths:
+            body.append(self.propstat(p))
+        body.append('</D:multistatus>\n')
+        self.send_status(207, ''.join(body), {'Content-Type': 'application/xml; charset="utf-8"'})
+
+    def propstat(self, path):
+        st = os.stat(path)
+        if os.path.isdir(path):
+            props = '<D:resourcetype><D:collection/></D:resourcetype>'
+        else:
+            props = ('<D:resourcetype/><D:getcontentlength>%d</D:getcontentlength>'
+                '<D:getetag>%s%s</D:getetag>' % (st.st_size, 'W/' if self.server.weak_etags else '',
+                escape(self.etag(st))))
+        props += '<D:getlastmodified>%s</D:getlastmodified>' % \
+            email.utils.formatdate(st.st_mtime, usegmt=True)
+        return ('<D:response><D:href>%s</D:href><D:propstat><D:prop>%s</D:prop>'
+            '<D:status>HTTP/1.1 200 OK</D:status></D:propstat></D:response>' %
+            (escape(self.href(path)), props))
+
+    def parse_range(self, size, etag):
+        """Returns the (start, end) of a satisfiable single byte range, or
+        None to send the whole entity."""
+        value = self.headers.get('Range')
+        if not value or not self.server.ranges:
+            return None
+        if_range = self.headers.get('If-Range')
+        if if_range and if_range != etag:
+            return None
+        match = re.match(r'bytes=(\d*)-(\d*)$', value.strip())
+        if not match or not any(match.groups()):
+            return None
+        start, end = match.groups()
+        if not start:
+            start, end = max(0, size - int(end)), size - 1
+        else:
+            start, end = int(start), min(int(end), size - 1) if end else size - 1
+        if start > end:
+            return None
+        return start, end
+
+    def do_GET(self):
+        path = self.fs_path()
+        if not os.path.isfile(path):
+            return self.send_status(404)
+        st = os.stat(path)
+        etag = self.etag(st)
+        if self.not_modified(st, etag):
+            return self.send_status(304, headers={'ETag': etag})
+        byte_range = self.parse_range(st.st_size, etag)
+        if byte_range is None and self.wants_gzip():
+            return self.send_gzip(path, st, etag)
+        if byte_range is None:
+            start, end = 0, st.st_size - 1
+            self.send_response(200)
+        else:
+            start, end = byte_range
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, st.st_size))
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', email.utils.formatdate(st.st_mtime, usegmt=True))
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = f.read(min(remaining, self.blocksize))
+                if not data:
+                    break
+                self.wfile.write(data)
+                self.server.count('sent', len(data))
+                remaining -= len(data)
+
+    def send_gzip(self, path, st, etag):
+        """Send a file compressed on the fly, in chunks as its length is
+        not known up front. Like most servers, the ETag is made weak."""
+        self.send_response(200)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('ETag', 'W/' + etag)
+        self.send_header('Last-Modified', email.utils.formatdate(st.st_mtime, usegmt=True))
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(self.blocksize)
+                if not data:
+                    break
+                self.send_chunk(compressor.compress(data))
+        self.send_chunk(compressor.flush())
+        self.wfile.write('0\r\n\r\n')
+
+    def send_chunk(self, data):
+        if data:
+            self.wfile.write('%x\r\n%s\r\n' % (len(data), data))
+            self.server.count('sent', len(data))
+
+    do_HEAD = do_GET
+
+    def do_PUT(self):
+        path = self.fs_path()
+        if not os.path.isdir(os.path.dirname(path)):
+            self.read_body()
+            return self.send_status(409)
+        existed = os.path.exists(path)
+        etag = self.etag(os.stat(path)) if existed else None
+        if_match, if_none_match = self.headers.get('If-Match'), self.headers.get('If-None-Match')
+        if (if_match is not None and not self.etag_matches(if_match, etag)) or \
+                (if_none_match is not None and self.etag_matches(if_none_match, etag)):
+            self.read_body()
+            return self.send_status(412)
+        # Compressed uploads are stored inflated (RFC 7694).
+        encoding = (self.headers.get('Content-Encoding') or 'identity').lower()
+        if encoding not in ('identity', 'gzip') or (encoding == 'gzip' and not self.server.gzip):
+            self.read_body()
+            return self.send_status(415, headers={'Accept-Encoding': 'identity'})
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if encoding == 'gzip' else None
+        remaining = int(self.headers.get('Content-Length') or 0)
+        with open(path, 'wb') as f:
+            while remaining > 0:
+                data = self.rfile.read(min(remaining, self.blocksize))
+                if not data:
+                    break
+                self.server.count('received', len(data))
+                remaining -= len(data)
+                f.write(decompressor.decompress(data) if decompressor else data)
+            if decompressor:
+                f.write(decompressor.flush())
+        self.send_status(204 if existed else 201, headers={'ETag': self.etag(os.stat(path))})
+
+    def do_MKCOL(self):
+        self.read_body()
+        path = self.fs_path()
+        if os.path.exists(path):
+            return self.send_status(405)
+        if not os.path.isdir(os.path.dirname(path)):
+            return self.send_status(409)
+        os.mkdir(path)
+        self.send_status(201)
+
+    def do_DELETE(self):
+        path = self.fs_path()
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        else:
+            return self.send_status(404)
+        self.send_status(204)
+
+    def destination(self):
+        """The local path named by the Destination header, or None if it
+        points to another server."""
+        value = self.headers.get('Destination')
+        if not value:
+            return None
+        parts = urlparse.urlsplit(value)
+        if parts.netloc and parts.netloc != self.headers.get('Host'):
+            return None
+        if not urllib.unquote(parts.path).startswith(self.server.prefix + '/'):
+            return None
+        return self.fs_path(value)
+
+    def copy_or_move(self, move):
+        self.read_body()
+        source, target = self.fs_path(), self.destination()
+        if not os.path.exists(source):
+            return self.send_status(404)
+        if_match = self.headers.get('If-Match')
+        if if_match is not None and not self.etag_matches(if_match, self.etag(os.stat(source))):
+            return self.send_status(412)
+        if target is None or target == source or target == self.server.root:
+            return self.send_status(403 if target else 400)
+        if not os.path.isdir(os.path.dirname(target)):
+            return self.send_status(409)
+        existed = os.path.exists(target)
+        if existed:
+            if self.headers.get('Overwrite', 'T').upper() == 'F':
+                return self.send_status(412)
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+            else:
+                os.remove(target)
+        if move:
+            os.rename(source, target)
+        elif not os.path.isdir(source):
+            shutil.copyfile(source, target)
+        elif self.headers.get('Depth', 'infinity') == '0':
+            os.mkdir(target)
+        else:
+            shutil.copytree(source, target)
+        self.send_status(204 if existed else 201)
+
+    def do_MOVE(self):
+        self.copy_or_move(move=True)
+
+    def do_COPY(self):
+        self.copy_or_move(move=False)
+
+class DAVServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Serves root under the /dav prefix. Use port 0 to pick a free port and
+    start() to run it on a background thread. With ranges=False Range
+    headers are ignored, like some servers do, and with gzip=False
+    compressed transfers are refused. weak_etags makes listings report weak
+    ETags, like Apache does for files modified within the last second, while
+    other responses keep strong ones. latency delays every
+    request by that many seconds and max_concurrent makes the server answer
+    503 with a Retry-After once more requests than that are being served.
+
+    The time spent serving every request is recorded by method, and the
+    body bytes received and sent are counted; see reset_stats() and
+    reset_traffic().
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    methods = ['OPTIONS', 'PROPFIND', 'GET', 'HEAD', 'PUT', 'MKCOL', 'MOVE', 'COPY',
+        'DELETE']
+
+    def __init__(self, root, port=0, host='127.0.0.1', prefix='/dav', verbose=False,
+            ranges=True, latency=0, max_concurrent=None, gzip=True, weak_etags=False):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), DAVRequestHandler)
+        self.root = os.path.abspath(root)
+        self.ranges = ranges
+        self.gzip = gzip
+        self.weak_etags = weak_etags
+        self.latency = latency
+        self.max_concurrent = max_concurrent
+        self.active = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._recorded = threading.Condition(self._lock)
+        self._serving = 0
+        self.prefix = prefix.rstrip('/')
+        self.verbose = verbose
+        self._thread = None
+        self._sockets = set()
+        self._timings = {}
+        self._traffic = {'received': 0, 'sent': 0}
+
+    def admit(self):
+        with self._lock:
+            if self.max_concurrent and self.active >= self.max_concurrent:
+                self.rejected += 1
+                return False
+            self.active += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.active -= 1
+
+    def begin(self):
+        with self._lock:
+            self._serving += 1
+
+    def record(self, method, seconds):
+        with self._lock:
+            if method:
+                self._timings.setdefault(method, []).append(seconds)
+            self._serving -= 1
+            self._recorded.notify_all()
+
+    def count(self, direction, amount):
+        with self._lock:
+            self._traffic[direction] += amount
+
+    def reset_traffic(self):
+        """Returns the number of body bytes received and sent since the
+        last call, as a dict."""
+        with self._lock:
+            traffic, self._traffic = self._traffic, {'received': 0, 'sent': 0}
+        return traffic
+
+    def reset_stats(self, timeout=1.0):
+        """Returns a dict mapping every method served since the last call
+        to the list of seconds each of its requests took. A request is
+        recorded after its response has been sent, so this waits up to
+        timeout seconds for the requests being served to be recorded."""
+        deadline = time.time() + timeout
+        with self._lock:
+            while self._serving and time.time() < deadline:
+                self._recorded.wait(deadline - time.time())
+            timings, self._timings = self._timings, {}
+        return timings
+
+    def process_request(self, request, client_address):
+        self._sockets.add(request)
+        SocketServer.ThreadingMixIn.process_request(self, request, client_address)
+
+    def shutdown_request(self, request):
+        self._sockets.discard(request)
+        BaseHTTPServer.HTTPServer.shutdown_request(self, request)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://%s:%d%s' % (host, port, self.prefix)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='davserver')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        # Keep-alive connections would otherwise keep their threads around.
+        for request in list(self._sockets):
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+if __name__ == '__main__':
+    root = sys.argv[1] if len(sys.argv) > 1 else os.getcwd()
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8080
+    server = DAVServer(root, port, verbose=True)
+    print("Serving %s at %s" % (server.root, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
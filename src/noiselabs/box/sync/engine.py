@@ -0,0 +1,879 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import errno
+import hashlib
+import os
+import shutil
+import stat
+import threading
+import time
+
+from noiselabs.box.sync.filters import PathFilter
+from noiselabs.box.sync.hashing import HASH_ALGORITHM, Hasher, hash_file
+from noiselabs.box.sync.index import IndexEntry, StateIndex
+from noiselabs.box.sync.listing import RemoteWalker
+from noiselabs.box.sync.moves import find_moves, named, pair, rekey, under
+from noiselabs.box.sync.scanner import LocalEntry, LocalScanner
+from noiselabs.box.sync.transfer import TEMP_SUFFIXES, Downloader
+from noiselabs.box.sync.webdav import NotModified, WebDAVError, conditional_headers, weak_match
+from noiselabs.box.sync.workers import WorkerPool
+
+ACTIONS = ['remove', 'delete', 'mkdir', 'mkcol', 'rename', 'move', 'get', 'put']
+
+MIN_COPY_SIZE = 64 * 1024
+"""Smaller files are uploaded even when the server holds a copy already,
+as a COPY is not much cheaper than such a PUT."""
+
+class Cancelled(Exception):
+    """Raised by a sync stopped with L{SyncEngine.cancel}."""
+
+def parents(path):
+    """Yields every ancestor of a relative path, closest first."""
+    while '/' in path:
+        path = path.rsplit('/', 1)[0]
+        yield path
+
+class SyncEngine(object):
+    """
+    Synchronizes box_dir with the WebDAV server without going through a
+    davfs2 mount. Listing and transfers run concurrently on a pool of worker
+    threads sharing the client's keep-alive connections.
+
+    Both listings are compared against a L{StateIndex} holding the state of
+    every path after the previous run: only entries whose local stat or
+    remote ETag moved since then are transferred, and entries that vanished
+    from one side are deleted from the other. Paths unknown to the index
+    are considered in sync when both copies have the same size and either
+    the same modification time or the same content; otherwise, as when a
+    file changed on both sides, the most recent copy wins.
+
+    Requests are conditional wherever the index allows: downloads the
+    listing cannot rule out as unnecessary (it gave no ETag, or one only
+    weakly different from the indexed one) send the validators of the copy
+    already held and are skipped on 304, and uploads only replace the
+    remote version the plan was based on, leaving concurrent remote
+    changes for the next run.
+
+    Files and directories renamed or moved on one side are moved on the
+    other one as well, with a single request for a directory moved as a
+    whole, instead of being deleted and transferred again. Local moves are
+    told by the inode, or by the content hash when the inode changed;
+    remote ones by the ETag, or by size and modification time.
+
+    New files whose content, according to the index, is already stored on
+    the server under another path are copied there instead of uploaded.
+
+    With a L{Journal} every operation is logged as it is planned and
+    completed, so an interrupted run can be recovered without redoing
+    finished transfers.
+
+    Paths excluded by C{filter}, a L{PathFilter}, are left alone on both
+    sides: excluded directories are not even listed. The filter may be
+    replaced between runs.
+
+    A sync running on another thread is stopped with L{cancel}.
+    """
+    def __init__(self, box_console, client, box_dir, workers=4, index=None, downloader=None,
+            hasher=None, journal=None, filter=None):
+        self.out = box_console
+        self.client = client
+        self.box_dir = box_dir
+        self.index = index if index is not None else StateIndex(':memory:')
+        self.downloader = downloader if downloader is not None else Downloader(client)
+        self.hasher = hasher if hasher is not None else Hasher(box_console, processes=1)
+        self.journal = journal
+        self.filter = filter if filter is not None else PathFilter()
+        self.pool = WorkerPool(workers)
+        self.cancelled = threading.Event()
+        self._recovering = False
+        self.stats = dict.fromkeys(ACTIONS + ['bytes_down', 'bytes_up', 'errors', 'conditional',
+            'not_modified', 'bytes_saved', 'conflicts', 'bytes_moved', 'copy', 'bytes_copied'], 0)
+        self._lock = threading.Lock()
+        self._cached = {}
+        self._expected = {}
+        self._listed = None
+        self._synced = []
+        self._forgotten = []
+        self._downloaded = []
+        self._uploaded = {}
+
+    def local_path(self, path):
+        return os.path.join(self.box_dir, *path.split('/'))
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def run(self):
+        """Perform a full synchronization. Returns True if every operation
+        succeeded."""
+        started = time.time()
+        if not self.index.bind(self.box_dir, self.client.url):
+            self.out.warning("The sync index belonged to another directory or server and was reset.")
+            if self.journal is not None:
+                self.journal.checkpoint()
+        self.recover()
+        self.generation = self.index.begin_generation()
+        before = dict(self.stats)
+        try:
+            with self.out.span('sync.list_remote'):
+                remote = self.list_remote()
+            if self.stats['errors'] > before['errors']:
+                self.out.error("Failed to list remote files, nothing was synchronized.")
+                return False
+            with self.out.span('disk.scan'):
+                local = self.list_local()
+            self._check_cancelled()
+            if self.stats['errors'] > before['errors']:
+                # Whatever is below an unreadable directory would look like
+                # it had been deleted locally.
+                self.out.error("Failed to scan local files, nothing was synchronized.")
+                return False
+            indexed = self.index.load()
+            self.out.debug("Found %d remote, %d local and %d indexed entries" %
+                (len(remote), len(local), len(indexed)))
+            if indexed and not (local and remote):
+                # Most likely an unmounted disk or a wrong URL rather than
+                # somebody deleting everything.
+                self.out.error("One side of the sync is empty, refusing to delete everything from the other.")
+                return False
+            with self.out.span('sync.plan'):
+                actions = self.plan(local, remote, indexed)
+            self.execute(actions)
+        except BaseException:
+            self.drain()
+            raise
+        finally:
+            self.save_index()
+        done = dict((key, self.stats[key] - before[key]) for key in self.stats)
+        self.out.info("Sync finished in %.1fs: %d downloaded (%d bytes), %d uploaded (%d bytes), "
+            "%d deleted, %d errors" % (time.time() - started, done['get'], done['bytes_down'],
+            done['put'], done['bytes_up'], done['remove'] + done['delete'], done['errors']))
+        if done['move'] or done['rename']:
+            self.out.info("Moves: %d on the server and %d local, %d bytes not transferred again" %
+                (done['move'], done['rename'], done['bytes_moved']))
+        if done['copy']:
+            self.out.info("Server-side copies: %d files, %d bytes not uploaded" %
+                (done['copy'], done['bytes_copied']))
+        if done['conditional']:
+            self.out.info("Conditional downloads: %d of %d not modified (%.0f%% hit ratio), "
+                "%d bytes saved" % (done['not_modified'], done['conditional'],
+                100.0 * done['not_modified'] / done['conditional'], done['bytes_saved']))
+        if done['conflicts']:
+            self.out.warning("%d uploads were skipped because the server copy changed meanwhile, "
+                "they will be resolved on the next sync" % done['conflicts'])
+        self.hasher.report()
+        self.out.debug("Concurrency: %s" % self.client.pool.concurrency.summary())
+        return done['errors'] == 0
+
+    def close(self):
+        self.pool.close()
+        self.hasher.close()
+
+    def cancel(self):
+        """
+        Stop the sync or push running on another thread: operations not
+        started yet are dropped, those in flight finish and are recorded,
+        and the run raises L{Cancelled} at its next step. The engine is
+        not meant to run again afterwards.
+        """
+        self.cancelled.set()
+        self.pool.cancel()
+
+    def _check_cancelled(self):
+        if self.cancelled.is_set():
+            raise Cancelled("Sync of '%s' cancelled" % self.box_dir)
+
+    def _join(self):
+        if self.cancelled.is_set():
+            # Operations submitted since cancel() are dropped too.
+            self.pool.cancel()
+        self._report(self.pool.join())
+        self._check_cancelled()
+
+    def drain(self):
+        """
+        Stop starting new operations and wait for those in flight, so they
+        can be recorded before the process exits.
+        """
+        running = self.pool.cancel()
+        if running:
+            self.out.warning("Interrupted, waiting for %d operations in flight to finish..." % running)
+        self._report(self.pool.join())
+
+    def recover(self):
+        """
+        Apply the work completed by an interrupted run to the index and
+        finish the local changes it was pushing when it stopped.
+        """
+        if self.journal is None:
+            return
+        done, pending = self.journal.recover()
+        if not (done or pending):
+            return
+        self.out.info("Recovering an interrupted sync: %d operations completed, %d unfinished" %
+            (len(done), len(pending)))
+        for path, entry in done:
+            if entry is None:
+                self.index.remove([path])
+            else:
+                self.index.update([entry])
+        self.index.commit()
+        self.journal.checkpoint()
+        # Remote changes are picked up by the next full listing; local ones
+        # may only be known from the watcher events that led to them.
+        pushed = [path for action, path in pending if action in ('put', 'mkcol', 'delete')]
+        if pushed:
+            self._recovering = True
+            try:
+                self.push(pushed)
+            finally:
+                self._recovering = False
+
+    def push(self, paths):
+        """
+        Propagate local changes to the given paths without listing either
+        tree. Used by the watcher, whose events already tell what may have
+        changed.
+        """
+        self.generation = self.index.begin_generation()
+        errors = self.stats['errors']
+        actions = dict((name, []) for name in ACTIONS)
+        self._cached = {}
+        self._listed = None
+        try:
+            pairs = [(path, self.stat_local(path), self.index.get(path)) for path in sorted(set(paths))]
+            if self.filter:
+                # Patterns ending in '/' only match directories, which a
+                # deleted path can only be told to be by its index entry.
+                pairs = [(path, l, i) for path, l, i in pairs
+                    if not self.filter.excludes(path, (l or i).is_dir if l or i else False)]
+            actions['move'] = self.find_pushed_moves(pairs)
+            moved = dict((e.path, e) for move in actions['move'] for e in move.entries)
+            if moved:
+                sources = set(move.src for move in actions['move'])
+                pairs = [(path, l, moved.get(path, i)) for path, l, i in pairs
+                    if not under(path, sources)]
+            # Uploads must replace the last synchronized remote version.
+            self._expected = dict((path, i) for path, l, i in pairs)
+            touched = self.touched_only([(l, i) for path, l, i in pairs if l and i])
+            for path, l, i in pairs:
+                if l is None:
+                    if i is not None:
+                        actions['delete'].append(i)
+                elif path in touched:
+                    self._record(path, False, l, i.etag, i.hash)
+                elif i is None or self.local_changed(l, i):
+                    actions['mkcol' if l.is_dir else 'put'].append(l)
+            # New files may land in directories the server does not know yet.
+            creating = set(entry.path for entry in actions['mkcol'])
+            for entry in actions['put'] + actions['mkcol'] + actions['move']:
+                for parent in parents(entry.path):
+                    if parent in creating or parent in moved or self.index.get(parent) is not None:
+                        break
+                    creating.add(parent)
+                    actions['mkcol'].append(self.stat_local(parent))
+            self._keep_parents(actions, 'delete', 'mkdir', [])
+            self.execute(actions)
+        except BaseException:
+            self.drain()
+            raise
+        finally:
+            self.save_index()
+        return self.stats['errors'] == errors
+
+    def stat_local(self, path):
+        if path.endswith(TEMP_SUFFIXES):
+            return None
+        try:
+            st = os.stat(self.local_path(path))
+        except OSError:
+            return None
+        if stat.S_ISDIR(st.st_mode):
+            return LocalEntry(path, True, 0, None, None)
+        return LocalEntry(path, False, st.st_size, st.st_mtime, st.st_ino)
+
+    def save_index(self):
+        with self._lock:
+            synced, self._synced = self._synced, []
+            forgotten, self._forgotten = self._forgotten, []
+        with self.out.span('index.save'):
+            self.index.remove(forgotten)
+            self.index.update(synced)
+            self.index.commit()
+            if self.journal is not None:
+                self.journal.checkpoint()
+
+    def _record(self, path, is_dir, st=None, etag=None, digest=None):
+        if st is None:
+            entry = IndexEntry(path, is_dir, 0, None, None, etag, digest, self.generation)
+        else:
+            entry = IndexEntry(path, is_dir, st.size, st.mtime, st.inode, etag, digest, self.generation)
+        with self._lock:
+            self._synced.append(entry)
+        if self.journal is not None:
+            self.journal.done(self.generation, path, entry)
+
+    def _forget(self, path):
+        with self._lock:
+            self._forgotten.append(path)
+        if self.journal is not None:
+            self.journal.done(self.generation, path)
+
+    def list_remote(self):
+        """
+        Walk the remote tree issuing one Depth:1 PROPFIND per collection,
+        with as many requests in flight as there are workers.
+        """
+        walker = RemoteWalker(self.client, self.pool.size)
+        entries = {}
+        for entry in walker.walk(filter=self.filter):
+            self._check_cancelled()
+            entries[entry.path] = entry
+        for path, e in walker.errors:
+            self.out.error("Failed to list '%s': %s" % (path, e))
+            self._count('errors')
+        self.out.debug("Listed %s" % walker.report())
+        self._report_pruned('remote')
+        return entries
+
+    def list_local(self):
+        """
+        Scan box_dir reading as many directories at once as there are
+        workers. Directories that cannot be read are counted as errors.
+        """
+        scanner = LocalScanner(self.box_dir, self.pool.size, self.filter)
+        entries = dict((entry.path, entry) for entry in scanner.scan())
+        for path, e in scanner.errors:
+            self.out.error("Failed to scan '%s': %s" % (path or self.box_dir, e))
+            self._count('errors')
+        self.out.debug("Scanned %s" % scanner.report())
+        self._report_pruned('local')
+        return entries
+
+    def _report_pruned(self, side):
+        pruned = self.filter.report()
+        if pruned:
+            self.out.debug("Excluded from the %s listing: %s" % (side, pruned))
+
+    def local_changed(self, l, i):
+        return l.is_dir != i.is_dir or (not l.is_dir and
+            (l.size, l.mtime, l.inode) != (i.size, i.mtime, i.inode))
+
+    def touched_only(self, pairs):
+        """
+        Of the given (local, indexed) pairs, return the paths whose stat
+        changed while their content did not, like files that were merely
+        touched or rewritten with the same data.
+        """
+        suspects = dict((self.local_path(l.path), i) for l, i in pairs
+            if i.hash and not l.is_dir and l.size == i.size and self.local_changed(l, i))
+        if not suspects:
+            return set()
+        hashes = self.hasher.hash_files(suspects.keys())
+        return set(i.path for path, i in suspects.items() if hashes.get(path) == i.hash)
+
+    def remote_changed(self, r, i):
+        return r.is_dir != i.is_dir or (not r.is_dir and r.etag != i.etag)
+
+    def plan(self, local, remote, indexed):
+        """
+        Compare both listings with the index and decide what to do with
+        every path. Returns a dict mapping an action name to a sorted list of
+        entries: C{remove} and C{delete} hold local and remote deletions,
+        the other actions are named after the operation they perform.
+        """
+        actions = dict((name, []) for name in ACTIONS)
+        self._cached = {}
+        actions['move'] = self.find_local_moves(local, remote, indexed)
+        actions['rename'] = self.find_remote_moves(local, remote, indexed)
+        touched = self.touched_only([(l, indexed[path]) for path, l in local.items() if path in indexed])
+        unindexed = []
+        for path in sorted(set(local) | set(remote) | set(indexed)):
+            l, r, i = local.get(path), remote.get(path), indexed.get(path)
+            if l is None and r is None:
+                self._forget(path)
+            elif l is None:
+                if i is not None and not self.remote_changed(r, i):
+                    actions['delete'].append(r)
+                else:
+                    actions['mkdir' if r.is_dir else 'get'].append(r)
+            elif r is None:
+                if i is not None and (path in touched or not self.local_changed(l, i)):
+                    actions['remove'].append(l)
+                else:
+                    actions['mkcol' if l.is_dir else 'put'].append(l)
+            elif l.is_dir != r.is_dir:
+                self.out.warning("Skipping '%s': it is a file on one side and a directory on the other" % path)
+            elif l.is_dir:
+                if i is None:
+                    self._record(path, True)
+            else:
+                lchanged = i is None or (path not in touched and self.local_changed(l, i))
+                rchanged = i is None or self.remote_changed(r, i)
+                if i is None and l.size == r.size:
+                    unindexed.append((l, r))
+                elif lchanged and rchanged:
+                    if i is not None:
+                        self.out.warning("'%s' changed on both sides, keeping the most recent copy" % path)
+                    self._keep_newest(actions, l, r)
+                elif lchanged:
+                    actions['put'].append(l)
+                elif rchanged:
+                    actions['get'].append(r)
+                    if r.etag is None or weak_match(r.etag, i.etag):
+                        # Otherwise the listing already tells the server
+                        # holds another version, and a 304 is impossible.
+                        self._cached[path] = i
+                elif path in touched:
+                    self._record(path, False, l, i.etag, i.hash)
+        same = self.same_content(unindexed)
+        for l, r in unindexed:
+            if l.path in same:
+                self._record(l.path, False, l, r.etag, same[l.path])
+            else:
+                self.out.warning("'%s' differs between both sides, keeping the most recent copy" % l.path)
+                self._keep_newest(actions, l, r)
+        self._keep_parents(actions, 'remove', 'mkcol', ['mkcol', 'move', 'put'])
+        self._keep_parents(actions, 'delete', 'mkdir', ['mkdir', 'rename', 'get'])
+        self._expected = dict((entry.path, remote.get(entry.path)) for entry in actions['put'])
+        self._listed = remote
+        return actions
+
+    def _keep_newest(self, actions, l, r):
+        if r.mtime is None or l.mtime > r.mtime:
+            actions['put'].append(l)
+        else:
+            actions['get'].append(r)
+
+    def same_content(self, pairs):
+        """
+        Of the given (local, remote) pairs of files of the same size found
+        on both sides but not in the index, as on a first sync, return the
+        paths holding the same content on both, mapped to its hash (None
+        when not computed). Files with the same modification time are taken
+        to be the same; the others are compared by hash, which means
+        reading the remote file.
+        """
+        same = {}
+        unsure = []
+        for l, r in pairs:
+            if r.mtime is not None and int(l.mtime) == int(r.mtime):
+                same[l.path] = None
+            else:
+                unsure.append(l.path)
+        if unsure:
+            hashes = self.hasher.hash_files([self.local_path(path) for path in unsure])
+            for path in unsure:
+                digest = hashes.get(self.local_path(path))
+                try:
+                    if digest is not None and self._remote_hash(path) == digest:
+                        same[path] = digest
+                except (WebDAVError, IOError, OSError) as e:
+                    self.out.debug("Could not compare '%s' with the server: %s" % (path, e))
+        return same
+
+    def find_local_moves(self, local, remote, indexed):
+        """
+        Find the entries moved inside box_dir since the last run, among
+        those that did not change on the server meanwhile, and rewrite
+        remote and indexed as if they had been moved there already.
+        Returns the L{Move}s to make on the server.
+        """
+        gone = dict((path, i) for path, i in indexed.items()
+            if path not in local and path in remote and not self.remote_changed(remote[path], i))
+        new = dict((path, l) for path, l in local.items() if path not in indexed and path not in remote)
+        moves = self._match_local(gone, new, indexed)
+        if moves:
+            remote_paths, indexed_paths = sorted(remote), sorted(indexed)
+            for move in moves:
+                rekey(remote, remote_paths, move.src, move.path)
+                rekey(indexed, indexed_paths, move.src, move.path)
+        return moves
+
+    def find_pushed_moves(self, pairs):
+        """Like find_local_moves() for the (path, local, indexed) triples
+        of push(), assuming the server did not change."""
+        gone = {}
+        for path, l, i in pairs:
+            if l is None and i is not None:
+                gone[path] = i
+                if i.is_dir:
+                    gone.update((e.path, e) for e in self.index.subtree(path))
+        new = dict((path, l) for path, l, i in pairs if l is not None and i is None)
+        return self._match_local(gone, new, gone)
+
+    def _match_local(self, gone, new, indexed):
+        if not (gone and new):
+            return []
+        matches = {}
+        inode = lambda e: e.inode
+        pair(gone, new, inode, inode, matches)
+        # Files copied and deleted, or moved in from another file system,
+        # got a new inode but kept their content. Empty files are not
+        # worth moving.
+        matched = set(matches.values())
+        sizes = set(i.size for path, i in gone.items()
+            if not i.is_dir and i.hash and i.size and path not in matched)
+        suspects = [path for path, l in new.items()
+            if not l.is_dir and path not in matches and l.size in sizes]
+        if suspects:
+            hashes = self.hasher.hash_files([self.local_path(path) for path in suspects])
+            digests = dict((path, hashes.get(self.local_path(path))) for path in suspects)
+            content = lambda i: (i.size, i.hash) if i.hash and i.size else None
+            hashed = lambda l: (l.size, digests[l.path]) if digests.get(l.path) else None
+            pair(gone, new, content, hashed, matches)
+            # Copies of the same content are told apart by their names.
+            pair(gone, new, named(content), named(hashed), matches)
+        if not matches:
+            return []
+        return find_moves(gone, new, matches, sorted(indexed))
+
+    def find_remote_moves(self, local, remote, indexed):
+        """
+        Find the entries moved on the server since the last run, among
+        those that did not change locally meanwhile, and rewrite local and
+        indexed as if they had been moved in box_dir already. Returns the
+        L{Move}s to make locally, whose entries hold the ETags of their new
+        location.
+        """
+        gone = dict((path, i) for path, i in indexed.items()
+            if path not in remote and path in local and local[path].is_dir == i.is_dir and
+            (i.is_dir or not self.local_changed(local[path], i)))
+        new = dict((path, r) for path, r in remote.items() if path not in indexed and path not in local)
+        if not (gone and new):
+            return []
+        matches = {}
+        etag = lambda e: (e.size, e.etag) if e.etag else None
+        # Downloaded files carry the modification time of the server copy.
+        stamp = lambda e: (e.size, e.mtime) if e.mtime else None
+        # Copies of the same content are told apart by their names.
+        for key in (etag, named(etag), stamp, named(stamp)):
+            pair(gone, new, key, key, matches)
+        if not matches:
+            return []
+        moves = [move._replace(entries=[e if e.is_dir else e._replace(etag=remote[e.path].etag)
+            for e in move.entries]) for move in find_moves(gone, new, matches, sorted(indexed))]
+        local_paths, indexed_paths = sorted(local), sorted(indexed)
+        for move in moves:
+            rekey(local, local_paths, move.src, move.path)
+            rekey(indexed, indexed_paths, move.src, move.path)
+            indexed.update((e.path, e) for e in move.entries)
+        return moves
+
+    def _keep_parents(self, actions, deletion, creation, needed_by):
+        """
+        A directory deleted on one side must be recreated there instead if
+        something new is about to be transferred into it. Deleting a
+        directory takes all its children along, so those are dropped from
+        the plan.
+        """
+        needed = set()
+        for name in needed_by:
+            for entry in actions[name]:
+                needed.update(parents(entry.path))
+        doomed = set()
+        kept = []
+        for entry in actions[deletion]:
+            if any(p in doomed for p in parents(entry.path)):
+                continue
+            if entry.is_dir and entry.path in needed:
+                actions[creation].append(entry)
+            else:
+                kept.append(entry)
+                if entry.is_dir:
+                    doomed.add(entry.path)
+        actions[deletion] = kept
+        actions[creation].sort()
+
+    def execute(self, actions):
+        if self.journal is not None:
+            for name in ACTIONS:
+                for entry in actions[name]:
+                    self.journal.planned(self.generation, name, entry.path)
+
+        # Parents must exist before their children can be created or
+        # moved into them, so directories are created and entries moved
+        # one tree level at a time. Deletions wait for the moves out of
+        # the directories they take along.
+        levels = {}
+        for name in ('mkdir', 'rename', 'mkcol', 'move'):
+            for entry in actions[name]:
+                levels.setdefault(entry.path.count('/'), []).append((name, entry))
+        for depth in sorted(levels):
+            for name, entry in levels[depth]:
+                if name == 'mkdir':
+                    self._mkdir(entry)
+                elif name == 'rename':
+                    self._rename(entry)
+                else:
+                    self.pool.submit(self._mkcol if name == 'mkcol' else self._move, entry)
+            self._join()
+
+        for entry in actions['delete']:
+            self.pool.submit(self._delete, entry)
+        for entry in actions['remove']:
+            self._remove(entry)
+        self._join()
+
+        hashes = self.hasher.hash_files([self.local_path(entry.path) for entry in actions['put']])
+        for entry in actions['get']:
+            self.pool.submit(self._get, entry)
+        # New files already on the server are copied there. Of several new
+        # files with the same content, only the first one is uploaded and
+        # the others are copied from it afterwards.
+        unsafe = set(entry.path for entry in actions['put'] + actions['delete'])
+        unsafe.update(move.src for move in actions['move'])
+        uploading = {}
+        later = []
+        self._uploaded = {}
+        for entry in actions['put']:
+            digest = hashes.get(self.local_path(entry.path))
+            if digest and entry.size >= MIN_COPY_SIZE and self._expected.get(entry.path) is None:
+                source = self._copy_source(entry.size, digest, unsafe)
+                if source is not None:
+                    self.pool.submit(self._copy, entry, source[0], source[1], digest)
+                    continue
+                key = (entry.size, digest)
+                if key in uploading:
+                    later.append((entry, uploading[key], digest))
+                    continue
+                uploading[key] = entry.path
+            self.pool.submit(self._put, entry, digest)
+        self._join()
+        for entry, source, digest in later:
+            if source in self._uploaded:
+                self.pool.submit(self._copy, entry, source, self._uploaded[source], digest)
+            else:
+                self.pool.submit(self._put, entry, digest)
+        self._join()
+
+        # Downloaded content is hashed in one batch once it is on disk.
+        downloaded, self._downloaded = self._downloaded, []
+        hashes = self.hasher.hash_files([self.local_path(entry.path) for entry in downloaded])
+        for entry in downloaded:
+            self._record(entry.path, False, entry, entry.etag, hashes.get(self.local_path(entry.path)))
+
+    def _remove(self, entry):
+        self.out.debug("Removing local %s" % entry.path)
+        path = self.local_path(entry.path)
+        try:
+            with self.out.span('disk.remove'):
+                if entry.is_dir:
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+        except OSError as e:
+            self.out.error("Failed to remove '%s': %s" % (path, e))
+            self._count('errors')
+            return
+        self._forget(entry.path)
+        self._count('remove')
+
+    def _delete(self, entry):
+        self.out.debug("DELETE %s" % entry.path)
+        self.client.delete(entry.path)
+        self._forget(entry.path)
+        self._count('delete')
+
+    def _mkdir(self, entry):
+        path = self.local_path(entry.path)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._record(entry.path, True)
+        self._count('mkdir')
+
+    def _rename(self, move):
+        self.out.debug("Renaming local %s to %s" % (move.src, move.path))
+        src, dst = self.local_path(move.src), self.local_path(move.path)
+        try:
+            if os.path.lexists(dst):
+                raise OSError(errno.EEXIST, os.strerror(errno.EEXIST))
+            with self.out.span('disk.rename'):
+                os.rename(src, dst)
+        except OSError as e:
+            self.out.error("Failed to rename '%s' to '%s': %s" % (src, dst, e))
+            self._count('errors')
+            return
+        self._moved(move, 'rename')
+
+    def _move(self, move):
+        self.out.debug("MOVE %s %s" % (move.src, move.path))
+        self.client.move(move.src, move.path)
+        entries = move.entries
+        files = [e for e in entries if not e.is_dir]
+        # Servers that do not derive ETags from the content give moved
+        # files new ones, which must be recorded or they would all be
+        # downloaded again by the next sync. One file tells.
+        if files:
+            probe = self.client.propfind(files[0].path, depth=0)[0]
+            if probe.etag != files[0].etag:
+                listed = {probe.path: probe}
+                if move.is_dir:
+                    listed = dict((r.path, r) for r in RemoteWalker(self.client).walk(move.path))
+                entries = [e._replace(etag=listed[e.path].etag) if e.path in listed else e
+                    for e in entries]
+                with self._lock:
+                    # Uploads of files changed since the move must replace
+                    # the moved versions.
+                    for e in entries:
+                        if e.path in self._expected:
+                            self._expected[e.path] = e
+        self._moved(move._replace(entries=entries), 'move')
+
+    def _moved(self, move, action):
+        self._forget(move.src)
+        for e in move.entries:
+            self._record(e.path, e.is_dir, e, e.etag, e.hash)
+        self._count(action)
+        self._count('bytes_moved', sum(e.size for e in move.entries if not e.is_dir))
+
+    def _mkcol(self, entry):
+        self.out.debug("MKCOL %s" % entry.path)
+        self.client.mkcol(entry.path)
+        self._record(entry.path, True)
+        self._count('mkcol')
+
+    def _get(self, entry):
+        self.out.debug("GET %s" % entry.path)
+        path = self.local_path(entry.path)
+        cached = self._cached.get(entry.path)
+        conditions = conditional_headers(cached.etag, cached.mtime) if cached else None
+        if conditions:
+            self._count('conditional')
+        try:
+            etag = self.downloader.download(entry.path, path, entry.size, entry.mtime, entry.etag,
+                conditions)
+        except NotModified:
+            # Record the listed ETag so the next listing does not ask again.
+            self.out.debug("GET %s: not modified" % entry.path)
+            self._record(entry.path, False, cached, entry.etag, cached.hash)
+            self._count('not_modified')
+            self._count('bytes_saved', entry.size)
+            return
+        st = os.stat(path)
+        downloaded = IndexEntry(entry.path, False, st.st_size, st.st_mtime, st.st_ino,
+            etag or entry.etag, None, self.generation)
+        self._record(entry.path, False, downloaded, downloaded.etag)
+        with self._lock:
+            self._downloaded.append(downloaded)
+        self._count('get')
+        self._count('bytes_down', entry.size)
+
+    def _put(self, entry, digest=None):
+        self.out.debug("PUT %s" % entry.path)
+        if_match = if_none_match = None
+        if entry.path in self._expected:
+            expected = self._expected[entry.path]
+            if expected is None:
+                if_none_match = '*'
+            else:
+                if_match = expected.etag
+        try:
+            etag = self.client.put(self.local_path(entry.path), entry.path, if_match, if_none_match)
+        except WebDAVError as e:
+            if e.status != 412:
+                raise
+            remote = self._uploaded_before(entry, digest) if self._recovering else None
+            if remote is not None:
+                # The interrupted run got this far but never logged it.
+                self.out.debug("PUT %s had completed before the interruption" % entry.path)
+                self._record(entry.path, False, entry, remote.etag, digest)
+                return
+            self.out.warning("'%s' changed on the server during the sync, not overwriting it" % entry.path)
+            self._count('conflicts')
+            return
+        if etag is None:
+            etag = self.client.propfind(entry.path, depth=0)[0].etag
+        self._record(entry.path, False, entry, etag, digest)
+        with self._lock:
+            self._uploaded[entry.path] = etag
+        self._count('put')
+        self._count('bytes_up', entry.size)
+
+    def _uploaded_before(self, entry, digest):
+        """
+        The remote L{DAVEntry} of entry if the server holds the same content
+        as the local file, which it does when the upload of an interrupted
+        run completed but was not journaled; None otherwise. Only files of
+        the same size are read back to compare.
+        """
+        try:
+            r = self.client.propfind(entry.path, depth=0)[0]
+            if r.is_dir or r.size != entry.size:
+                return None
+            if digest is None:
+                digest = hash_file(self.local_path(entry.path))[0]
+            remote_digest = self._remote_hash(entry.path)
+        except (WebDAVError, IOError, OSError):
+            return None
+        return r if remote_digest == digest else None
+
+    def _remote_hash(self, path):
+        """Download the remote file at path, only to hash its content."""
+        h = hashlib.new(HASH_ALGORITHM)
+        with self.client.request('GET', path, expect=(200,)) as resp:
+            while True:
+                data = resp.read(self.downloader.blocksize)
+                if not data:
+                    break
+                self.client.limiter.download.consume(len(data))
+                h.update(data)
+        return h.hexdigest()
+
+    def _copy_source(self, size, digest, unsafe):
+        """
+        The path and ETag of a file the index says has the given content on
+        the server, and which this run neither replaces nor deletes, or
+        None. The ETag is the indexed one, which the copy is made
+        conditional on.
+        """
+        for i in self.index.with_hash(digest):
+            if i.size != size or under(i.path, unsafe):
+                continue
+            if self._listed is not None:
+                r = self._listed.get(i.path)
+                if r is None or self.remote_changed(r, i):
+                    continue
+            if i.etag:
+                return i.path, i.etag
+        return None
+
+    def _copy(self, entry, source, etag, digest):
+        self.out.debug("COPY %s %s" % (source, entry.path))
+        try:
+            self.client.copy(source, entry.path, if_match=etag)
+        except WebDAVError as e:
+            # The source changed or is gone (or the destination exists, which
+            # the upload's own precondition then reports as a conflict).
+            self.out.debug("COPY %s failed (%s), uploading instead" % (entry.path, e))
+            return self._put(entry, digest)
+        etag = self.client.propfind(entry.path, depth=0)[0].etag
+        self._record(entry.path, False, entry, etag, digest)
+        self._count('copy')
+        self._count('bytes_copied', entry.size)
+
+    def _report(self, errors):
+        for (func, args, kwargs), e in errors:
+            self.out.error("%s" % e)
+            self._count('errors')
@@ -0,0 +1,200 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+
+import re
+import threading
+
+from collections import Counter, namedtuple
+
+Rule = namedtuple('Rule', 'pattern negate dir_only')
+
+GLOB_CHARS = re.compile(r'[*?[]')
+ESCAPED = re.compile(r'\\(.)')
+
+# Python 2's re refuses patterns with 100 groups or more.
+MAX_GROUPS = 99
+
+def translate(glob):
+    """Turn a gitignore glob into a regular expression. A '*' stays within
+    one path component; '**' spans any number of them."""
+    i, n = 0, len(glob)
+    parts = []
+    while i < n:
+        c = glob[i]
+        if glob.startswith('**/', i) and (i == 0 or glob[i - 1] == '/'):
+            parts.append('(?:.*/)?')
+            i += 3
+            continue
+        if glob.startswith('**', i) and i + 2 == n and (i == 0 or glob[i - 1] == '/'):
+            parts.append('.*')
+            i += 2
+            continue
+        if c == '*':
+            parts.append('[^/]*')
+            while i + 1 < n and glob[i + 1] == '*':
+                i += 1
+        elif c == '?':
+            parts.append('[^/]')
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            parts.append(re.escape(glob[i]))
+        elif c == '[':
+            j = glob.find(']', i + 2 if glob[i + 1:i + 2] in ('!', '^', ']') else i + 1)
+            if j < 0:
+                parts.append('\\[')
+            else:
+                body = glob[i + 1:j].replace('\\', '\\\\')
+                if body[:1] in ('!', '^'):
+                    body = '^' + body[1:]
+                parts.append('[%s]' % body)
+                i = j
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return ''.join(parts)
+
+class PathFilter(object):
+    """
+    Decides which paths are left out of a sync, from gitignore-style
+    patterns: a pattern without a slash matches a name at any depth, one
+    with a leading or inner slash is anchored to the root of the tree, a
+    trailing slash restricts it to directories, '!' brings back what an
+    earlier pattern excluded and the last matching pattern wins.
+
+    The patterns are compiled once. Literal names go to a dict, literal
+    anchored paths to a trie and the globs into one regular expression
+    per kind (names or paths, files or directories) in which the latest
+    pattern comes first, so a single match finds the rule that applies.
+
+    Walkers call L{prune} on every entry before descending into it, so an
+    excluded directory is never listed, and C{pruned} counts what each
+    rule left out.
+    """
+    def __init__(self, patterns=()):
+        self.rules = []
+        self.pruned = Counter()
+        self._lock = threading.Lock()
+        # name -> [last rule for files, last rule for directories]
+        self._names = {}
+        # part -> (children, [last rule for files, last rule for directories])
+        self._trie = {}
+        globs = {}
+        for pattern in patterns:
+            self._add(pattern, globs)
+        self._regexes = {}
+        for kind, rules in globs.items():
+            rules.reverse()
+            self._regexes[kind] = [(re.compile('(?:%s)\\Z' % '|'.join('(%s)' % regex
+                for index, regex in chunk), re.S), [index for index, regex in chunk])
+                for chunk in [rules[i:i + MAX_GROUPS] for i in range(0, len(rules), MAX_GROUPS)]]
+
+    def __nonzero__(self):
+        return bool(self.rules)
+
+    def _add(self, pattern, globs):
+        pattern = pattern.strip()
+        if not pattern or pattern.startswith('#'):
+            return
+        negate = pattern.startswith('!')
+        if negate:
+            pattern = pattern[1:]
+        elif pattern.startswith('\\!') or pattern.startswith('\\#'):
+            pattern = pattern[1:]
+        index = len(self.rules)
+        dir_only = pattern.endswith('/')
+        self.rules.append(Rule(('!' if negate else '') + pattern, negate, dir_only))
+        pattern = pattern.rstrip('/')
+        anchored = '/' in pattern
+        pattern = pattern.lstrip('/')
+        slots = (1,) if dir_only else (0, 1)
+        if not GLOB_CHARS.search(ESCAPED.sub('', pattern)):
+            literal = ESCAPED.sub(r'\1', pattern)
+            if anchored:
+                node = (self._trie, None)
+                for part in literal.split('/'):
+                    node = node[0].setdefault(part, ({}, [-1, -1]))
+                last = node[1]
+            else:
+                last = self._names.setdefault(literal, [-1, -1])
+            for slot in slots:
+                last[slot] = index
+        else:
+            regex = translate(pattern)
+            for slot in slots:
+                globs.setdefault(('path' if anchored else 'name', slot), []).append((index, regex))
+
+    def match(self, path, is_dir):
+        """The index of the last rule matching path itself, or -1. The
+        parents of path are not looked at."""
+        slot = 1 if is_dir else 0
+        name = path.rpartition('/')[2]
+        best = self._names[name][slot] if name in self._names else -1
+        if self._trie:
+            children, last = self._trie, None
+            for part in path.split('/'):
+                if part not in children:
+                    last = None
+                    break
+                children, last = children[part]
+            if last is not None and last[slot] > best:
+                best = last[slot]
+        for kind, subject in (('name', name), ('path', path)):
+            for regex, indices in self._regexes.get((kind, slot), ()):
+                m = regex.match(subject)
+                if m is not None:
+                    best = max(best, indices[m.lastindex - 1])
+                    break
+        return best
+
+    def excluded(self, path, is_dir):
+        """Whether path itself is excluded, its parents aside."""
+        index = self.match(path, is_dir)
+        return index >= 0 and not self.rules[index].negate
+
+    def prune(self, path, is_dir):
+        """L{excluded}, counting the hit against the rule for C{pruned}."""
+        index = self.match(path, is_dir)
+        if index < 0 or self.rules[index].negate:
+            return False
+        with self._lock:
+            self.pruned[index] += 1
+        return True
+
+    def excludes(self, path, is_dir=False):
+        """Whether path or one of its parent directories is excluded, for
+        paths that did not come from a walk."""
+        parts = path.split('/')
+        for i in range(1, len(parts)):
+            if self.excluded('/'.join(parts[:i]), True):
+                return True
+        return self.excluded(path, is_dir)
+
+    def report(self):
+        """How many entries each rule pruned since the last call, as a
+        one-line summary, or None if none were."""
+        with self._lock:
+            pruned, self.pruned = self.pruned, Counter()
+        if not pruned:
+            return None
+        return ', '.join("'%s' %d" % (self.rules[index].pattern, count)
+            for index, count in sorted(pruned.items()))
@@ -0,0 +1,212 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import hashlib
+import mmap
+import multiprocessing
+import os
+import signal
+import sqlite3
+import threading
+import time
+
+from noiselabs.box.config import BASEDIR
+
+HASH_ALGORITHM = 'sha1'
+
+_local = threading.local()
+
+def stat_key(st):
+    """The identity of a file's content as far as stat can tell."""
+    mtime_ns = getattr(st, 'st_mtime_ns', None) or int(st.st_mtime * 1000000000)
+    return (st.st_dev, st.st_ino, st.st_size, mtime_ns)
+
+def hash_file(path, bufsize=1024 * 1024):
+    """
+    Hash a file's content. Large files are mapped into memory and handed to
+    the hash in place; smaller ones are read into a buffer allocated once
+    per thread, and so once per worker process. Returns (hexdigest, size).
+    """
+    h = hashlib.new(HASH_ALGORITHM)
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= bufsize:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                h.update(mm)
+            finally:
+                mm.close()
+        elif size:
+            buf = getattr(_local, 'buf', None)
+            if buf is None or len(buf) < bufsize:
+                buf = _local.buf = bytearray(bufsize)
+            view = memoryview(buf)
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                h.update(view[:n])
+    return h.hexdigest(), size
+
+def _ignore_signals():
+    # Interrupting a sync is handled by the parent, which closes the pool.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+def _hash_worker(path):
+    started = time.time()
+    try:
+        digest, size = hash_file(path)
+    except (IOError, OSError) as e:
+        return path, None, 0, 0.0, os.getpid(), str(e)
+    return path, digest, size, time.time() - started, os.getpid(), None
+
+class HashCache(object):
+    """
+    Content hashes keyed by (device, inode, size, mtime_ns), so a file is
+    only hashed again once it was actually modified, moved to another
+    filesystem or replaced.
+    """
+    filepath = os.path.join(BASEDIR, 'hashes.db')
+
+    def __init__(self, filepath=None):
+        if filepath is not None:
+            self.filepath = filepath
+        if self.filepath != ':memory:':
+            basedir = os.path.dirname(self.filepath)
+            if not os.path.isdir(basedir):
+                os.makedirs(basedir, 0700)
+        self.db = sqlite3.connect(self.filepath, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS hashes ("
+            "dev INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, hash TEXT, "
+            "PRIMARY KEY (dev, inode))")
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            row = self.db.execute("SELECT size, mtime_ns, hash FROM hashes WHERE dev = ? AND inode = ?",
+                key[:2]).fetchone()
+        if row is None or tuple(row[:2]) != key[2:]:
+            return None
+        return row[2]
+
+    def put(self, items):
+        """Store a list of (key, hash) pairs."""
+        with self._lock:
+            self.db.executemany("INSERT OR REPLACE INTO hashes (dev, inode, size, mtime_ns, hash) "
+                "VALUES (?, ?, ?, ?, ?)", [key + (digest,) for key, digest in items])
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+class Hasher(object):
+    """
+    Hashes batches of files on a pool of processes, skipping files whose
+    hash is already cached. Small batches are hashed in-process since
+    starting the pool would cost more than it saves. Several threads may
+    hash at once and share the pool.
+    """
+    inline_limit = 4 * 1024 * 1024
+
+    def __init__(self, box_console, cache=None, processes=None):
+        self.out = box_console
+        self.cache = cache if cache is not None else HashCache(':memory:')
+        self.processes = processes or multiprocessing.cpu_count()
+        self.stats = {'hits': 0, 'misses': 0, 'bytes': 0, 'seconds': 0.0}
+        self.workers = {}
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+    def hash_files(self, paths):
+        """Returns a dict mapping every readable path to its hash."""
+        hashes = {}
+        misses = {}
+        for path in paths:
+            try:
+                key = stat_key(os.stat(path))
+            except OSError:
+                continue
+            digest = self.cache.get(key)
+            if digest is None:
+                misses[path] = key
+            else:
+                hashes[path] = digest
+        with self._lock:
+            self.stats['hits'] += len(hashes)
+            self.stats['misses'] += len(misses)
+        self.out.count('hash.cache_hits', len(hashes))
+        self.out.count('hash.cache_misses', len(misses))
+        if not misses:
+            return hashes
+
+        started = time.time()
+        if self.processes > 1 and len(misses) > 1 and \
+                sum(key[2] for key in misses.values()) > self.inline_limit:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = multiprocessing.Pool(self.processes, _ignore_signals)
+            chunksize = max(1, min(64, len(misses) // (self.processes * 4)))
+            results = self._pool.imap_unordered(_hash_worker, misses.keys(), chunksize)
+        else:
+            results = (_hash_worker(path) for path in misses)
+        computed = []
+        for path, digest, size, elapsed, pid, error in results:
+            if digest is None:
+                self.out.debug("Could not hash '%s': %s" % (path, error))
+                continue
+            # The file may have changed while it was read, in which case
+            # the hash must not be cached under the old key.
+            if size == misses[path][2]:
+                computed.append((misses[path], digest))
+            hashes[path] = digest
+            with self._lock:
+                worker = self.workers.setdefault(pid, [0, 0.0])
+                worker[0] += size
+                worker[1] += elapsed
+                self.stats['bytes'] += size
+            self.out.observe('hash.file', elapsed)
+            self.out.count('hash.bytes', size)
+        with self._lock:
+            self.stats['seconds'] += time.time() - started
+        self.cache.put(computed)
+        return hashes
+
+    def report(self):
+        """Log throughput and cache efficiency at debug level."""
+        lookups = self.stats['hits'] + self.stats['misses']
+        if not lookups:
+            return
+        mb = self.stats['bytes'] / 1048576.0
+        rate = mb / self.stats['seconds'] if self.stats['seconds'] else 0.0
+        self.out.debug("Hashed %.1f MB at %.1f MB/s, cache hits %d/%d (%.0f%%)" % (mb, rate,
+            self.stats['hits'], lookups, 100.0 * self.stats['hits'] / lookups))
+        for pid, (size, seconds) in sorted(self.workers.items()):
+            self.out.debug("  worker %d: %.1f MB at %.1f MB/s" % (pid, size / 1048576.0,
+                size / 1048576.0 / seconds if seconds else 0.0))
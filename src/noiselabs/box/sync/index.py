@@ -0,0 +1,163 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import os
+import sqlite3
+
+from collections import namedtuple
+
+from noiselabs.box.config import BASEDIR
+
+IndexEntry = namedtuple('IndexEntry', 'path is_dir size mtime inode etag hash generation')
+"""The state of a path as of the last time it was synchronized."""
+
+class StateIndex(object):
+    """
+    On-disk record of every synchronized path, kept in a SQLite database
+    next to box-sync.cfg. Comparing a fresh scan against it tells which
+    entries changed locally (size, mtime or inode differ) or remotely (the
+    ETag differs) since the last run, so unchanged files are never
+    transferred or compared again.
+
+    Every run bumps a generation counter which is stored along with the
+    entries it wrote.
+    """
+    filepath = os.path.join(BASEDIR, 'index.db')
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS entries (
+            path TEXT PRIMARY KEY,
+            is_dir INTEGER NOT NULL,
+            size INTEGER,
+            mtime REAL,
+            inode INTEGER,
+            etag TEXT,
+            hash TEXT,
+            generation INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS entries_hash ON entries (hash);
+    """
+
+    def __init__(self, filepath=None):
+        if filepath is not None:
+            self.filepath = filepath
+        if self.filepath != ':memory:':
+            basedir = os.path.dirname(self.filepath)
+            if not os.path.isdir(basedir):
+                os.makedirs(basedir, 0700)
+        self.db = sqlite3.connect(self.filepath)
+        self.db.text_factory = str
+        self.db.executescript(self.schema)
+        self.generation = int(self.get_meta('generation', 0))
+
+    def close(self):
+        self.db.close()
+
+    def get_meta(self, key, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_meta(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def bind(self, box_dir, url):
+        """
+        Tie the index to a local directory and remote URL. If it was built
+        for another pair it is cleared, otherwise every file would look like
+        it had been deleted on one side. Returns False if it was cleared.
+        """
+        if self.get_meta('box_dir') in (None, box_dir) and self.get_meta('url') in (None, url):
+            bound = True
+        else:
+            self.db.execute("DELETE FROM entries")
+            bound = False
+        self.set_meta('box_dir', box_dir)
+        self.set_meta('url', url)
+        self.db.commit()
+        return bound
+
+    def begin_generation(self):
+        self.generation += 1
+        self.set_meta('generation', self.generation)
+        self.db.commit()
+        return self.generation
+
+    def load(self):
+        """Returns every entry as a dict keyed by path."""
+        cursor = self.db.execute("SELECT path, is_dir, size, mtime, inode, etag, hash, generation FROM entries")
+        return dict((row[0], IndexEntry(row[0], bool(row[1]), *row[2:])) for row in cursor)
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def get(self, path):
+        row = self.db.execute("SELECT path, is_dir, size, mtime, inode, etag, hash, generation "
+            "FROM entries WHERE path = ?", (path,)).fetchone()
+        return None if row is None else IndexEntry(row[0], bool(row[1]), *row[2:])
+
+    def with_hash(self, digest):
+        """Yields the file entries whose content has the given hash."""
+        cursor = self.db.execute("SELECT path, is_dir, size, mtime, inode, etag, hash, generation "
+            "FROM entries WHERE hash = ? AND is_dir = 0", (digest,))
+        for row in cursor:
+            yield IndexEntry(row[0], bool(row[1]), *row[2:])
+
+    def children(self, path):
+        """Yields (path, entry) for the entries directly below path."""
+        if path:
+            cursor = self.db.execute("SELECT path, is_dir, size, mtime, inode, etag, hash, generation "
+                "FROM entries WHERE path >= ? AND path < ?", (path + '/', path + '0'))
+            depth = path.count('/') + 1
+        else:
+            cursor = self.db.execute("SELECT path, is_dir, size, mtime, inode, etag, hash, generation "
+                "FROM entries")
+            depth = 0
+        for row in cursor:
+            if row[0].count('/') == depth:
+                yield row[0], IndexEntry(row[0], bool(row[1]), *row[2:])
+
+    def subtree(self, path):
+        """Yields the entries below path, at any depth."""
+        cursor = self.db.execute("SELECT path, is_dir, size, mtime, inode, etag, hash, generation "
+            "FROM entries WHERE path >= ? AND path < ?", (path + '/', path + '0'))
+        for row in cursor:
+            yield IndexEntry(row[0], bool(row[1]), *row[2:])
+
+    def update(self, entries):
+        self.db.executemany("INSERT OR REPLACE INTO entries "
+            "(path, is_dir, size, mtime, inode, etag, hash, generation) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", entries)
+
+    def remove(self, paths):
+        """Forget paths along with everything below them."""
+        for path in paths:
+            # '0' is the character right after '/', so this range holds
+            # exactly the descendants of path.
+            self.db.execute("DELETE FROM entries WHERE path = ? OR (path >= ? AND path < ?)",
+                (path, path + '/', path + '0'))
+
+    def commit(self):
+        self.db.commit()
@@ -0,0 +1,149 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import json
+import os
+import threading
+import time
+
+from noiselabs.box.config import BASEDIR
+from noiselabs.box.metrics import NULL_METRICS
+from noiselabs.box.sync.index import IndexEntry
+
+class Journal(object):
+    """
+    A write-ahead log of the operations of a sync run.
+
+    Every operation is logged as planned before it starts and as done, with
+    the index entry it produced, once it has finished. Records are written
+    by a background thread that fsyncs once per batch (group commit), so
+    transfers never wait for the disk. The log is truncated whenever the
+    index has been committed; whatever is in it at startup belongs to a run
+    that did not finish, and recover() hands back both the completed work,
+    to be applied to the index, and the operations that never finished.
+    """
+    filepath = os.path.join(BASEDIR, 'journal.log')
+    commit_interval = 0.05
+
+    def __init__(self, filepath=None, metrics=NULL_METRICS):
+        if filepath is not None:
+            self.filepath = filepath
+        self.metrics = metrics
+        basedir = os.path.dirname(self.filepath)
+        if not os.path.isdir(basedir):
+            os.makedirs(basedir, 0700)
+        self.f = open(self.filepath, 'ab')
+        self._buffer = []
+        self._appended = 0
+        self._committed = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._flush_loop, name='box-sync-journal')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _append(self, record):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._cond:
+            self._buffer.append(line)
+            self._appended += 1
+            self._cond.notify_all()
+
+    def planned(self, generation, action, path):
+        self._append(['plan', generation, action, path])
+
+    def done(self, generation, path, entry=None):
+        """@param entry: the resulting L{IndexEntry}, None if path is gone"""
+        self._append(['done', generation, path, list(entry) if entry else None])
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._buffer and not self._closed:
+                    self._cond.wait(1.0)
+                if not self._buffer and self._closed:
+                    return
+            # Give concurrent writers a moment to join this batch.
+            if not self._closed:
+                time.sleep(self.commit_interval)
+            with self._cond:
+                lines, self._buffer = self._buffer, []
+                target = self._appended
+            with self.metrics.span('journal.commit'):
+                self.f.write(''.join(lines))
+                self.f.flush()
+                os.fsync(self.f.fileno())
+            self.metrics.count('journal.records', len(lines))
+            with self._cond:
+                self._committed = target
+                self._cond.notify_all()
+
+    def sync(self):
+        """Block until everything appended so far is on disk."""
+        with self._cond:
+            target = self._appended
+            while self._committed < target and self._thread.is_alive():
+                self._cond.wait(0.5)
+
+    def checkpoint(self):
+        """Called once the index holds everything logged so far."""
+        self.sync()
+        with self._cond:
+            self.f.truncate(0)
+            self.f.flush()
+            os.fsync(self.f.fileno())
+
+    def recover(self):
+        """
+        Read what a previous, interrupted run left behind. Returns
+        (done, pending): the done records as (path, entry) pairs in the
+        order they happened, and the (action, path) pairs that were planned
+        but never finished.
+        """
+        done = []
+        pending = {}
+        with open(self.filepath, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn write from the crash; nothing after it made it.
+                    break
+                if record[0] == 'plan':
+                    pending[record[3].encode('utf-8')] = record[2]
+                else:
+                    path = record[2].encode('utf-8')
+                    pending.pop(path, None)
+                    entry = record[3]
+                    if entry is not None:
+                        entry = IndexEntry(*[v.encode('utf-8') if isinstance(v, unicode) else v
+                            for v in entry])
+                    done.append((path, entry))
+        return done, sorted((action, path) for path, action in pending.items())
+
+    def close(self):
+        self.sync()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(5)
+        self.f.close()
@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import collections
+import os
+import Queue
+import resource
+import threading
+import time
+
+_DONE = object()
+
+class WalkError(object):
+    def __init__(self, path, error):
+        self.path = path
+        self.error = error
+
+def peak_rss():
+    """Peak resident set size of this process, in bytes, since it started
+    or since the last L{reset_peak_rss}."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, ValueError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def reset_peak_rss():
+    """Make peak_rss() start again from the current resident set size, if
+    the kernel allows it (Linux 4.0 and later). Returns whether it did."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except IOError:
+        return False
+
+class RemoteWalker(object):
+    """
+    Lists a remote tree breadth-first with at most C{max_inflight} Depth:1
+    PROPFIND requests running at once. Entries are handed over through a
+    bounded queue as soon as they are parsed, so a slow consumer throttles
+    the listing instead of letting it pile up in memory.
+
+    Failures do not stop the walk; they are collected in C{errors} as
+    (path, exception) tuples.
+    """
+    def __init__(self, client, max_inflight=4, queue_size=1024):
+        self.client = client
+        self.max_inflight = max_inflight
+        self.queue_size = queue_size
+        self.errors = []
+        self.entries = 0
+        self.elapsed = 0.0
+
+    def walk(self, path='', filter=None):
+        """Yields every L{DAVEntry} below path (excluding path itself) that
+        the L{PathFilter} filter does not prune. Pruned directories are not
+        listed."""
+        pending = collections.deque([path])
+        cond = threading.Condition()
+        state = {'outstanding': 1, 'stop': False}
+        out = Queue.Queue(self.queue_size)
+
+        def put(item):
+            while not state['stop']:
+                try:
+                    out.put(item, timeout=0.1)
+                    return
+                except Queue.Full:
+                    pass
+
+        def work():
+            while True:
+                with cond:
+                    while not pending and state['outstanding'] and not state['stop']:
+                        cond.wait()
+                    if state['stop'] or not pending:
+                        return
+                    dirpath = pending.popleft()
+                try:
+                    for entry in self.client.iter_propfind(dirpath, depth=1):
+                        if entry.path == dirpath:
+                            continue
+                        if filter and filter.prune(entry.path, entry.is_dir):
+                            continue
+                        if entry.is_dir:
+                            with cond:
+                                pending.append(entry.path)
+                                state['outstanding'] += 1
+                                cond.notify()
+                        put(entry)
+                except Exception as e:
+                    put(WalkError(dirpath, e))
+                finally:
+                    with cond:
+                        state['outstanding'] -= 1
+                        done = not state['outstanding']
+                        if done:
+                            cond.notify_all()
+                    if done:
+                        put(_DONE)
+
+        threads = [threading.Thread(target=work, name='box-sync-walker-%d' % i)
+            for i in range(self.max_inflight)]
+        started = time.time()
+        for t in threads:
+            t.daemon = True
+            t.start()
+        try:
+            while True:
+                try:
+                    # A timeout keeps the main thread responsive to signals.
+                    item = out.get(timeout=0.5)
+                except Queue.Empty:
+                    continue
+                if item is _DONE:
+                    break
+                if isinstance(item, WalkError):
+                    self.errors.append((item.path, item.error))
+                    continue
+                self.entries += 1
+                yield item
+        finally:
+            with cond:
+                state['stop'] = True
+                cond.notify_all()
+            for t in threads:
+                t.join()
+            self.elapsed += time.time() - started
+
+    def report(self):
+        """A one-line summary of the listing throughput."""
+        rate = self.entries / self.elapsed if self.elapsed else 0.0
+        return "%d entries in %.1fs (%.0f entries/s), peak RSS %.1f MB" % (
+            self.entries, self.elapsed, rate, peak_rss() / 1048576.0)
+
+def walk_mount(top):
+    """
+    Walk a mounted tree with readdir and stat, as davfs2 users would. Returns
+    (entries, seconds) so it can be compared with a L{RemoteWalker}.
+    """
+    started = time.time()
+    entries = 0
+    for dirpath, dirnames, filenames in os.walk(top):
+        for name in filenames:
+            try:
+                os.stat(os.path.join(dirpath, name))
+            except OSError:
+                pass
+        entries += len(dirnames) + len(filenames)
+    return entries, time.time() - started
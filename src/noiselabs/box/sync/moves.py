@@ -0,0 +1,139 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import bisect
+
+from collections import namedtuple
+
+Move = namedtuple('Move', 'path src is_dir entries')
+"""A file or directory to move from C{src} to C{path}. C{entries} are the
+index entries of everything moved, already carrying their new paths."""
+
+def below(paths, top):
+    """The paths below top in the sorted list paths."""
+    # '0' is the character right after '/', so this range holds exactly
+    # the descendants of top.
+    return paths[bisect.bisect_left(paths, top + '/'):bisect.bisect_left(paths, top + '0')]
+
+def under(path, tops):
+    """Whether path is one of the paths in the set tops or lies below one."""
+    while True:
+        if path in tops:
+            return True
+        if '/' not in path:
+            return False
+        path = path.rsplit('/', 1)[0]
+
+def rekey(entries, paths, src, dst):
+    """
+    Move the entry for src and all those below it in the dict entries to
+    dst. paths is a sorted list of the keys of entries, which may hold
+    paths that are gone already.
+    """
+    for path in [src] + below(paths, src):
+        entry = entries.pop(path, None)
+        if entry is not None:
+            entries[dst + path[len(src):]] = entry._replace(path=dst + path[len(src):])
+
+def pair(gone, new, old_key, new_key, matches):
+    """
+    Add to matches, a dict mapping new paths to gone ones, the files of new
+    and gone that share a key no other unmatched file on either side has.
+    Keys are computed by old_key for the entries of gone and new_key for
+    those of new; None never matches.
+    """
+    taken = set(matches.values())
+    olds = {}
+    for path, entry in gone.items():
+        if not entry.is_dir and path not in taken:
+            key = old_key(entry)
+            if key is not None:
+                olds.setdefault(key, []).append(path)
+    news = {}
+    for path, entry in new.items():
+        if not entry.is_dir and path not in matches:
+            key = new_key(entry)
+            if key is not None and key in olds:
+                news.setdefault(key, []).append(path)
+    for key, paths in news.items():
+        if len(paths) == 1 and len(olds[key]) == 1:
+            matches[paths[0]] = olds[key][0]
+
+def named(key):
+    """Extend key with the name of the entry, to tell copies apart."""
+    def named_key(entry):
+        value = key(entry)
+        return value and value + (entry.path.rsplit('/', 1)[-1],)
+    return named_key
+
+def find_moves(gone, new, matches, indexed):
+    """
+    Turn matched files into moves. A directory becomes a single move when
+    everything the index holds below it was moved along to the same place,
+    files being matched and directories recreated; otherwise its files are
+    moved one by one.
+
+    @param gone: entries that disappeared from one side, by path
+    @param new: entries that appeared on the same side, by path
+    @param matches: new file paths mapped to the gone ones they came from
+    @param indexed: sorted list of every indexed path
+    @return: a list of L{Move} sorted by destination
+    """
+    candidates = set()
+    for dst, src in matches.items():
+        while '/' in src and '/' in dst:
+            src, name = src.rsplit('/', 1)
+            dst, other = dst.rsplit('/', 1)
+            if name != other:
+                break
+            if not (src in gone and gone[src].is_dir and dst in new and new[dst].is_dir):
+                break
+            candidates.add((src, dst))
+
+    def moved_whole(src, dst):
+        for path in below(indexed, src):
+            entry = gone.get(path)
+            if entry is None:
+                return False
+            target = dst + path[len(src):]
+            if entry.is_dir:
+                if target not in new or not new[target].is_dir:
+                    return False
+            elif matches.get(target) != path:
+                return False
+        return True
+
+    moves = []
+    sources = set()
+    # Outermost directories first, so that they take their subdirectories
+    # along.
+    for src, dst in sorted(candidates, key=lambda pair: (pair[0].count('/'), pair)):
+        if not under(src, sources) and moved_whole(src, dst):
+            entries = [gone[path] for path in [src] + below(indexed, src)]
+            moves.append(Move(dst, src, True,
+                [e._replace(path=dst + e.path[len(src):]) for e in entries]))
+            sources.add(src)
+    for dst, src in matches.items():
+        if not under(src, sources):
+            moves.append(Move(dst, src, False, [gone[src]._replace(path=dst)]))
+    moves.sort()
+    return moves
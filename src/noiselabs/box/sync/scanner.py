@@ -0,0 +1,183 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import collections
+import os
+import stat
+import threading
+import time
+
+from collections import namedtuple
+from operator import itemgetter
+
+from noiselabs.box.sync.transfer import TEMP_SUFFIXES
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+LocalEntry = namedtuple('LocalEntry', 'path is_dir size mtime inode')
+"""A file or directory inside box_dir. C{path} is relative to box_dir and
+uses forward slashes, just like L{DAVEntry} paths."""
+
+def read_dir(path):
+    """
+    Yields (name, is_dir, is_link, stat) for every entry of a directory,
+    where stat is a callable returning the entry's (followed) stat result.
+
+    With scandir the directory type comes from readdir and a file costs a
+    single stat() call; without it every entry is lstat()ed, which gives
+    the same answers at the same cost except for directories.
+    """
+    if scandir is not None:
+        for entry in scandir(path):
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            yield entry.name, is_dir, entry.is_symlink(), entry.stat
+        return
+    for name in os.listdir(path):
+        full = os.path.join(path, name)
+        try:
+            st = os.lstat(full)
+            is_link = stat.S_ISLNK(st.st_mode)
+            if is_link:
+                st = os.stat(full)
+        except OSError:
+            # Gone already, or a dangling link that could not be synced.
+            continue
+        yield name, stat.S_ISDIR(st.st_mode), is_link, lambda st=st: st
+
+class LocalScanner(object):
+    """
+    Lists box_dir with up to C{threads} directories read at once, which
+    hides the latency of network-backed home directories. Directories are
+    told apart without a stat() call and each file is stat()ed once, its
+    inode number being recorded so that a file replaced by another one
+    with the same size and mtime is still seen as changed.
+
+    Symbolic links are followed for stat() but not descended into, and
+    temporary download files are skipped, as os.walk() used to do. Paths
+    pruned by the L{PathFilter} filter are left out and excluded
+    directories are not read. Directories that cannot be read are
+    collected in C{errors} as (path, exception) tuples.
+    """
+    def __init__(self, box_dir, threads=8, filter=None):
+        self.box_dir = box_dir
+        self.threads = max(1, threads)
+        self.filter = filter
+        self.errors = []
+        self.dirs = 0
+        self.files = 0
+        self.elapsed = 0.0
+
+    def scan(self):
+        """Returns every L{LocalEntry} below box_dir as a list sorted by
+        path, ready to be merged with the index."""
+        pending = collections.deque([''])
+        cond = threading.Condition()
+        state = {'outstanding': 1, 'stop': False}
+        found = []
+
+        def work():
+            entries = []
+            found.append(entries)
+            while True:
+                with cond:
+                    while not pending and state['outstanding'] and not state['stop']:
+                        cond.wait()
+                    if state['stop'] or not pending:
+                        return
+                    reldir = pending.popleft()
+                subdirs = []
+                try:
+                    self._read(reldir, entries, subdirs)
+                except OSError as e:
+                    with cond:
+                        self.errors.append((reldir, e))
+                with cond:
+                    pending.extend(subdirs)
+                    state['outstanding'] += len(subdirs) - 1
+                    if not state['outstanding']:
+                        cond.notify_all()
+                    elif subdirs:
+                        cond.notify(len(subdirs))
+
+        threads = [threading.Thread(target=work, name='box-sync-scanner-%d' % i)
+            for i in range(self.threads)]
+        started = time.time()
+        for t in threads:
+            t.daemon = True
+            t.start()
+        try:
+            for t in threads:
+                while t.is_alive():
+                    # A timeout keeps the main thread responsive to signals.
+                    t.join(0.5)
+        finally:
+            with cond:
+                state['stop'] = True
+                cond.notify_all()
+            for t in threads:
+                t.join()
+            self.elapsed += time.time() - started
+        entries = [entry for entries in found for entry in entries]
+        entries.sort(key=itemgetter(0))
+        dirs = sum(1 for entry in entries if entry.is_dir)
+        self.dirs += dirs
+        self.files += len(entries) - dirs
+        return entries
+
+    def _read(self, reldir, entries, subdirs):
+        prune = self.filter.prune if self.filter else None
+        prefix = reldir + '/' if reldir else ''
+        path = os.path.join(self.box_dir, *reldir.split('/')) if reldir else self.box_dir
+        for name, is_dir, is_link, get_stat in read_dir(path):
+            relpath = prefix + name
+            if is_dir:
+                if prune is not None and prune(relpath, True):
+                    continue
+                entries.append(LocalEntry(relpath, True, 0, None, None))
+                if not is_link:
+                    subdirs.append(relpath)
+                continue
+            if name.endswith(TEMP_SUFFIXES):
+                continue
+            if prune is not None and prune(relpath, False):
+                continue
+            try:
+                st = get_stat()
+            except OSError:
+                continue
+            entries.append(LocalEntry(relpath, False, st.st_size, st.st_mtime, st.st_ino))
+
+    def report(self):
+        """A one-line summary of the scanning throughput."""
+        elapsed = self.elapsed or float('inf')
+        return "%d directories and %d files in %.1fs (%.0f dirs/s, %.0f files/s, %d threads%s)" % (
+            self.dirs, self.files, self.elapsed, self.dirs / elapsed, self.files / elapsed,
+            self.threads, '' if scandir is not None else ', without scandir')
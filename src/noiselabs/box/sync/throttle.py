@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import threading
+import time
+
+class TokenBucket(object):
+    """
+    A token bucket shared by every transfer going in one direction.
+
+    Tokens are bytes and accumulate at C{rate} per second up to C{burst}.
+    A caller takes what it needs and, if that leaves the bucket in debt,
+    sleeps until the debt would have been paid off. The aggregate rate is
+    therefore exact no matter how many threads draw from the bucket. A rate
+    of 0 means unlimited. Both values may be changed at any time.
+    """
+    def __init__(self, rate=0, burst=0):
+        self._lock = threading.Lock()
+        self.rate = 0
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=0):
+        """
+        Change the limits, keeping the tokens in the bucket up to the new
+        burst so reloading the configuration never lets more through. The
+        bucket starts full if there was no limit.
+
+        @param burst: bucket size in bytes, defaults to one second worth
+        """
+        with self._lock:
+            now = time.time()
+            if self.rate:
+                tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            else:
+                tokens = burst or rate
+            self.rate = rate
+            self.burst = burst or rate
+            self.tokens = min(tokens, self.burst)
+            self.stamp = now
+
+    def consume(self, amount):
+        with self._lock:
+            if not self.rate:
+                return
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= amount
+            wait = -self.tokens / float(self.rate) if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+class BandwidthLimiter(object):
+    """Separate upload and download budgets."""
+    def __init__(self, upload=0, download=0, upload_burst=0, download_burst=0):
+        self.upload = TokenBucket(upload, upload_burst)
+        self.download = TokenBucket(download, download_burst)
+
+    def configure(self, config):
+        """(Re)load the limits from a L{ConfigSnapshot}."""
+        self.upload.set_rate(config.upload_limit, config.upload_burst)
+        self.download.set_rate(config.download_limit, config.download_burst)
+
+class ThrottledFile(object):
+    """A read-only file wrapper drawing from a bucket for every read."""
+    def __init__(self, f, bucket):
+        self.f = f
+        self.bucket = bucket
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.bucket.consume(len(data))
+        return data
+
+    def readinto(self, buf):
+        if hasattr(self.f, 'readinto'):
+            n = self.f.readinto(buf)
+        else:
+            data = self.f.read(len(buf))
+            n = len(data)
+            buf[:n] = data
+        self.bucket.consume(n)
+        return n
+
+    def seek(self, offset, whence=0):
+        self.f.seek(offset, whence)
@@ -0,0 +1,277 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import errno
+import json
+import os
+import re
+import threading
+
+from noiselabs.box.sync.compression import gunzip
+from noiselabs.box.sync.webdav import NotModified, WebDAVError, parse_http_date
+
+PART_SUFFIX = '.box-sync.part'
+CHUNKS_SUFFIX = '.box-sync.chunks'
+TEMP_SUFFIXES = (PART_SUFFIX, CHUNKS_SUFFIX)
+"""Files being downloaded, never synchronized themselves."""
+
+CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+_fallocate = None
+
+def _posix_fallocate():
+    global _fallocate
+    if _fallocate is None:
+        # Loaded on first use: finding libc is slow.
+        import ctypes
+        import ctypes.util
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6')
+            func = getattr(libc, 'posix_fallocate64', None) or libc.posix_fallocate
+            func.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+            func.restype = ctypes.c_int
+            _fallocate = func
+        except (OSError, AttributeError):
+            _fallocate = False
+    return _fallocate
+
+def preallocate(f, size):
+    """
+    Extend the file object f to size bytes, reserving the disk space with
+    posix_fallocate so the file is laid out in few extents and a full disk
+    is noticed before anything is downloaded. Where that is not supported
+    the file is extended sparse.
+    """
+    fallocate = _posix_fallocate()
+    if fallocate and size:
+        err = fallocate(f.fileno(), 0, size)
+        if not err:
+            return
+        if err not in (errno.EINVAL, errno.EOPNOTSUPP, errno.ENOSYS):
+            raise IOError(err, os.strerror(err), f.name)
+    f.truncate(size)
+
+class Downloader(object):
+    """
+    Downloads files into box_dir.
+
+    Files of at least two chunks are fetched with up to C{parallel}
+    concurrent C{Range} requests written straight to their offset in a
+    preallocated temporary file. Completed chunks are recorded next to it
+    so an interrupted download resumes where it stopped, as long as the
+    remote ETag did not change. When the server ignores C{Range} the first
+    response is simply streamed to the end instead.
+
+    Files the client's L{Compression} picks are asked for with
+    C{Accept-Encoding: gzip} and inflated on their way to disk. Once the
+    server is seen to compress them, large ones are no longer split into
+    ranges, which do not mix with compression.
+
+    Downloads may be made conditional (see L{conditional_headers}), in
+    which case L{NotModified} is raised if the server answers 304 and the
+    local file is left alone.
+
+    Files larger than C{blocksize} are preallocated (see L{preallocate}).
+    Bodies are received into one buffer per thread, reused by every
+    download the thread runs.
+    """
+    blocksize = 64 * 1024
+
+    def __init__(self, client, chunk_size=8 * 1024 * 1024, parallel=4):
+        self.client = client
+        self.chunk_size = chunk_size
+        self.parallel = parallel
+        self._local = threading.local()
+
+    def download(self, path, local_path, size=None, mtime=None, etag=None, conditions=None):
+        """Fetch path into local_path. Returns the ETag of what was
+        downloaded."""
+        tmp_path = local_path + PART_SUFFIX
+        compress = self.client.compression.worth(path, size)
+        with self.client.metrics.span('download.file'):
+            if size is not None and self.parallel > 1 and size >= 2 * self.chunk_size and \
+                    not (compress and self.client.gzip_downloads):
+                etag = self._ranged(path, tmp_path, size, etag, conditions)
+            else:
+                headers = dict(conditions or {})
+                if compress:
+                    headers['Accept-Encoding'] = 'gzip'
+                with self.client.request('GET', path, headers=headers, expect=(200, 304)) as resp:
+                    if resp.status == 304:
+                        raise NotModified('GET', path, resp.getheader('etag'))
+                    encoding = (resp.getheader('content-encoding') or 'identity').lower()
+                    if encoding not in ('identity', 'gzip'):
+                        raise WebDAVError('GET', path, resp.status,
+                            "unsupported Content-Encoding '%s'" % encoding)
+                    if compress:
+                        self.client.gzip_downloads = encoding == 'gzip'
+                    with open(tmp_path, 'wb') as f:
+                        allocated = size is not None and size > self.blocksize
+                        if allocated:
+                            preallocate(f, size)
+                        self._stream(resp, f, gunzip() if encoding == 'gzip' else None)
+                        if allocated and f.tell() != size:
+                            # The file changed since it was listed.
+                            f.truncate()
+                    if encoding == 'identity' or etag is None:
+                        # A compressed response may carry an ETag of its
+                        # own, which the listing would never match.
+                        etag = resp.getheader('etag') or etag
+                    if mtime is None:
+                        mtime = parse_http_date(resp.getheader('last-modified'))
+            os.rename(tmp_path, local_path)
+            if mtime is not None:
+                os.utime(local_path, (mtime, mtime))
+        return etag
+
+    def _stream(self, resp, f, decompressor=None):
+        bucket = self.client.limiter.download
+        buf = getattr(self._local, 'buf', None)
+        if buf is None:
+            buf = self._local.buf = bytearray(self.blocksize)
+        view = memoryview(buf)
+        received = 0
+        while True:
+            n = resp.readinto(buf)
+            if not n:
+                break
+            bucket.consume(n)
+            received += n
+            if decompressor is None:
+                f.write(view[:n])
+                continue
+            # Inflate a block at a time, however well it compressed. zlib
+            # takes old-style buffers only.
+            data = decompressor.decompress(buffer(buf, 0, n), self.blocksize)
+            while decompressor.unconsumed_tail:
+                f.write(data)
+                data = decompressor.decompress(decompressor.unconsumed_tail, self.blocksize)
+            f.write(data)
+        if decompressor is not None:
+            f.write(decompressor.flush())
+            self.client.metrics.count('download.gzip_saved', f.tell() - received)
+        self.client.metrics.count('download.bytes', received)
+
+    def _load_state(self, tmp_path, size, etag):
+        state_path = tmp_path[:-len(PART_SUFFIX)] + CHUNKS_SUFFIX
+        if etag is None:
+            # Without an ETag there is no telling whether the chunks on disk
+            # still belong to the remote file.
+            return state_path, set()
+        try:
+            with open(state_path, 'rb') as f:
+                state = json.load(f)
+            if (state['size'], state['etag'], state['chunk_size']) == (size, etag, self.chunk_size) \
+                    and os.path.getsize(tmp_path) == size:
+                return state_path, set(state['done'])
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+        return state_path, set()
+
+    def _save_state(self, state_path, size, etag, done):
+        tmp_state = state_path + '.tmp'
+        with open(tmp_state, 'wb') as f:
+            json.dump({'size': size, 'etag': etag, 'chunk_size': self.chunk_size,
+                'done': sorted(done)}, f)
+        os.rename(tmp_state, state_path)
+
+    def _ranged(self, path, tmp_path, size, etag, conditions=None):
+        state_path, done = self._load_state(tmp_path, size, etag)
+        if not done:
+            with open(tmp_path, 'wb') as f:
+                preallocate(f, size)
+        chunks = [i for i in range(0, (size + self.chunk_size - 1) // self.chunk_size) if i not in done]
+        lock = threading.Lock()
+        errors = []
+
+        def fetch(i, resp=None):
+            start = i * self.chunk_size
+            end = min(start + self.chunk_size, size) - 1
+            if resp is None:
+                resp = self._request_range(path, start, end, etag)
+            with resp:
+                if resp.status != 206:
+                    raise WebDAVError('GET', path, resp.status, resp.reason)
+                with open(tmp_path, 'r+b') as f:
+                    f.seek(start)
+                    self._stream(resp, f)
+                    if f.tell() != end + 1:
+                        raise WebDAVError('GET', path, resp.status, "short read")
+            with lock:
+                done.add(i)
+                self._save_state(state_path, size, etag, done)
+
+        def work():
+            while True:
+                with lock:
+                    if not chunks or errors:
+                        return
+                    i = chunks.pop(0)
+                try:
+                    fetch(i)
+                except Exception as e:
+                    with lock:
+                        errors.append(e)
+
+        if chunks:
+            # The first request tells whether ranges are honoured at all.
+            i = chunks.pop(0)
+            start = i * self.chunk_size
+            resp = self._request_range(path, start, min(start + self.chunk_size, size) - 1, etag,
+                None if done else conditions)
+            if resp.status == 304:
+                resp.close()
+                for name in (tmp_path, state_path):
+                    if os.path.exists(name):
+                        os.remove(name)
+                raise NotModified('GET', path, resp.getheader('etag'))
+            if resp.status == 200:
+                with resp:
+                    with open(tmp_path, 'wb') as f:
+                        self._stream(resp, f)
+                    etag = resp.getheader('etag') or etag
+                if os.path.exists(state_path):
+                    os.remove(state_path)
+                return etag
+            fetch(i, resp)
+            threads = [threading.Thread(target=work) for n in range(min(self.parallel, len(chunks)))]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            if errors:
+                raise errors[0]
+        os.remove(state_path)
+        return etag
+
+    def _request_range(self, path, start, end, etag, conditions=None):
+        headers = dict(conditions or {})
+        headers['Range'] = 'bytes=%d-%d' % (start, end)
+        if etag:
+            headers['If-Range'] = etag
+        resp = self.client.request('GET', path, headers=headers, expect=(200, 206, 304))
+        if resp.status == 206:
+            match = CONTENT_RANGE.match(resp.getheader('content-range', ''))
+            if not match or int(match.group(1)) != start:
+                resp.close()
+                raise WebDAVError('GET', path, resp.status, "unexpected Content-Range")
+        return resp
@@ -0,0 +1,296 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+from noiselabs.box.sync.transfer import TEMP_SUFFIXES
+
+IN_MODIFY       = 0x00000002
+IN_ATTRIB       = 0x00000004
+IN_CLOSE_WRITE  = 0x00000008
+IN_MOVED_FROM   = 0x00000040
+IN_MOVED_TO     = 0x00000080
+IN_CREATE       = 0x00000100
+IN_DELETE       = 0x00000200
+IN_DELETE_SELF  = 0x00000400
+IN_MOVE_SELF    = 0x00000800
+IN_Q_OVERFLOW   = 0x00004000
+IN_IGNORED      = 0x00008000
+IN_ONLYDIR      = 0x01000000
+IN_MASK_ADD     = 0x20000000
+IN_ISDIR        = 0x40000000
+
+IN_CLOEXEC      = 02000000
+IN_NONBLOCK     = 04000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+    IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+class Inotify(object):
+    """A thin ctypes wrapper around the Linux inotify API."""
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise()
+        self._wake_r, self._wake_w = os.pipe()
+        self.closed = False
+
+    def _raise(self, path=None):
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err), path)
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self.libc.inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            self._raise(path)
+        return wd
+
+    def rm_watch(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout=None):
+        """
+        Wait up to timeout seconds for events and return them as a list of
+        (wd, mask, cookie, name) tuples. Returns early, with no events, if
+        L{wake} is called.
+        """
+        try:
+            ready = select.select([self.fd, self._wake_r], [], [], timeout)[0]
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+        if self._wake_r in ready:
+            os.read(self._wake_r, 4096)
+        if self.fd not in ready:
+            return []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset < len(buf):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(buf, offset)
+            offset += EVENT_HEADER.size
+            name = buf[offset:offset + length].rstrip('\0')
+            offset += length
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def wake(self):
+        """Interrupt a L{read} blocked in another thread."""
+        if not self.closed:
+            os.write(self._wake_w, 'x')
+
+    def close(self):
+        self.closed = True
+        os.close(self.fd)
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+class Watcher(object):
+    """
+    Reacts to local changes inside box_dir.
+
+    Bursts of events are coalesced into a single pending entry per path,
+    and a path is only pushed to the server once it has been quiet for
+    C{delay} seconds, so an editor's save dance or a build writing the same
+    file many times results in one upload of the final content. On queue
+    overflow only directories whose mtime moved are rescanned. A full sync
+    runs every C{interval} seconds to pick up remote changes.
+
+    Given a L{BoxConfig}, the configuration file is watched too and reloaded
+    as soon as it is rewritten.
+    """
+    def __init__(self, box_console, engine, delay=2.0, interval=600, config=None):
+        self.out = box_console
+        self.engine = engine
+        self.box_dir = engine.box_dir
+        self.delay = delay
+        self.interval = interval
+        self.config = config
+        self.config_wd = None
+        self.next_sync = None
+        self.stopped = False
+        self.inotify = Inotify()
+        self.wds = {}
+        self.dirs = {}
+        self.pending = {}
+        if config is not None:
+            config.subscribe(self.configure)
+
+    def configure(self, snapshot, previous=None):
+        """Apply the watch_delay and sync_interval of a L{ConfigSnapshot}."""
+        self.delay = snapshot.watch_delay
+        if snapshot.sync_interval != self.interval:
+            self.interval = snapshot.sync_interval
+            self.next_sync = time.time() + self.interval if self.interval else None
+
+    def relpath(self, path):
+        rel = os.path.relpath(path, self.box_dir)
+        return '' if rel == os.curdir else rel.replace(os.sep, '/')
+
+    def watch_tree(self, top, mark=False):
+        """
+        Add watches for top and all directories below it. Files found along
+        the way are marked as pending if mark is True, which is needed for
+        directories that were created or moved in: their content may predate
+        the watch. Excluded directories are not watched.
+        """
+        for dirpath, dirnames, filenames in os.walk(top):
+            if self.engine.filter:
+                reldir = self.relpath(dirpath)
+                if reldir and self.engine.filter.excludes(reldir, True):
+                    del dirnames[:]
+                    continue
+            try:
+                wd = self.inotify.add_watch(dirpath)
+                self.dirs[dirpath] = (wd, os.stat(dirpath).st_mtime)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    self.out.error("Out of inotify watches, raise fs.inotify.max_user_watches.")
+                    raise
+                continue
+            self.wds[wd] = dirpath
+            if mark:
+                self.mark(dirpath)
+                for name in filenames:
+                    self.mark(os.path.join(dirpath, name))
+
+    def unwatch_tree(self, top):
+        """Forget the watches of a directory that was moved away or deleted.
+        The kernel drops them by itself when the directory goes away."""
+        prefix = top + os.sep
+        for dirpath in [d for d in self.dirs if d == top or d.startswith(prefix)]:
+            wd = self.dirs.pop(dirpath)[0]
+            if self.wds.get(wd) == dirpath:
+                del self.wds[wd]
+
+    def mark(self, path, now=None):
+        if path.endswith(TEMP_SUFFIXES):
+            return
+        rel = self.relpath(path)
+        if rel and not (self.engine.filter and self.engine.filter.excludes(rel, os.path.isdir(path))):
+            self.pending[rel] = (now or time.time()) + self.delay
+
+    def handle(self, events):
+        now = time.time()
+        for wd, mask, cookie, name in events:
+            if mask & IN_Q_OVERFLOW:
+                self.out.warning("inotify queue overflowed, rescanning modified directories")
+                self.rescan()
+                continue
+            if mask & IN_IGNORED:
+                self.wds.pop(wd, None)
+                continue
+            if wd == self.config_wd and name == os.path.basename(self.config.filepath):
+                self.config.reload()
+            dirpath = self.wds.get(wd)
+            if dirpath is None:
+                continue
+            path = os.path.join(dirpath, name) if name else dirpath
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.watch_tree(path, mark=True)
+                elif mask & (IN_MOVED_FROM | IN_DELETE):
+                    self.unwatch_tree(path)
+            self.mark(path, now)
+
+    def rescan(self):
+        """
+        Find what happened while events were being dropped: the mtime of a
+        directory changes when entries are added, removed or renamed in it,
+        so only those directories need to be listed again. In-place changes
+        to existing files are caught by the next full sync.
+        """
+        for dirpath, (wd, mtime) in self.dirs.items():
+            try:
+                st = os.stat(dirpath)
+            except OSError:
+                self.unwatch_tree(dirpath)
+                self.mark(dirpath)
+                continue
+            if st.st_mtime == mtime:
+                continue
+            self.dirs[dirpath] = (wd, st.st_mtime)
+            self.mark(dirpath)
+            for name in os.listdir(dirpath):
+                path = os.path.join(dirpath, name)
+                if os.path.isdir(path) and path not in self.dirs:
+                    self.watch_tree(path, mark=True)
+                else:
+                    self.mark(path)
+            for rel, entry in self.engine.index.children(self.relpath(dirpath)):
+                self.mark(self.engine.local_path(rel))
+
+    def flush(self, force=False):
+        """Push the paths that have been quiet for long enough."""
+        now = time.time()
+        ready = [path for path, deadline in self.pending.items() if force or deadline <= now]
+        if not ready:
+            return
+        for path in ready:
+            del self.pending[path]
+        self.out.debug("Pushing %d changed paths" % len(ready))
+        self.engine.push(ready)
+
+    def run(self):
+        self.out.info("Watching '%s' for changes (Control-C to stop)..." % self.box_dir)
+        self.watch_tree(self.box_dir)
+        if self.config is not None:
+            self.config_wd = self.inotify.add_watch(os.path.dirname(self.config.filepath),
+                IN_CLOSE_WRITE | IN_MOVED_TO | IN_ONLYDIR | IN_MASK_ADD)
+        self.next_sync = time.time() + self.interval if self.interval else None
+        try:
+            while not self.stopped:
+                timeout = None
+                if self.pending:
+                    timeout = max(0, min(self.pending.values()) - time.time())
+                if self.next_sync is not None:
+                    until_sync = max(0, self.next_sync - time.time())
+                    timeout = until_sync if timeout is None else min(timeout, until_sync)
+                self.handle(self.inotify.read(timeout))
+                self.flush()
+                if self.next_sync is not None and time.time() >= self.next_sync:
+                    self.flush(force=True)
+                    self.engine.run()
+                    self.next_sync = time.time() + self.interval if self.interval else None
+        finally:
+            self.inotify.close()
+
+    def stop(self):
+        """Make L{run} return from another thread, once the sync or push in
+        progress is done."""
+        self.stopped = True
+        self.inotify.wake()
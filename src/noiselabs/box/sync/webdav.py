@@ -0,0 +1,521 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import base64
+import email.utils
+import errno
+import httplib
+import os
+import socket
+import threading
+import time
+import urllib
+import urlparse
+
+from collections import namedtuple
+from xml.etree import cElementTree as ElementTree
+
+from noiselabs.box.metrics import NULL_METRICS
+from noiselabs.box.sync.compression import Compression, gzip_file
+from noiselabs.box.sync.concurrency import THROTTLE_STATUSES, AdaptiveConcurrency
+from noiselabs.box.sync.throttle import BandwidthLimiter, ThrottledFile
+
+DAV_NS = '{DAV:}'
+
+PROPFIND_BODY = """<?xml version="1.0" encoding="utf-8"?>
+<D:propfind xmlns:D="DAV:">
+  <D:prop>
+    <D:resourcetype/>
+    <D:getcontentlength/>
+    <D:getlastmodified/>
+    <D:getetag/>
+  </D:prop>
+</D:propfind>
+"""
+
+DAVEntry = namedtuple('DAVEntry', 'path is_dir size mtime etag')
+"""A remote resource as reported by PROPFIND. C{path} is relative to the
+WebDAV root and never has leading or trailing slashes."""
+
+class WebDAVError(Exception):
+    """Raised when the server answers with an unexpected status code."""
+    def __init__(self, method, path, status, reason):
+        Exception.__init__(self, "%s %s failed: %d %s" % (method, path, status, reason))
+        self.method = method
+        self.path = path
+        self.status = status
+        self.reason = reason
+
+class NotModified(WebDAVError):
+    """Raised by conditional requests answered with 304 Not Modified: the
+    copy the client already holds is still current."""
+    def __init__(self, method, path, etag=None):
+        WebDAVError.__init__(self, method, path, 304, 'Not Modified')
+        self.etag = etag
+
+def parse_http_date(value):
+    """Convert a RFC 1123 date (as used by getlastmodified) to a timestamp."""
+    parsed = email.utils.parsedate_tz(value) if value else None
+    if parsed is None:
+        return None
+    return email.utils.mktime_tz(parsed)
+
+def format_http_date(timestamp):
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+def conditional_headers(etag=None, mtime=None):
+    """
+    Headers making a GET conditional on the remote file having changed
+    since the copy with the given ETag (or, lacking one, modification time)
+    was downloaded. Servers ignore If-Modified-Since when If-None-Match is
+    present, and its one second resolution could hide changes, so it is
+    only sent when no ETag is known.
+    """
+    if etag:
+        return {'If-None-Match': etag}
+    if mtime is not None:
+        return {'If-Modified-Since': format_http_date(mtime)}
+    return {}
+
+def weak_match(etag, other):
+    """Whether two ETags name the same version under the weak comparison
+    (RFC 7232), which ignores a W/ prefix."""
+    strip = lambda tag: tag[2:] if tag.startswith('W/') else tag
+    return etag is not None and other is not None and strip(etag) == strip(other)
+
+def parse_retry_after(value):
+    """Seconds to wait according to a Retry-After header (delta or date)."""
+    if not value:
+        return None
+    try:
+        return max(0, int(value))
+    except ValueError:
+        timestamp = parse_http_date(value)
+        return None if timestamp is None else max(0, timestamp - time.time())
+
+class _Tuned:
+    # Mixed into the httplib connection classes, which are old-style.
+    blocksize = 64 * 1024
+
+    def connect(self):
+        self.base.connect(self)
+        # Request headers and bodies go out in separate writes; with Nagle's
+        # algorithm the body would wait for the server to ACK the headers.
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send(self, data):
+        """Bodies that support readinto() are sent from one buffer kept
+        for the life of the connection instead of 8K strings."""
+        if not hasattr(data, 'readinto'):
+            return self.base.send(self, data)
+        if self.sock is None:
+            self.connect()
+        if getattr(self, '_sendbuf', None) is None:
+            self._sendbuf = bytearray(self.blocksize)
+        view = memoryview(self._sendbuf)
+        while True:
+            n = data.readinto(self._sendbuf)
+            if not n:
+                break
+            self.sock.sendall(view[:n])
+
+class HTTPConnection(_Tuned, httplib.HTTPConnection):
+    base = httplib.HTTPConnection
+
+class HTTPSConnection(_Tuned, httplib.HTTPSConnection):
+    base = httplib.HTTPSConnection
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of keep-alive HTTP(S) connections to a single host.
+
+    Connections are only handed out while the L{AdaptiveConcurrency}
+    controller allows another request in flight; every release reports the
+    request's latency and status back to it.
+    """
+    def __init__(self, url, concurrency, timeout=60):
+        parts = urlparse.urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        """The largest number of requests that may ever run at once."""
+        return self.concurrency.maximum
+
+    def _connect(self):
+        if self.scheme == 'https':
+            return HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def acquire(self, key=None):
+        """Returns an idle connection or opens a new one, blocking while the
+        pool is exhausted. Connections carry no credentials, so clients of
+        several accounts on one host may share a pool; key tells them apart
+        for fair scheduling."""
+        self.concurrency.acquire(key)
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def release(self, conn, reuse=True, latency=None, status=None, retry_after=None, key=None):
+        if reuse:
+            with self._lock:
+                self._idle.append(conn)
+        else:
+            conn.close()
+        self.concurrency.release(latency, status, retry_after, key)
+
+    def close(self):
+        with self._lock:
+            for conn in self._idle:
+                conn.close()
+            self._idle = []
+
+class DAVResponse(object):
+    """
+    Wraps a httplib response and gives its connection back to the pool once
+    the body has been consumed (or discards it if it was not).
+    """
+    def __init__(self, pool, conn, response, latency=None, key=None):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self.latency = latency
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = dict(response.getheaders())
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    def read(self, amt=None):
+        return self._response.read(amt)
+
+    def readinto(self, buf):
+        """
+        Read up to len(buf) bytes of the body into the writable buffer buf.
+        Returns how many, 0 at the end. Bodies of known length are received
+        straight from the socket, without a string per read.
+        """
+        response = self._response
+        fp = response.fp
+        if fp is None:
+            return 0
+        sock = getattr(fp, '_sock', None)
+        rbuf = getattr(fp, '_rbuf', None)
+        if response.chunked or response.length is None or sock is None or rbuf is None \
+                or rbuf.tell():
+            # Nothing to gain, or bytes already buffered by the file object.
+            data = response.read(len(buf))
+            buf[:len(data)] = data
+            return len(data)
+        if not response.length:
+            response.close()
+            return 0
+        view = memoryview(buf)[:response.length]
+        while True:
+            try:
+                n = sock.recv_into(view)
+                break
+            except socket.error as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+        if not n:
+            raise httplib.IncompleteRead('', response.length)
+        response.length -= n
+        if not response.length:
+            response.close()
+        return n
+
+    def close(self):
+        if self._conn is None:
+            return
+        reuse = self._response.isclosed() and not self._response.will_close
+        self._response.close()
+        self._pool.release(self._conn, reuse, self.latency, self.status,
+            parse_retry_after(self.getheader('retry-after')), self._key)
+        self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class WebDAVClient(object):
+    """
+    A minimal WebDAV client speaking directly to the server over a pool of
+    persistent connections. Every method is safe to call from several
+    threads at once. Transfers draw from the buckets of a
+    L{BandwidthLimiter}, which may be shared between clients, and so may
+    the L{ConnectionPool}: its requests are then scheduled fairly against
+    those of the other clients, which are told apart by C{name}.
+
+    Files chosen by C{compression}, a L{Compression}, are uploaded
+    gzip-compressed if the server says it accepts that, and downloaded
+    compressed if it is willing to (see L{Downloader}).
+
+    The time to the response headers of every request is observed as
+    C{http.<METHOD>} in C{metrics}, a L{Metrics} object.
+    """
+    retries = 5
+
+    def __init__(self, url, username=None, password=None, pool_size=4, timeout=60,
+            limiter=None, concurrency=None, metrics=NULL_METRICS, pool=None, name=None,
+            compression=None):
+        self.url = url.rstrip('/')
+        self.name = name
+        self.metrics = metrics
+        self.compression = compression if compression is not None else Compression()
+        # Whether the server takes compressed uploads and sends compressed
+        # downloads, None until known.
+        self.gzip_uploads = None
+        self.gzip_downloads = None
+        self._probe_lock = threading.Lock()
+        self.limiter = limiter if limiter is not None else BandwidthLimiter()
+        if concurrency is None:
+            concurrency = AdaptiveConcurrency(pool_size, adaptive=False)
+        self.root = urlparse.urlsplit(self.url).path.rstrip('/')
+        self._owns_pool = pool is None
+        self.pool = ConnectionPool(self.url, concurrency, timeout) if pool is None else pool
+        self.headers = {}
+        if username is not None:
+            credentials = base64.b64encode('%s:%s' % (username, password or ''))
+            self.headers['Authorization'] = 'Basic ' + credentials
+
+    def close(self):
+        if self._owns_pool:
+            self.pool.close()
+
+    def href(self, path):
+        """Build the request URI for a path relative to the WebDAV root."""
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        return urllib.quote(self.root + '/' + path.strip('/'))
+
+    def relpath(self, href):
+        """The inverse of href(): strip the WebDAV root from a server href."""
+        path = urllib.unquote(urlparse.urlsplit(href).path)
+        if path.startswith(self.root):
+            path = path[len(self.root):]
+        return path.strip('/')
+
+    def request(self, method, path, body=None, headers=None, expect=None):
+        """
+        Issue a request and return a L{DAVResponse}. The caller must close()
+        it (or read it to the end) so the connection returns to the pool.
+
+        @param expect: acceptable status codes, anything else raises
+            L{WebDAVError}
+        @type expect: tuple
+        """
+        hdrs = dict(self.headers)
+        if headers:
+            hdrs.update(headers)
+        uri = self.href(path)
+        attempt = 0
+        while True:
+            resp = self._send(method, uri, body, hdrs)
+            if resp.status not in THROTTLE_STATUSES or attempt >= self.retries:
+                break
+            # The server is shedding load: releasing the response lowers
+            # the concurrency limit and holds back every request for as
+            # long as Retry-After says, or for an exponential backoff.
+            resp.read()
+            if resp.getheader('retry-after') is None:
+                resp.headers['retry-after'] = str(2 ** attempt)
+            resp.close()
+            self.metrics.count('http.throttled')
+            attempt += 1
+            if hasattr(body, 'seek'):
+                body.seek(0)
+        if expect and resp.status not in expect:
+            resp.read()
+            resp.close()
+            raise WebDAVError(method, path, resp.status, resp.reason)
+        return resp
+
+    def _send(self, method, uri, body, headers):
+        # A keep-alive connection may have been closed by the server while
+        # idle, so retry once on a fresh one.
+        for attempt in (0, 1):
+            conn = self.pool.acquire(self.name)
+            started = time.time()
+            try:
+                conn.request(method, uri, body, headers)
+                response = conn.getresponse()
+                break
+            except (socket.error, httplib.HTTPException):
+                self.pool.release(conn, reuse=False, key=self.name)
+                self.metrics.count('http.reconnects')
+                if attempt:
+                    raise
+                if hasattr(body, 'seek'):
+                    body.seek(0)
+        elapsed = time.time() - started
+        self.metrics.observe('http.' + method, elapsed)
+        # Uploads spend most of that time sending the body, which says
+        # nothing about how loaded the server is.
+        latency = None if hasattr(body, 'read') else elapsed
+        return DAVResponse(self.pool, conn, response, latency, self.name)
+
+    def propfind(self, path, depth=1):
+        """
+        List a collection. Returns a list of L{DAVEntry}, the first one being
+        the collection itself.
+        """
+        return list(self.iter_propfind(path, depth))
+
+    def iter_propfind(self, path, depth=1):
+        """
+        Like propfind() but parses the multistatus response while it is
+        being received and yields every entry as soon as it is complete.
+        Parsed elements are discarded right away so memory use does not
+        depend on the size of the collection.
+        """
+        headers = {'Depth': str(depth), 'Content-Type': 'application/xml; charset="utf-8"'}
+        with self.request('PROPFIND', path, PROPFIND_BODY, headers, expect=(207,)) as resp:
+            root = None
+            for event, elem in ElementTree.iterparse(resp, events=('start', 'end')):
+                if root is None:
+                    root = elem
+                elif event == 'end' and elem.tag == DAV_NS + 'response':
+                    yield self._parse_response(elem)
+                    root.clear()
+
+    def _parse_response(self, elem):
+        path = self.relpath(elem.findtext(DAV_NS + 'href'))
+        is_dir, size, mtime, etag = False, 0, None, None
+        for propstat in elem.findall(DAV_NS + 'propstat'):
+            status = propstat.findtext(DAV_NS + 'status', '')
+            if ' 200 ' not in status:
+                continue
+            prop = propstat.find(DAV_NS + 'prop')
+            resourcetype = prop.find(DAV_NS + 'resourcetype')
+            if resourcetype is not None and resourcetype.find(DAV_NS + 'collection') is not None:
+                is_dir = True
+            size = int(prop.findtext(DAV_NS + 'getcontentlength') or 0)
+            mtime = parse_http_date(prop.findtext(DAV_NS + 'getlastmodified'))
+            etag = prop.findtext(DAV_NS + 'getetag')
+        return DAVEntry(path, is_dir, size, mtime, etag)
+
+    def put(self, local_path, path, if_match=None, if_none_match=None):
+        """
+        Upload a local file. Returns the new ETag if the server sent one.
+
+        @param if_match: only replace the remote file if it still has this
+            ETag, otherwise raise a L{WebDAVError} with status 412
+        @param if_none_match: C{'*'} to only create the remote file if it
+            does not exist yet
+        """
+        headers = {}
+        if if_match:
+            headers['If-Match'] = if_match
+        if if_none_match:
+            headers['If-None-Match'] = if_none_match
+        with open(local_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if self.compression.worth(path, size) and self.accepts_gzip():
+                body, length = gzip_file(f)
+                with body:
+                    if length < size:
+                        try:
+                            etag = self._upload(path, body, length,
+                                dict(headers, **{'Content-Encoding': 'gzip'}))
+                            self.metrics.count('upload.gzip_saved', size - length)
+                            return etag
+                        except WebDAVError as e:
+                            if e.status != 415:
+                                raise
+                            self.gzip_uploads = False
+                f.seek(0)
+            return self._upload(path, f, size, headers)
+
+    def _upload(self, path, f, size, headers):
+        headers['Content-Length'] = str(size)
+        body = ThrottledFile(f, self.limiter.upload)
+        with self.request('PUT', path, body, headers, expect=(200, 201, 204)) as resp:
+            resp.read()
+            self.metrics.count('upload.bytes', size)
+            return resp.getheader('etag')
+
+    def accepts_gzip(self):
+        """
+        Whether the server takes gzip-compressed uploads, which it tells by
+        listing gzip in the Accept-Encoding header of its answer to OPTIONS
+        (RFC 7694). The server is only asked once; one that does not answer
+        OPTIONS is taken not to.
+        """
+        with self._probe_lock:
+            if self.gzip_uploads is None:
+                try:
+                    with self.request('OPTIONS', '') as resp:
+                        resp.read()
+                        codings = resp.getheader('accept-encoding') or ''
+                except WebDAVError:
+                    codings = ''
+                self.gzip_uploads = 'gzip' in [coding.split(';')[0].strip().lower()
+                    for coding in codings.split(',')]
+            return self.gzip_uploads
+
+    def mkcol(self, path):
+        """Create a collection. An already existing one is not an error."""
+        with self.request('MKCOL', path, expect=(201, 405)) as resp:
+            resp.read()
+            return resp.status == 201
+
+    def move(self, path, destination):
+        """
+        Move a file or a whole collection on the server. An existing
+        destination is not overwritten: a L{WebDAVError} with status 412
+        is raised instead.
+        """
+        self._relocate('MOVE', path, destination)
+
+    def copy(self, path, destination, if_match=None):
+        """
+        Like move() but leaves the source in place. With if_match the copy
+        is only made while the source still has that ETag; 412 is raised
+        otherwise too.
+        """
+        self._relocate('COPY', path, destination, if_match)
+
+    def _relocate(self, method, path, destination, if_match=None):
+        parts = urlparse.urlsplit(self.url)
+        headers = {'Destination': '%s://%s%s' % (parts.scheme, parts.netloc, self.href(destination)),
+            'Overwrite': 'F'}
+        if if_match:
+            headers['If-Match'] = if_match
+        with self.request(method, path, headers=headers, expect=(201, 204)) as resp:
+            resp.read()
+
+    def delete(self, path):
+        with self.request('DELETE', path, expect=(200, 204, 404)) as resp:
+            resp.read()
@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+import Queue
+import threading
+
+class WorkerPool(object):
+    """
+    A pool of daemon threads consuming a shared task queue.
+
+    Tasks may submit further tasks; join() returns once the queue has been
+    drained, including anything submitted along the way. The pool can be
+    resized at any time; surplus threads leave after their current task.
+    """
+    def __init__(self, size=4, name='box-sync-worker'):
+        self.size = 0
+        self.name = name
+        self.queue = Queue.Queue()
+        self.errors = []
+        self._lock = threading.Lock()
+        self._threads = []
+        self._started = 0
+        self.resize(size)
+
+    def resize(self, size):
+        with self._lock:
+            for i in range(self.size, size):
+                t = threading.Thread(target=self._work, name='%s-%d' % (self.name, self._started))
+                t.daemon = True
+                t.start()
+                self._threads.append(t)
+                self._started += 1
+            for i in range(size, self.size):
+                self._retire()
+            self.size = size
+
+    def _retire(self):
+        """Queue a stop marker ahead of the waiting tasks."""
+        with self.queue.mutex:
+            self.queue.queue.appendleft(None)
+            self.queue.unfinished_tasks += 1
+            self.queue.not_empty.notify()
+
+    def submit(self, func, *args, **kwargs):
+        self.queue.put((func, args, kwargs))
+
+    def _work(self):
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None:
+                    with self._lock:
+                        self._threads.remove(threading.current_thread())
+                    return
+                func, args, kwargs = task
+                func(*args, **kwargs)
+            except Exception as e:
+                with self._lock:
+                    self.errors.append((task, e))
+            finally:
+                self.queue.task_done()
+
+    def join(self):
+        """Wait until every submitted task is done. Returns the errors raised
+        by the tasks since the last call."""
+        # Waiting with a timeout keeps the main thread responsive to signals.
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                self.queue.all_tasks_done.wait(0.5)
+        with self._lock:
+            errors, self.errors = self.errors, []
+        return errors
+
+    def cancel(self):
+        """Drop the tasks that have not started yet. Returns how many are
+        still running."""
+        retiring = 0
+        while True:
+            try:
+                task = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            self.queue.task_done()
+            if task is None:
+                retiring += 1
+        for i in range(retiring):
+            self._retire()
+        return self.queue.unfinished_tasks - retiring
+
+    def close(self):
+        self.resize(0)
+        with self._lock:
+            threads = list(self._threads)
+        for t in threads:
+            t.join()
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Fixtures driving the sync engine against a L{DAVServer} on a temporary
+directory.
+"""
+
+import pytest
+
+from noiselabs.box.sync.davserver import DAVServer
+from noiselabs.box.sync.engine import SyncEngine
+from noiselabs.box.sync.index import StateIndex
+from noiselabs.box.sync.journal import Journal
+from noiselabs.box.sync.webdav import WebDAVClient
+from noiselabs.box.test.helpers import RecordingConsole
+
+@pytest.fixture
+def remote(tmpdir):
+    return tmpdir.mkdir('remote')
+
+@pytest.fixture
+def local(tmpdir):
+    return tmpdir.mkdir('local')
+
+@pytest.fixture
+def server(remote):
+    server = DAVServer(str(remote)).start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def client(server):
+    client = WebDAVClient(server.url, pool_size=4)
+    yield client
+    client.close()
+
+@pytest.fixture
+def console():
+    return RecordingConsole()
+
+@pytest.fixture
+def make_engine(tmpdir, local, client, console):
+    """
+    Returns a function building a L{SyncEngine} for local and the server,
+    with its index and journal in tmpdir. Engines built again later pick
+    up the same index and journal, like a new process would.
+    """
+    engines = []
+
+    def close():
+        if engines:
+            engine = engines.pop()
+            engine.close()
+            engine.index.close()
+            engine.journal.close()
+
+    def make_engine():
+        close()
+        engines.append(SyncEngine(console, client, str(local), 4,
+            StateIndex(str(tmpdir.join('index.db'))),
+            journal=Journal(str(tmpdir.join('journal.log')))))
+        return engines[-1]
+
+    yield make_engine
+    close()
@@ -0,0 +1,82 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Helpers shared by the tests.
+"""
+
+import os
+
+from noiselabs.box.metrics import Metrics
+
+class RecordingConsole(object):
+    """Stands in for L{BoxConsole}, keeping what was logged by level."""
+    def __init__(self):
+        self.metrics = Metrics()
+        self.messages = dict((level, []) for level in ('debug', 'info', 'warning', 'error'))
+
+    def debug(self, msg):
+        self.messages['debug'].append(msg)
+
+    def info(self, msg):
+        self.messages['info'].append(msg)
+
+    def warning(self, msg):
+        self.messages['warning'].append(msg)
+
+    def error(self, msg):
+        self.messages['error'].append(msg)
+
+    def span(self, name):
+        return self.metrics.span(name)
+
+    def count(self, name, amount=1):
+        self.metrics.count(name, amount)
+
+    def observe(self, name, value):
+        self.metrics.observe(name, value)
+
+def write(root, path, data):
+    """Write data to the file at the relative path, creating its parents."""
+    filepath = os.path.join(str(root), *path.split('/'))
+    if not os.path.isdir(os.path.dirname(filepath)):
+        os.makedirs(os.path.dirname(filepath))
+    with open(filepath, 'wb') as f:
+        f.write(data)
+
+def read(root, path):
+    with open(os.path.join(str(root), *path.split('/')), 'rb') as f:
+        return f.read()
+
+def tree(root):
+    """Every file below root, as a dict of relative paths to contents."""
+    root = str(root)
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.relpath(os.path.join(dirpath, name), root).replace(os.sep, '/')
+            files[path] = read(root, path)
+    return files
+
+def requests(server):
+    """The number of requests served since the last call, by method."""
+    return dict((method, len(timings)) for method, timings in server.reset_stats().items())
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Tests for the benchmark scenarios.
+"""
+
+import hashlib
+import os
+
+from noiselabs.box.sync.bench import SCENARIOS, Benchmark, make_huge, write_file
+from noiselabs.box.test.helpers import RecordingConsole
+
+def digests(root):
+    return [hashlib.sha1(open(os.path.join(root, name), 'rb').read()).hexdigest()
+        for name in sorted(os.listdir(root))]
+
+def test_write_file(tmpdir):
+    path = str(tmpdir.join('f'))
+    write_file(path, 3 * 1024 * 1024 + 5)
+    assert os.path.getsize(path) == 3 * 1024 * 1024 + 5
+
+def test_huge_files_are_distinct(tmpdir):
+    # Identical files would be deduplicated into server-side copies and the
+    # scenario would no longer measure transfers.
+    make_huge(str(tmpdir), 1.0 / 64)
+    assert len(set(digests(str(tmpdir)))) == 4
+
+def test_scenarios(tmpdir):
+    for name, make in SCENARIOS.items():
+        root = tmpdir.mkdir(name)
+        make(str(root), 0.01)
+        assert os.listdir(str(root))
+
+def test_benchmark():
+    small = Benchmark(RecordingConsole(), scale=0.01).run(['small'])['scenarios']['small']
+    assert small['files'] == 20
+    for phase in Benchmark.phases:
+        assert small[phase]['ok']
+    assert small['upload']['requests']['PUT'] == 20
+    assert list(small['rescan']['requests']) == ['PROPFIND']
+    assert small['download']['requests']['GET'] == 20
+
+def test_copies_benchmark():
+    copies = Benchmark(RecordingConsole(), scale=0.1).run_scenario('copies')
+    # The second folder is copied from the first one on the server.
+    assert copies['upload']['requests']['COPY'] == 4
+    assert copies['upload']['bytes_copied'] == copies['bytes'] / 2
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Tests for the adaptive concurrency controller.
+"""
+
+import threading
+import time
+
+from noiselabs.box.sync.concurrency import AdaptiveConcurrency
+
+def served(controller, count, latency=0.01, status=200, key=None):
+    for i in range(count):
+        controller.acquire(key)
+        controller.release(latency, status, key=key)
+
+def wait_until(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+def test_additive_increase():
+    controller = AdaptiveConcurrency(2, 8)
+    # About one more per round of requests: 2 + 4 take it past 4.
+    served(controller, 6)
+    assert controller.size == 4
+    served(controller, 100)
+    assert controller.size == 8
+    assert controller.summary() == "limit 8 (2 -> 8)"
+
+def test_slow_responses_back_off():
+    controller = AdaptiveConcurrency(8, 8)
+    served(controller, 10, latency=0.01)
+    served(controller, 1, latency=0.5)
+    assert controller.size == 6
+    # Once per cooldown only: a burst of slow responses is one signal.
+    served(controller, 3, latency=0.5)
+    assert controller.size == 6
+    controller._last_decrease -= controller.cooldown
+    served(controller, 1, latency=0.5)
+    assert controller.size == 4
+
+def test_throttling_halves_the_limit():
+    controller = AdaptiveConcurrency(8, 8)
+    served(controller, 1, status=503)
+    assert controller.size == 4
+    controller._last_decrease -= controller.cooldown
+    served(controller, 1, status=429)
+    assert controller.size == 2
+    assert 'throttled (429)' in controller.summary()
+
+def test_fixed_limit():
+    controller = AdaptiveConcurrency(4, 16, adaptive=False)
+    served(controller, 50)
+    served(controller, 1, status=503)
+    assert controller.size == 4
+    controller.configure(6, adaptive=False)
+    assert controller.size == 6
+
+def test_retry_after():
+    controller = AdaptiveConcurrency(4, adaptive=False)
+    controller.acquire()
+    controller.release(0.01, 503, retry_after=0.3)
+    started = time.time()
+    controller.acquire()
+    assert time.time() - started > 0.25
+    controller.release(0.01, 200)
+
+def test_free_slots_go_to_the_least_busy_key():
+    controller = AdaptiveConcurrency(2, adaptive=False)
+    controller.acquire('busy')
+    controller.acquire('busy')
+    acquired = []
+
+    def acquire(key):
+        controller.acquire(key)
+        acquired.append(key)
+    threads = [threading.Thread(target=acquire, args=(key,)) for key in ('busy', 'idle')]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: len(controller.waiting) == 2)
+    controller.release(key='busy')
+    wait_until(lambda: acquired)
+    assert acquired == ['idle']
+    controller.release(key='busy')
+    wait_until(lambda: len(acquired) == 2)
+    for thread in threads:
+        thread.join()
+    assert controller.inflight == 2
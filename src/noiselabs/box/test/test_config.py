@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Tests for the typed configuration loader.
+"""
+
+import os
+
+import pytest
+
+from noiselabs.box.config import BoxConfig, ConfigError
+from noiselabs.box.test.helpers import RecordingConsole
+
+@pytest.fixture
+def config(tmpdir):
+    config = BoxConfig(RecordingConsole())
+    config.filepath = str(tmpdir.join('box-sync.cfg'))
+    return config
+
+def rewrite(config, text):
+    """Write the file, making sure its stat changes even within one tick."""
+    stamp = config._stamp()
+    with open(config.filepath, 'w') as f:
+        f.write(text)
+    if stamp is not None and config._stamp() == stamp:
+        os.utime(config.filepath, (stamp[0] + 1, stamp[0] + 1))
+
+def test_defaults(config):
+    config.write_default_config(config.filepath)
+    snapshot = config.load()
+    assert snapshot.missing == ()
+    assert config.check_config()
+    assert snapshot.box_dir == os.path.join(os.path.expanduser('~'), 'Box')
+    assert snapshot.use_davfs is True
+    assert snapshot.workers == 4
+    assert snapshot.chunk_size == 8 * 1024 * 1024
+    assert snapshot.compress_min_size == 4096
+    assert '.txt' in snapshot.compress and 'text/*' in snapshot.compress
+    assert snapshot.exclude == ()
+    assert snapshot.targets == {}
+
+def test_missing_options_use_the_defaults(config):
+    rewrite(config, "[main]\nworkers = 8\nexclude = *.tmp\n    # comment\n    /build/\n")
+    snapshot = config.load()
+    assert snapshot.workers == 8
+    assert snapshot.exclude == ('*.tmp', '/build/')
+    assert snapshot.sync_interval == 600
+    assert 'sync_interval' in snapshot.missing and 'workers' not in snapshot.missing
+    assert not config.check_config()
+    assert config.get('workers') == '8'
+    assert config.getsize('chunk_size') == 8 * 1024 * 1024
+
+@pytest.mark.parametrize('value, size', [('0', 0), ('512', 512), ('4K', 4096), ('1.5m', 1572864),
+    ('2G', 2 * 1024 ** 3), ('64kb', 65536)])
+def test_sizes(config, value, size):
+    assert config.to_size(value) == size
+
+def test_snapshots_are_cached_until_the_file_changes(config):
+    rewrite(config, "[main]\nworkers = 8\n")
+    snapshot = config.load()
+    assert config.load() is snapshot
+    rewrite(config, "[main]\nworkers = 16\n")
+    assert config.load() is not snapshot
+    assert config.load().workers == 16
+
+def test_invalid_values(config):
+    rewrite(config, "[main]\nworkers = many\n")
+    with pytest.raises(ConfigError):
+        config.load()
+    rewrite(config, "[main]\nuse_davfs = maybe\n")
+    with pytest.raises(ConfigError):
+        config.load()
+
+def test_reload(config):
+    rewrite(config, "[main]\nworkers = 4\n")
+    seen = []
+    config.subscribe(lambda snapshot, previous: seen.append((snapshot, previous)))
+    first = config.reload()
+    assert seen == [(first, None)]
+    assert config.reload() is None
+    rewrite(config, "[main]\nworkers = 8\nbox_dir = Elsewhere\n")
+    second = config.reload()
+    assert seen[-1] == (second, first)
+    assert second.changed(first) == ['box_dir', 'workers']
+    # box_dir cannot change under a running sync.
+    assert config.out.messages['warning'] == ["Restart box-sync to apply: box_dir"]
+    rewrite(config, "[main]\nworkers = lots\n")
+    assert config.reload() is None
+    assert config.snapshot is second
+    assert 'Keeping the previous configuration' in config.out.messages['error'][0]
+    assert len(seen) == 2
+
+def test_targets(config):
+    rewrite(config, "\n".join([
+        "[main]",
+        "dav_url = https://main.example.com/dav",
+        "exclude = *.tmp",
+        "[target:work]",
+        "box_dir = /srv/work",
+        "dav_url = https://work.example.com/dav",
+        "[target:photos]",
+        "box_dir = Photos",
+        "exclude = *.raw",
+        ""]))
+    targets = config.load().targets
+    assert list(targets) == ['work', 'photos']
+    work, photos = targets['work'], targets['photos']
+    assert (work.name, work.box_dir, work.dav_url, work.exclude) == (
+        'work', '/srv/work', 'https://work.example.com/dav', ('*.tmp',))
+    assert photos.box_dir == os.path.join(os.path.expanduser('~'), 'Photos')
+    assert (photos.dav_url, photos.exclude) == ('https://main.example.com/dav', ('*.raw',))
+
+def test_changed_targets(config):
+    rewrite(config, "[main]\n[target:a]\nbox_dir = /a\n")
+    first = config.load()
+    rewrite(config, "[main]\n[target:a]\nbox_dir = /a\nexclude = *.tmp\n")
+    second = config.load()
+    assert second.changed(first) == ['exclude']
+    rewrite(config, "[main]\n[target:a]\nbox_dir = /a\nexclude = *.tmp\n[target:b]\nbox_dir = /b\n")
+    assert config.load().changed(second) == ['targets']
+
+@pytest.mark.parametrize('text', [
+    "[main]\n[target:no_box_dir]\ndav_url = x\n",
+    "[main]\n[target:bad name]\nbox_dir = /a\n",
+    "[main]\n[target:main]\nbox_dir = /a\n",
+    "[main]\nbox_dir = /a\n[target:same]\nbox_dir = /a\n",
+])
+def test_invalid_targets(config, text):
+    rewrite(config, text)
+    with pytest.raises(ConfigError):
+        config.load()
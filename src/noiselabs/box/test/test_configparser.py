@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Tests for the parsers of whitespace delimited files.
+"""
+
+import os
+import stat
+
+from noiselabs.box.configparser import FstabConfigParser, WhitespaceDelimitedConfigParser
+
+SECRETS = """# davfs2 secrets file
+
+https://dav.box.com/dav me@example.com "my secret # password"
+/home/me/Box other@example.com plain
+"""
+
+def test_lookups(tmpdir):
+    path = tmpdir.join('secrets')
+    path.write(SECRETS)
+    secrets = WhitespaceDelimitedConfigParser(str(path))
+    assert secrets.get_option('https://dav.box.com/dav') == \
+        ['https://dav.box.com/dav', 'me@example.com', 'my secret # password']
+    assert secrets.get_option('other@example.com', index=1)[0] == '/home/me/Box'
+    assert secrets.get_option('nowhere') is False
+    assert secrets.options() == ['https://dav.box.com/dav', '/home/me/Box']
+
+def test_missing_file(tmpdir):
+    parser = WhitespaceDelimitedConfigParser()
+    assert not parser.read(str(tmpdir.join('missing')))
+    assert parser.get_option('anything') is False
+
+def test_edit_and_write(tmpdir):
+    path = tmpdir.join('secrets')
+    path.write(SECRETS)
+    os.chmod(str(path), 0600)
+    secrets = WhitespaceDelimitedConfigParser(str(path))
+    assert not secrets.set_option(['/home/me/Box', 'other@example.com', 'plain'])
+    assert secrets.set_option(['/home/me/Box', 'other@example.com', 'new "pass"'])
+    assert secrets.set_option(['https://other/dav', 'x@example.com', 'y'])
+    assert secrets.remove_option('https://dav.box.com/dav') == 1
+    secrets.write()
+
+    assert stat.S_IMODE(os.stat(str(path)).st_mode) == 0600
+    # Comments and blank lines are kept as they were.
+    assert path.read() == ('# davfs2 secrets file\n'
+        '\n'
+        '/home/me/Box other@example.com "new \\"pass\\""\n'
+        'https://other/dav x@example.com y\n')
+    again = WhitespaceDelimitedConfigParser(str(path))
+    assert again.get_option('/home/me/Box')[2] == 'new "pass"'
+    assert again.get_option('https://other/dav')[2] == 'y'
+    assert tmpdir.listdir() == [path]
+
+def test_new_file(tmpdir):
+    path = str(tmpdir.join('davfs2.conf'))
+    conf = WhitespaceDelimitedConfigParser(path)
+    conf.set_option(['use_locks', 0])
+    conf.write()
+    assert open(path).read() == 'use_locks 0\n'
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0644
+
+def test_fstab_escapes(tmpdir):
+    path = tmpdir.join('fstab')
+    path.write('# <file system> <dir> <type> <options> <dump> <pass>\n'
+        'UUID=1234 / ext4 defaults 0 1\n'
+        'https://dav.box.com/dav /home/me/My\\040Box davfs rw,user,noauto 0 0\n')
+    fstab = FstabConfigParser(str(path))
+    assert fstab.get_option('/home/me/My Box', index=1)[0] == 'https://dav.box.com/dav'
+    assert fstab.get_option('/') is False
+
+    # The mount point moved to another URL: the line is replaced.
+    assert fstab.set_option(['https://new/dav', '/home/me/My Box', 'davfs',
+        'rw,user,noauto', '0', '0'], index=1)
+    fstab.write()
+    lines = path.read().splitlines()
+    assert lines[:2] == ['# <file system> <dir> <type> <options> <dump> <pass>',
+        'UUID=1234 / ext4 defaults 0 1']
+    assert lines[2] == 'https://new/dav /home/me/My\\040Box davfs rw,user,noauto 0 0'
+    assert FstabConfigParser(str(path)).get_option('https://new/dav')[1] == '/home/me/My Box'
@@ -0,0 +1,102 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Tests for stopping the targets served by the daemon.
+"""
+
+import time
+
+import pytest
+
+from noiselabs.box.config import BoxConfig
+from noiselabs.box.sync import daemon as daemon_module
+from noiselabs.box.sync.daemon import SyncDaemon
+from noiselabs.box.sync.hashing import HashCache
+from noiselabs.box.test.helpers import RecordingConsole, tree, write
+
+class FakeSetup(object):
+    def __init__(self, config):
+        self.config = config
+
+    def get_credentials(self, url, box_dir=None):
+        return (None, None)
+
+@pytest.fixture
+def daemon(tmpdir, local, server, monkeypatch):
+    """A daemon serving local as target 'work', keeping its state in tmpdir."""
+    state = tmpdir.mkdir('state')
+    monkeypatch.setattr(daemon_module, 'BASEDIR', str(state))
+    monkeypatch.setattr(HashCache, 'filepath', str(state.join('hashes.db')))
+    console = RecordingConsole()
+    config = BoxConfig(console)
+    config.filepath = str(tmpdir.join('box-sync.cfg'))
+    with open(config.filepath, 'w') as f:
+        f.write("[main]\nbox_dir = %s\ndav_url = %s\n\n[target:work]\nbox_dir = %s\n" % (
+            tmpdir.join('davfs'), server.url, local))
+    daemon = SyncDaemon(console, FakeSetup(config))
+    yield daemon
+    daemon.stop()
+
+def start(daemon):
+    for target in daemon.targets:
+        target.thread.start()
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+def test_stop_cancels_the_first_sync(daemon, local, remote, server):
+    for i in range(200):
+        write(local, 'f%03d' % i, 'file %d' % i)
+    server.latency = 0.02
+    target, = daemon.targets
+    start(daemon)
+    assert wait_for(lambda: tree(remote))
+    daemon.stop()
+    assert not target.thread.is_alive()
+    assert not target.failed
+    assert 0 < len(tree(remote)) < 200
+    assert "[work] Stopped syncing '%s'" % local in daemon.out.messages['info']
+
+def test_stop_while_watching(daemon, local, remote):
+    write(local, 'a.txt', 'data')
+    target, = daemon.targets
+    start(daemon)
+    assert wait_for(lambda: target.watcher is not None)
+    assert tree(remote) == {'a.txt': 'data'}
+    daemon.stop()
+    assert not target.thread.is_alive()
+    assert not target.failed
+    assert target.watcher.stopped
+
+def test_stop_before_starting(daemon, local, remote):
+    write(local, 'a.txt', 'data')
+    target, = daemon.targets
+    target.stop()
+    start(daemon)
+    target.thread.join(5)
+    assert not target.thread.is_alive()
+    assert target.engine is not None and target.watcher is None
+    assert tree(remote) == {}
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Tests for the davfs2.conf generator.
+"""
+
+from noiselabs.box.davfs import DEFAULTS, PRESETS, diff, guess_preset, render, tune
+
+MIB = 1024 * 1024
+
+def test_untouched_preset():
+    assert tune('workstation', {}) == PRESETS['workstation']
+
+def test_tune():
+    options = tune('workstation', {'free_disk': 400 * MIB, 'entries': 100000,
+        'ram': 1024 * MIB, 'latency': 0.25})
+    # A quarter of the free disk.
+    assert options['cache_size'] == 100
+    assert options['table_size'] == 131072
+    assert options['buf_size'] == 32
+    # Twice the refresh intervals for a 250 ms round trip.
+    assert options['dir_refresh'] == 2 * PRESETS['workstation']['dir_refresh']
+    assert options['file_refresh'] == 2 * PRESETS['workstation']['file_refresh']
+
+def test_tune_bounds():
+    options = tune('laptop', {'free_disk': 0, 'entries': 10 ** 9, 'ram': 0, 'latency': 10})
+    assert options['cache_size'] == DEFAULTS['cache_size']
+    assert options['table_size'] == 1 << 20
+    assert options['buf_size'] == DEFAULTS['buf_size']
+    assert options['dir_refresh'] == 4 * PRESETS['laptop']['dir_refresh']
+
+def test_guess_preset():
+    assert guess_preset({'battery': True}) == 'laptop'
+    assert guess_preset({'battery': False}) == 'workstation'
+
+def test_render_keeps_other_settings_and_sections():
+    existing = "\n".join([
+        "# old comment",
+        "cache_size 10",
+        "proxy proxy.example.com:8080",
+        "",
+        "[/home/me/Box]",
+        "cache_size 20",
+        ""])
+    conf = render(tune('server', {}), 'server', existing)
+    lines = conf.splitlines()
+    assert lines[0] == "# davfs2 configuration file"
+    assert "cache_size %d" % PRESETS['server']['cache_size'] in lines
+    assert "cache_size 10" not in lines and "# old comment" not in lines
+    kept = lines[lines.index("# Kept from the previous configuration") + 1:]
+    assert kept == ["proxy proxy.example.com:8080", "", "[/home/me/Box]", "cache_size 20"]
+
+def test_render_from_scratch():
+    conf = render(PRESETS['laptop'], 'laptop')
+    assert "Kept from" not in conf
+    assert conf.count("(davfs2 default: ") == len(PRESETS['laptop'])
+
+def test_diff_ignores_the_header():
+    old = render(PRESETS['laptop'], 'laptop')
+    assert diff(old, old.replace('# Created by', '# Created by someone else, by'), 'davfs2.conf') == ''
+    changed = diff(old, render(PRESETS['server'], 'server'), 'davfs2.conf')
+    assert changed.startswith('--- davfs2.conf\n+++ davfs2.conf (tuned)\n')
+    assert '-cache_size %d\n' % PRESETS['laptop']['cache_size'] in changed
+    assert '+cache_size %d\n' % PRESETS['server']['cache_size'] in changed
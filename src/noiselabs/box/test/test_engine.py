@@ -0,0 +1,255 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+End to end tests of the sync engine against the stand-in WebDAV server.
+"""
+
+import errno
+import os
+import threading
+import time
+
+from noiselabs.box.sync import scanner
+from noiselabs.box.sync.engine import MIN_COPY_SIZE, Cancelled, SyncEngine
+from noiselabs.box.sync.index import StateIndex
+from noiselabs.box.sync.journal import Journal
+from noiselabs.box.test.helpers import read, requests, tree, write
+
+def test_first_sync(make_engine, local, remote):
+    write(local, 'a.txt', 'local file')
+    write(local, 'docs/b.txt', 'nested local file')
+    write(remote, 'c.txt', 'remote file')
+    write(remote, 'photos/d.jpg', 'nested remote file')
+    assert make_engine().run()
+    assert tree(local) == tree(remote)
+    assert len(tree(local)) == 4
+
+def test_nothing_to_do(make_engine, local, server):
+    write(local, 'a.txt', 'data')
+    engine = make_engine()
+    assert engine.run()
+    requests(server)
+    assert engine.run()
+    assert requests(server) == {'PROPFIND': 1}
+
+def test_edits(make_engine, local, remote):
+    write(local, 'up.txt', 'v1')
+    write(local, 'down.txt', 'v1')
+    engine = make_engine()
+    assert engine.run()
+    write(local, 'up.txt', 'version 2')
+    write(remote, 'down.txt', 'version 2')
+    assert engine.run()
+    assert read(remote, 'up.txt') == read(local, 'down.txt') == 'version 2'
+    assert tree(local) == tree(remote)
+
+def test_deletes(make_engine, local, remote):
+    for path in ('gone-here.txt', 'gone-there.txt', 'dir/f.txt'):
+        write(local, path, path)
+    engine = make_engine()
+    assert engine.run()
+    os.remove(str(local.join('gone-here.txt')))
+    os.remove(str(remote.join('gone-there.txt')))
+    remote.join('dir').remove()
+    assert engine.run()
+    assert sorted(tree(local)) == sorted(tree(remote)) == []
+
+def test_unreadable_directories_are_not_deleted(make_engine, local, remote, server, console,
+        monkeypatch):
+    write(local, 'docs/a.txt', 'a')
+    write(local, 'b.txt', 'b')
+    engine = make_engine()
+    assert engine.run()
+    read_dir = scanner.read_dir
+
+    def failing_read_dir(path):
+        if path == str(local.join('docs')):
+            raise OSError(errno.EACCES, "Permission denied", path)
+        return read_dir(path)
+    monkeypatch.setattr(scanner, 'read_dir', failing_read_dir)
+    requests(server)
+    assert not engine.run()
+    assert list(requests(server)) == ['PROPFIND']
+    assert tree(remote) == {'docs/a.txt': 'a', 'b.txt': 'b'}
+    assert console.messages['error'][-1] == "Failed to scan local files, nothing was synchronized."
+    monkeypatch.undo()
+    assert engine.run()
+    assert engine.index.get('docs/a.txt') is not None
+
+def test_unindexed_files_of_the_same_size(make_engine, local, remote, server, console):
+    # Files found on both sides before the first sync.
+    for name in ('same-mtime.txt', 'same-content.txt', 'differs.txt'):
+        write(remote, name, 'remote version')
+    write(local, 'same-mtime.txt', 'remote version')
+    write(local, 'same-content.txt', 'remote version')
+    write(local, 'differs.txt', 'local  version')
+    os.utime(str(local.join('same-content.txt')), (1000000000, 1000000000))
+    os.utime(str(local.join('differs.txt')), (1000000000, 1000000000))
+    st = os.stat(str(remote.join('same-mtime.txt')))
+    os.utime(str(local.join('same-mtime.txt')), (st.st_atime, st.st_mtime))
+    requests(server)
+    assert make_engine().run()
+    # Both files with other modification times are read back to compare,
+    # and only the one that differs is then downloaded.
+    counts = requests(server)
+    assert counts.get('GET') == 3 and 'PUT' not in counts
+    assert console.messages['warning'] == [
+        "'differs.txt' differs between both sides, keeping the most recent copy"]
+    assert tree(local) == tree(remote)
+    assert read(local, 'differs.txt') == 'remote version'
+
+def test_recovery(make_engine, local, remote, client, tmpdir, console):
+    for name in 'abc':
+        write(local, name, name * 1000)
+    engine = make_engine()
+    assert engine.run()
+    engine.journal.close()
+    # A run killed while uploading: a and b made it to the server but were
+    # never journaled as done, c was changed on the server meanwhile and d
+    # never got there.
+    time.sleep(0.01)
+    for name in 'abcd':
+        write(local, name, name.upper() * 2000)
+    client.put(str(local.join('a')), 'a')
+    client.put(str(local.join('b')), 'b')
+    write(remote, 'c', 'z' * 2000)
+    journal = Journal(str(tmpdir.join('journal.log')))
+    for name in 'abcd':
+        journal.planned(engine.generation + 1, 'put', name)
+    journal.close()
+    del console.messages['warning'][:]
+    engine = make_engine()
+    engine.recover()
+    conflicts = [msg for msg in console.messages['warning'] if 'changed on the server' in msg]
+    assert conflicts == ["'c' changed on the server during the sync, not overwriting it"]
+    assert read(remote, 'd') == 'D' * 2000
+    assert engine.index.get('a').etag is not None
+    assert engine.run()
+    assert tree(local) == tree(remote)
+
+def test_conditional_download(make_engine, local, remote, server, console):
+    # Apache lists recently modified files with weak ETags while GET
+    # answers with strong ones: the file did not change, and a conditional
+    # GET saves downloading it again.
+    write(remote, 'a.txt', 'x' * 100000)
+    server.weak_etags = True
+    engine = make_engine()
+    assert engine.run()
+    requests(server)
+    before = dict(engine.stats)
+    assert engine.run()
+    assert requests(server).get('GET') == 1
+    assert engine.stats['not_modified'] - before['not_modified'] == 1
+    assert engine.stats['get'] == before['get']
+    assert any('100% hit ratio' in msg for msg in console.messages['info'])
+    # A listing showing another version is downloaded without conditions.
+    write(remote, 'a.txt', 'y' * 200000)
+    before = dict(engine.stats)
+    assert engine.run()
+    assert read(local, 'a.txt') == 'y' * 200000
+    assert engine.stats['conditional'] == before['conditional']
+
+def test_cancel(tmpdir, local, remote, server, client, console):
+    for i in range(200):
+        write(local, 'f%03d' % i, 'file %d' % i)
+    server.latency = 0.02
+    started = threading.Event()
+    engines = []
+    errors = []
+    indexed = []
+
+    def run():
+        # The index may only be used by the thread that opened it.
+        index = StateIndex(str(tmpdir.join('index.db')))
+        engines.append(SyncEngine(console, client, str(local), 4, index))
+        started.set()
+        try:
+            engines[0].run()
+        except Cancelled as e:
+            errors.append(e)
+        indexed.extend(path for path, entry in index.load().items() if not entry.is_dir)
+        engines[0].close()
+        index.close()
+    thread = threading.Thread(target=run)
+    thread.start()
+    started.wait(5)
+    time.sleep(0.5)
+    engines[0].cancel()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert len(errors) == 1
+    uploaded = set(tree(remote))
+    assert 0 < len(uploaded) < 200
+    assert uploaded == set(indexed)
+
+def test_local_directory_rename_is_one_move(make_engine, local, remote, server):
+    for i in range(10):
+        write(local, 'old/f%d.txt' % i, 'content %d' % i)
+    engine = make_engine()
+    assert engine.run()
+    os.rename(str(local.join('old')), str(local.join('new')))
+    requests(server)
+    assert engine.run()
+    counts = requests(server)
+    assert counts.get('MOVE') == 1
+    assert 'PUT' not in counts and 'DELETE' not in counts
+    assert tree(local) == tree(remote)
+    assert not remote.join('old').exists()
+
+def test_remote_rename_is_a_local_rename(make_engine, local, remote, server):
+    write(local, 'a.txt', 'renamed on the server')
+    engine = make_engine()
+    assert engine.run()
+    inode = os.stat(str(local.join('a.txt'))).st_ino
+    os.rename(str(remote.join('a.txt')), str(remote.join('b.txt')))
+    requests(server)
+    assert engine.run()
+    assert 'GET' not in requests(server)
+    assert os.stat(str(local.join('b.txt'))).st_ino == inode
+    assert tree(local) == tree(remote)
+
+def test_known_content_is_copied_on_the_server(make_engine, local, remote, server):
+    data = os.urandom(MIN_COPY_SIZE)
+    write(local, 'a.bin', data)
+    engine = make_engine()
+    assert engine.run()
+    write(local, 'copy/a.bin', data)
+    requests(server)
+    assert engine.run()
+    counts = requests(server)
+    assert counts.get('COPY') == 1 and 'PUT' not in counts
+    assert read(remote, 'copy/a.bin') == data
+
+def test_copy_source_changed_on_the_server(make_engine, local, remote):
+    data = os.urandom(MIN_COPY_SIZE)
+    write(local, 'a.bin', data)
+    engine = make_engine()
+    assert engine.run()
+    write(remote, 'a.bin', 'changed on the server')
+    write(local, 'b.bin', data)
+    # push() does not list the server, only the COPY's precondition can
+    # tell the source changed.
+    assert engine.push(['b.bin'])
+    assert read(remote, 'b.bin') == data
+    assert engine.run()
+    assert tree(local) == tree(remote)
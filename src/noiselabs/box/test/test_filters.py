@@ -0,0 +1,121 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+
+"""
+Tests for the gitignore-style path filter.
+"""
+
+import pytest
+
+from noiselabs.box.sync.filters import PathFilter, translate
+from noiselabs.box.test.helpers import tree, write
+
+@pytest.mark.parametrize('pattern, path, is_dir, excluded', [
+    # Without a slash, a pattern matches a name at any depth.
+    ('*.tmp', 'a.tmp', False, True),
+    ('*.tmp', 'dir/sub/a.tmp', False, True),
+    ('*.tmp', 'a.tmpx', False, False),
+    ('cache', 'dir/cache', True, True),
+    ('cache', 'dir/cache', False, True),
+    # With a leading or inner slash, it is anchored to the root.
+    ('/build', 'build', True, True),
+    ('/build', 'src/build', True, False),
+    ('doc/*.html', 'doc/index.html', False, True),
+    ('doc/*.html', 'src/doc/index.html', False, False),
+    ('doc/*.html', 'doc/api/index.html', False, False),
+    # A trailing slash restricts it to directories.
+    ('logs/', 'logs', True, True),
+    ('logs/', 'logs', False, False),
+    ('logs/', 'var/logs', True, True),
+    # '**' spans any number of directories.
+    ('**/node_modules', 'a/b/node_modules', True, True),
+    ('**/node_modules', 'node_modules', True, True),
+    ('a/**/z', 'a/z', False, True),
+    ('a/**/z', 'a/b/c/z', False, True),
+    ('a/**', 'a/b/c', False, True),
+    ('?.txt', 'a.txt', False, True),
+    ('?.txt', 'ab.txt', False, False),
+    ('[ab].txt', 'b.txt', False, True),
+    ('[!ab].txt', 'b.txt', False, False),
+    ('\\#notes', '#notes', False, True),
+    ('\\*', '*', False, True),
+    ('\\*', 'x', False, False),
+])
+def test_pattern(pattern, path, is_dir, excluded):
+    assert PathFilter([pattern]).excluded(path, is_dir) is excluded
+
+def test_comments_and_blank_lines():
+    path_filter = PathFilter(['# *.tmp', '', '   '])
+    assert not path_filter
+    assert not path_filter.excluded('# *.tmp', False)
+
+def test_last_match_wins():
+    path_filter = PathFilter(['*.log', '!keep.log', 'dir/keep.log'])
+    assert path_filter.excluded('a.log', False)
+    assert not path_filter.excluded('keep.log', False)
+    assert not path_filter.excluded('other/keep.log', False)
+    assert path_filter.excluded('dir/keep.log', False)
+    assert PathFilter(['!*.log', '*.log']).excluded('a.log', False)
+
+def test_negation_across_kinds():
+    # The literal name, the anchored trie and the regexes must agree on
+    # which rule came last.
+    path_filter = PathFilter(['/a/b.txt', '!b.txt', 'a/*.txt', '!/a/b.txt'])
+    assert not path_filter.excluded('a/b.txt', False)
+    assert path_filter.excluded('a/c.txt', False)
+
+def test_excludes_checks_the_parents():
+    path_filter = PathFilter(['build/', '!build/keep'])
+    assert path_filter.excludes('src/build/out.o')
+    # Git cannot bring back a file from an excluded directory either.
+    assert path_filter.excludes('build/keep')
+    assert not path_filter.excluded('build/keep', False)
+    assert not path_filter.excludes('src/main.c')
+
+def test_many_patterns():
+    # More globs than Python 2's re takes groups in one pattern.
+    path_filter = PathFilter(['*.x%d' % i for i in range(250)] + ['!*.x7'])
+    assert path_filter.excluded('a.x0', False)
+    assert path_filter.excluded('d/a.x249', False)
+    assert not path_filter.excluded('a.x7', False)
+    assert not path_filter.excluded('a.x250', False)
+
+def test_prune_counts_per_rule():
+    path_filter = PathFilter(['*.tmp', 'cache/'])
+    for path, is_dir in [('a.tmp', False), ('b.tmp', False), ('cache', True), ('c', False)]:
+        path_filter.prune(path, is_dir)
+    assert path_filter.report() == "'*.tmp' 2, 'cache/' 1"
+    assert path_filter.report() is None
+
+def test_translate():
+    assert translate('*.py') == '[^/]*\\.py'
+    assert translate('**/x') == '(?:.*/)?x'
+
+def test_pushing_an_excluded_directory(make_engine, local, remote):
+    engine = make_engine()
+    engine.filter = PathFilter(['build/'])
+    write(local, 'build/out.o', 'object')
+    write(local, 'a.txt', 'source')
+    engine.push(['build', 'build/out.o', 'a.txt'])
+    assert tree(remote) == {'a.txt': 'source'}
+    assert not remote.join('build').check()
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Tests for content hashing and the hash cache.
+"""
+
+import hashlib
+import os
+
+import pytest
+
+from noiselabs.box.sync import hashing
+from noiselabs.box.sync.hashing import HashCache, Hasher, hash_file
+from noiselabs.box.test.helpers import RecordingConsole, write
+
+@pytest.mark.parametrize('size', [0, 1, 4095, 4096, 4097, 10000])
+def test_hash_file(tmpdir, size):
+    data = os.urandom(size)
+    write(tmpdir, 'f', data)
+    # Files of bufsize bytes or more are mapped, smaller ones read.
+    assert hash_file(str(tmpdir.join('f')), bufsize=4096) == (hashlib.sha1(data).hexdigest(), size)
+
+def test_read_buffer_is_reused(tmpdir):
+    write(tmpdir, 'a', 'small file')
+    write(tmpdir, 'b', 'another one')
+    hash_file(str(tmpdir.join('a')))
+    buf = hashing._local.buf
+    hash_file(str(tmpdir.join('b')))
+    assert hashing._local.buf is buf
+
+@pytest.fixture
+def hasher(tmpdir):
+    hasher = Hasher(RecordingConsole(), HashCache(str(tmpdir.join('hashes.db'))), processes=2)
+    yield hasher
+    hasher.close()
+    hasher.cache.close()
+
+def digests(root, names):
+    return dict((str(root.join(name)), hashlib.sha1(root.join(name).read('rb')).hexdigest())
+        for name in names)
+
+def test_cached_hashes_are_reused(tmpdir, hasher):
+    for name in 'abc':
+        write(tmpdir, name, name * 1000)
+    paths = [str(tmpdir.join(name)) for name in 'abc']
+    assert hasher.hash_files(paths + [str(tmpdir.join('missing'))]) == digests(tmpdir, 'abc')
+    assert (hasher.stats['hits'], hasher.stats['misses']) == (0, 3)
+    write(tmpdir, 'b', 'changed')
+    assert hasher.hash_files(paths) == digests(tmpdir, 'abc')
+    assert (hasher.stats['hits'], hasher.stats['misses']) == (2, 4)
+    # The cache outlives the hasher.
+    other = Hasher(RecordingConsole(), HashCache(str(tmpdir.join('hashes.db'))))
+    assert other.hash_files(paths) == digests(tmpdir, 'abc')
+    assert other.stats['misses'] == 0
+
+def test_pool(tmpdir, hasher):
+    hasher.inline_limit = 0
+    names = ['f%d' % i for i in range(20)]
+    for name in names:
+        write(tmpdir, name, os.urandom(5000))
+    assert hasher.hash_files([str(tmpdir.join(name)) for name in names]) == digests(tmpdir, names)
+    assert hasher._pool is not None
+    assert sum(size for size, seconds in hasher.workers.values()) == 20 * 5000
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Tests for the persistent sync index.
+"""
+
+from noiselabs.box.sync.index import IndexEntry, StateIndex
+
+def entry(path, is_dir=False, digest=None):
+    return IndexEntry(path, is_dir, 10, 1234.5, 42, '"etag"', digest, 1)
+
+def index_of(*paths):
+    index = StateIndex(':memory:')
+    index.update([entry(path, path.endswith('dir')) for path in paths])
+    index.commit()
+    return index
+
+def test_persistence(tmpdir):
+    index = StateIndex(str(tmpdir.join('index.db')))
+    assert index.bind('/box', 'http://dav/')
+    generation = index.begin_generation()
+    index.update([entry('a', digest='h')])
+    index.commit()
+    index.close()
+    index = StateIndex(str(tmpdir.join('index.db')))
+    assert index.generation == generation
+    assert index.load() == {'a': entry('a', digest='h')}
+    assert list(index.with_hash('h')) == [entry('a', digest='h')]
+
+def test_bind_to_another_folder_clears():
+    index = index_of('a')
+    assert index.bind('/box', 'http://dav/')
+    assert index.bind('/box', 'http://dav/')
+    assert index.count() == 1
+    assert not index.bind('/other', 'http://dav/')
+    assert index.count() == 0
+
+def test_children_and_subtree():
+    index = index_of('dir', 'dir/a', 'dir/sub', 'dir/sub/b', 'dir0', 'dir-x/c', 'top')
+    assert sorted(path for path, e in index.children('dir')) == ['dir/a', 'dir/sub']
+    assert sorted(path for path, e in index.children('')) == ['dir', 'dir0', 'top']
+    assert sorted(e.path for e in index.subtree('dir')) == ['dir/a', 'dir/sub', 'dir/sub/b']
+
+def test_remove_takes_the_subtree():
+    index = index_of('dir', 'dir/a', 'dir/sub/b', 'dir0', 'dir-x/c')
+    index.remove(['dir'])
+    assert sorted(index.load()) == ['dir-x/c', 'dir0']
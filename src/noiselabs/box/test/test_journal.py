@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Tests for the sync journal and its recovery.
+"""
+
+from noiselabs.box.sync.index import IndexEntry
+from noiselabs.box.sync.journal import Journal
+
+def entry(path):
+    return IndexEntry(path, False, 10, 1234.5, 42, '"etag"', 'hash', 3)
+
+def test_recover(tmpdir):
+    journal = Journal(str(tmpdir.join('journal.log')))
+    journal.planned(3, 'put', 'a')
+    journal.planned(3, 'get', 'b')
+    journal.planned(3, 'delete', 'c')
+    journal.done(3, 'a', entry('a'))
+    journal.done(3, 'c')
+    journal.close()
+    done, pending = Journal(str(tmpdir.join('journal.log'))).recover()
+    assert done == [('a', entry('a')), ('c', None)]
+    assert pending == [('get', 'b')]
+    assert isinstance(done[0][0], str) and isinstance(done[0][1].etag, str)
+
+def test_torn_write(tmpdir):
+    journal = Journal(str(tmpdir.join('journal.log')))
+    journal.planned(1, 'put', 'a')
+    journal.done(1, 'a', entry('a'))
+    journal.close()
+    with open(str(tmpdir.join('journal.log')), 'ab') as f:
+        f.write('["done",1,"b",[')
+    done, pending = Journal(str(tmpdir.join('journal.log'))).recover()
+    assert done == [('a', entry('a'))]
+    assert pending == []
+
+def test_checkpoint(tmpdir):
+    journal = Journal(str(tmpdir.join('journal.log')))
+    journal.planned(1, 'put', 'a')
+    journal.checkpoint()
+    journal.planned(2, 'put', 'b')
+    journal.close()
+    assert Journal(str(tmpdir.join('journal.log'))).recover() == ([], [('put', 'b')])
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Tests for the remote tree walker.
+"""
+
+from noiselabs.box.sync.filters import PathFilter
+from noiselabs.box.sync.listing import RemoteWalker
+from noiselabs.box.sync.webdav import WebDAVError
+from noiselabs.box.test.helpers import requests, write
+
+class FailingClient(object):
+    """Fails to list the given directories."""
+    def __init__(self, client, broken):
+        self.client = client
+        self.broken = broken
+
+    def iter_propfind(self, path, depth):
+        if path in self.broken:
+            raise WebDAVError('PROPFIND', path, 500, "injected failure")
+        return self.client.iter_propfind(path, depth)
+
+def make_tree(remote):
+    for i in range(3):
+        for j in range(3):
+            write(remote, 'd%d/e%d/f.txt' % (i, j), 'x')
+        write(remote, 'd%d/g.txt' % i, 'y')
+
+def test_walk(remote, client):
+    make_tree(remote)
+    # A queue of one entry makes every lister wait for the consumer.
+    walker = RemoteWalker(client, max_inflight=4, queue_size=1)
+    paths = sorted(entry.path for entry in walker.walk())
+    assert len(paths) == len(set(paths)) == 3 + 9 + 9 + 3
+    assert 'd2/e1/f.txt' in paths
+    assert walker.errors == []
+    assert walker.entries == len(paths)
+
+def test_errors_are_collected(remote, client):
+    make_tree(remote)
+    walker = RemoteWalker(FailingClient(client, ['d1', 'd2/e0']))
+    paths = set(entry.path for entry in walker.walk())
+    assert sorted(path for path, error in walker.errors) == ['d1', 'd2/e0']
+    assert all(isinstance(error, WebDAVError) for path, error in walker.errors)
+    # Everything else is still listed.
+    assert 'd1' in paths and 'd1/g.txt' not in paths
+    assert 'd2/e1/f.txt' in paths and 'd2/e0/f.txt' not in paths
+
+def test_pruned_directories_are_not_listed(remote, server, client):
+    make_tree(remote)
+    requests(server)
+    path_filter = PathFilter(['e1/', '/d2'])
+    paths = set(entry.path for entry in RemoteWalker(client).walk(filter=path_filter))
+    assert not [path for path in paths if 'e1' in path or path.startswith('d2')]
+    # The root, d0, d1 and their e0 and e2.
+    assert requests(server)['PROPFIND'] == 7
+    assert path_filter.report() == "'e1/' 2, '/d2' 1"
+
+def test_abandoned_walk(remote, client):
+    make_tree(remote)
+    walker = RemoteWalker(client, queue_size=1)
+    for entry in walker.walk():
+        break
+    assert walker.entries == 1
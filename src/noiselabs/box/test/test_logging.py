@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Tests for the queue-based logging.
+"""
+
+import logging
+import Queue
+import threading
+
+from noiselabs.box.logfile import RotatingFileHandler
+from noiselabs.box.loghandlers import BatchFlushMixin, QueueHandler, QueueListener
+
+class RecordingHandler(BatchFlushMixin, logging.Handler):
+    """Keeps the messages, and counts the flushes of batches."""
+    def __init__(self, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+        self.messages = []
+        self.batches = 0
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+    def flush_batch(self):
+        self.batches += 1
+
+def make_logger(name, queue):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    logger.handlers = [QueueHandler(queue)]
+    return logger
+
+def test_records_reach_the_handlers_by_level():
+    queue = Queue.Queue()
+    everything, errors = RecordingHandler(), RecordingHandler(logging.ERROR)
+    listener = QueueListener(queue, everything, errors)
+    listener.start()
+    logger = make_logger('test-levels', queue)
+    logger.debug('one %d', 1)
+    logger.error('two')
+    listener.flush()
+    assert everything.messages == ['one 1', 'two']
+    assert errors.messages == ['two']
+    listener.stop()
+
+def test_messages_are_formatted_when_logged():
+    queue = Queue.Queue()
+    handler = RecordingHandler()
+    listener = QueueListener(queue, handler)
+    logger = make_logger('test-format', queue)
+    args = ['before']
+    logger.info('%s', args)
+    args[0] = 'after'
+    listener.start()
+    listener.stop()
+    assert handler.messages == ["['before']"]
+
+def test_piled_up_records_are_flushed_once():
+    queue = Queue.Queue()
+    handler = RecordingHandler()
+    listener = QueueListener(queue, handler)
+    logger = make_logger('test-batch', queue)
+    for i in range(100):
+        logger.info('record %d', i)
+    listener.start()
+    listener.stop()
+    assert len(handler.messages) == 100
+    # One more batch if the thread got to the queue before stop() did.
+    assert handler.batches <= 2
+    # A batched handler is not flushed record by record.
+    assert handler.batched
+
+def test_logging_from_threads_to_a_rotating_file(tmpdir):
+    queue = Queue.Queue()
+    path = str(tmpdir.join('box-sync.log'))
+    handler = RotatingFileHandler(path, maxBytes=4000, backupCount=10)
+    listener = QueueListener(queue, handler)
+    listener.start()
+    logger = make_logger('test-file', queue)
+
+    def work(n):
+        for i in range(200):
+            logger.info('thread %d record %03d', n, i)
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    listener.stop()
+    handler.close()
+    files = tmpdir.listdir()
+    assert len(files) > 2
+    assert all(f.size() <= 4000 for f in files)
+    lines = [line for f in files for line in f.read().splitlines()]
+    assert sorted(lines) == sorted('thread %d record %03d' % (n, i)
+        for n in range(4) for i in range(200))
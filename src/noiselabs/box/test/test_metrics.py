@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Tests for the timing and counter collection.
+"""
+
+import json
+import threading
+
+from noiselabs.box.metrics import NULL_METRICS, Histogram, Metrics
+from noiselabs.box.output import BoxConsole
+
+class Options(object):
+    def __init__(self, verbose=False, metrics_json=None):
+        self.verbose = verbose
+        self.metrics_json = metrics_json
+        self.log = False
+
+def test_histogram():
+    h = Histogram()
+    assert h.percentile(50) is None
+    for value in [0.001] * 90 + [0.1] * 9 + [2.0]:
+        h.add(value)
+    assert (h.count, h.min, h.max) == (100, 0.001, 2.0)
+    assert abs(h.total - 2.99) < 1e-9
+    # Bucket upper bounds, within a fifth of the real values.
+    assert 0.001 <= h.percentile(50) < 0.0012
+    assert 0.1 <= h.percentile(99) < 0.12
+    assert h.percentile(100) == 2.0
+    assert sum(h.as_dict()['buckets'].values()) == 100
+
+def test_histogram_of_zeros():
+    h = Histogram()
+    h.add(0)
+    h.add(0)
+    h.add(1.0)
+    assert h.percentile(50) == 0.0
+    assert h.percentile(100) == 1.0
+
+def test_metrics_from_many_threads():
+    metrics = Metrics()
+
+    def work():
+        for i in range(1000):
+            metrics.count('requests')
+            metrics.observe('latency', 0.01)
+    threads = [threading.Thread(target=work) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    data = metrics.as_dict()
+    assert data['counters'] == {'requests': 8000}
+    assert data['histograms']['latency']['count'] == 8000
+
+def test_span():
+    metrics = Metrics()
+    with metrics.span('block'):
+        pass
+    try:
+        with metrics.span('block'):
+            raise ValueError
+    except ValueError:
+        pass
+    assert metrics.histograms['block'].count == 2
+
+def test_table_and_dump(tmpdir):
+    metrics = Metrics()
+    metrics.observe('http.GET', 0.02)
+    metrics.count('bytes', 1234)
+    lines = metrics.table().splitlines()
+    assert lines[0].split() == ['timing', 'count', 'total', 'mean', 'p50', 'p99', 'max']
+    assert lines[1].split()[:2] == ['http.GET', '1']
+    assert lines[3].split() == ['bytes', '1234']
+    metrics.dump(str(tmpdir.join('metrics.json')))
+    assert json.loads(tmpdir.join('metrics.json').read())['counters'] == {'bytes': 1234}
+
+def test_console_collects_only_when_asked(tmpdir):
+    quiet = BoxConsole(Options(), 'test-quiet')
+    verbose = BoxConsole(Options(metrics_json=str(tmpdir.join('m.json'))), 'test-json')
+    try:
+        assert quiet.metrics is NULL_METRICS
+        with quiet.span('nothing'):
+            quiet.count('nothing')
+        verbose.count('files', 3)
+        with verbose.span('sync'):
+            pass
+        verbose.report_metrics()
+    finally:
+        quiet.close()
+        verbose.close()
+    data = json.loads(tmpdir.join('m.json').read())
+    assert data['counters'] == {'files': 3}
+    assert list(data['histograms']) == ['sync']
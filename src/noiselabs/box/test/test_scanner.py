@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Tests for the threaded scanner of box_dir.
+"""
+
+import errno
+import os
+
+import pytest
+
+from noiselabs.box.sync import scanner
+from noiselabs.box.sync.filters import PathFilter
+from noiselabs.box.sync.scanner import LocalScanner
+from noiselabs.box.sync.transfer import PART_SUFFIX
+from noiselabs.box.test.helpers import write
+
+@pytest.mark.parametrize('threads', [1, 8])
+def test_entries_are_sorted(local, threads):
+    paths = ['b/%d/f%d.txt' % (i, j) for i in range(10) for j in range(3)] + ['a.txt', 'c/d.txt']
+    for path in paths:
+        write(local, path, path)
+    os.mkdir(str(local.join('empty')))
+    entries = LocalScanner(str(local), threads).scan()
+    dirs = ['b', 'c', 'empty'] + ['b/%d' % i for i in range(10)]
+    assert [e.path for e in entries] == sorted(paths + dirs)
+    assert [e.path for e in entries if e.is_dir] == sorted(dirs)
+    a = entries[0]
+    st = os.stat(str(local.join('a.txt')))
+    assert (a.size, a.mtime, a.inode) == (st.st_size, st.st_mtime, st.st_ino)
+
+def test_excluded_directories_are_not_read(local, monkeypatch):
+    write(local, 'src/main.c', 'code')
+    write(local, 'build/deep/out.o', 'object')
+    write(local, 'src/main.o', 'object')
+    write(local, 'a.txt' + PART_SUFFIX, 'download in progress')
+    read = []
+    read_dir = scanner.read_dir
+
+    def recording_read_dir(path):
+        read.append(os.path.relpath(path, str(local)))
+        return read_dir(path)
+    monkeypatch.setattr(scanner, 'read_dir', recording_read_dir)
+    path_filter = PathFilter(['build/', '*.o'])
+    entries = LocalScanner(str(local), 4, path_filter).scan()
+    assert [e.path for e in entries] == ['src', 'src/main.c']
+    assert sorted(read) == ['.', 'src']
+    assert path_filter.report() == "'build/' 1, '*.o' 1"
+
+def test_links_to_directories_are_not_followed(local, tmpdir):
+    write(tmpdir, 'elsewhere/a.txt', 'a')
+    os.symlink(str(tmpdir.join('elsewhere')), str(local.join('link')))
+    entries = LocalScanner(str(local)).scan()
+    assert [(e.path, e.is_dir) for e in entries] == [('link', True)]
+
+def test_errors_are_collected(local, monkeypatch):
+    write(local, 'ok/a.txt', 'a')
+    write(local, 'locked/b.txt', 'b')
+    read_dir = scanner.read_dir
+
+    def failing_read_dir(path):
+        if path == str(local.join('locked')):
+            raise OSError(errno.EACCES, "Permission denied", path)
+        return read_dir(path)
+    monkeypatch.setattr(scanner, 'read_dir', failing_read_dir)
+    scan = LocalScanner(str(local), 2)
+    assert [e.path for e in scan.scan()] == ['locked', 'ok', 'ok/a.txt']
+    assert [(path, e.errno) for path, e in scan.errors] == [('locked', errno.EACCES)]
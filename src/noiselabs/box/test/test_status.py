@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Tests for the davfs2 mount probe and its Prometheus export.
+"""
+
+import os
+import threading
+import time
+
+import pytest
+
+from collections import OrderedDict
+
+from noiselabs.box.status import MountProbe, render_textfile, write_textfile
+from noiselabs.box.test.helpers import write
+
+@pytest.fixture
+def mounted(monkeypatch, local):
+    """Make local look like a mount point."""
+    ismount = os.path.ismount
+    monkeypatch.setattr(os.path, 'ismount', lambda path: path == str(local) or ismount(path))
+
+def test_not_mounted(local, tmpdir):
+    metrics = MountProbe(str(local), str(tmpdir.join('cache'))).sample()
+    assert (metrics['mounted'], metrics['up']) == (0, 0)
+    assert 'not mounted' in metrics['error']
+    assert 'cache_bytes' not in metrics
+    assert metrics['cache_limit_bytes'] == 50 * 1024 * 1024
+
+def test_sample(mounted, local, tmpdir):
+    write(local, 'a-dir/big', 'x')
+    write(local, 'b.txt', 'sample me')
+    write(tmpdir, 'cache/0/file', 'x' * 1000)
+    write(tmpdir, 'davfs2.conf', 'cache_size 100\n')
+    probe = MountProbe(str(local), str(tmpdir.join('cache')), str(tmpdir.join('davfs2.conf')))
+    metrics = probe.sample()
+    assert (metrics['mounted'], metrics['up']) == (1, 1)
+    assert metrics['entries'] == 2
+    assert metrics['read_bytes'] == len('sample me')
+    assert probe.sample_file == str(local.join('b.txt'))
+    assert metrics['cache_bytes'] == 1000
+    assert metrics['cache_limit_bytes'] == 100 * 1024 * 1024
+
+def test_no_sample_file_is_remembered(mounted, monkeypatch, local, tmpdir):
+    for i in range(3):
+        local.mkdir('d%d' % i)
+    probe = MountProbe(str(local), str(tmpdir.join('cache')))
+    checked = []
+    isfile = os.path.isfile
+    monkeypatch.setattr(os.path, 'isfile', lambda path: checked.append(path) or isfile(path))
+    assert 'read_seconds' not in probe.sample()
+    assert len(checked) == 3
+    assert probe.sample()['up'] == 1
+    assert len(checked) == 3
+    write(local, 'e.txt', 'new')
+    assert probe.sample()['read_bytes'] == 3
+
+def test_hung_mount(monkeypatch, local, tmpdir):
+    # Even telling whether box_dir is a mount point may hang.
+    hung = threading.Event()
+    ismount = os.path.ismount
+    monkeypatch.setattr(os.path, 'ismount',
+        lambda path: hung.wait(10) if path == str(local) else ismount(path))
+    probe = MountProbe(str(local), str(tmpdir.join('cache')), timeout=0.2)
+    try:
+        started = time.time()
+        metrics = probe.sample()
+        assert time.time() - started < 2
+        assert metrics['up'] == 0 and 'mounted' not in metrics
+        assert 'did not answer' in metrics['error']
+        assert 'still blocked' in probe.sample()['error']
+    finally:
+        hung.set()
+
+def test_render_textfile(tmpdir):
+    metrics = OrderedDict([('timestamp', 1500000000.5), ('up', 1), ('mounted', 1),
+        ('stat_seconds', 0.25), ('entries', 3)])
+    text = render_textfile(metrics, '/home/me/"Box"')
+    lines = text.splitlines()
+    label = 'box_dir="/home/me/\\"Box\\""'
+    assert 'box_sync_mount_up{%s} 1.0' % label in lines
+    assert 'box_sync_mount_probe_seconds{op="stat",%s} 0.25' % label in lines
+    assert 'box_sync_mount_probe_timestamp_seconds{%s} 1500000000.5' % label in lines
+    # Every family is described once, missing values are left out.
+    assert lines.count('# TYPE box_sync_mount_probe_seconds gauge') == 1
+    assert not [line for line in lines if line.startswith('box_sync_davfs_cache_bytes')]
+    write_textfile(str(tmpdir.join('box.prom')), text)
+    assert tmpdir.join('box.prom').read() == text
+    assert os.listdir(str(tmpdir)) == ['box.prom']
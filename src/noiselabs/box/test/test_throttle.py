@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Tests for the bandwidth token buckets.
+"""
+
+import io
+import threading
+import time
+
+from noiselabs.box.sync.throttle import ThrottledFile, TokenBucket
+
+def timed(function, *args):
+    start = time.time()
+    function(*args)
+    return time.time() - start
+
+def test_unlimited():
+    assert timed(TokenBucket().consume, 10 ** 9) < 0.05
+
+def test_burst_is_free():
+    bucket = TokenBucket(100000, 20000)
+    assert timed(bucket.consume, 20000) < 0.05
+    # The bucket is empty now: the next 10000 bytes take 0.1s.
+    assert 0.08 < timed(bucket.consume, 10000) < 0.3
+
+def test_rate_is_shared_between_threads():
+    bucket = TokenBucket(200000, 1)
+
+    def transfer():
+        for i in range(10):
+            bucket.consume(5000)
+    threads = [threading.Thread(target=transfer) for i in range(4)]
+
+    def run():
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    # 200000 bytes at 200000 bytes per second, however many threads.
+    assert 0.9 < timed(run) < 1.5
+
+def test_set_rate():
+    bucket = TokenBucket(1000, 1)
+    bucket.set_rate(0)
+    assert timed(bucket.consume, 10 ** 6) < 0.05
+
+def test_set_rate_keeps_the_tokens():
+    bucket = TokenBucket(100000, 10000)
+    bucket.consume(10000)
+    # Reloading the same limits must not hand out another burst.
+    bucket.set_rate(100000, 10000)
+    assert 0.08 < timed(bucket.consume, 10000) < 0.3
+    # A smaller burst caps what was saved up.
+    time.sleep(0.1)
+    bucket.set_rate(100000, 1000)
+    assert bucket.tokens <= 1000
+
+def test_throttled_file():
+    bucket = TokenBucket(100000, 1)
+    f = ThrottledFile(io.BytesIO(b'x' * 20000), bucket)
+    buf = bytearray(10000)
+    assert 0.08 < timed(f.readinto, buf) < 0.3
+    assert buf == b'x' * 10000
+    f.seek(15000)
+    assert f.read() == b'x' * 5000
+    assert f.read() == b''
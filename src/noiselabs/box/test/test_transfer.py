@@ -0,0 +1,139 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Tests for downloads and uploads against the stand-in WebDAV server.
+"""
+
+import os
+
+import pytest
+
+from noiselabs.box.sync.compression import Compression
+from noiselabs.box.sync.davserver import DAVServer
+from noiselabs.box.sync.transfer import CHUNKS_SUFFIX, Downloader
+from noiselabs.box.sync.webdav import NotModified, WebDAVClient, WebDAVError, conditional_headers
+from noiselabs.box.test.helpers import read, requests, write
+
+CHUNK = 64 * 1024
+
+class FailingDownloader(Downloader):
+    """Fails the request for one chunk."""
+    def __init__(self, client, fail_at):
+        Downloader.__init__(self, client, chunk_size=CHUNK)
+        self.fail_at = fail_at
+
+    def _request_range(self, path, start, end, etag, conditions=None):
+        if start == self.fail_at:
+            raise WebDAVError('GET', path, 500, "injected failure")
+        return Downloader._request_range(self, path, start, end, etag, conditions)
+
+def entry(client, path):
+    return client.propfind(path, depth=0)[0]
+
+def test_ranged_download(remote, local, server, client):
+    data = os.urandom(5 * CHUNK + 123)
+    write(remote, 'big.bin', data)
+    listed = entry(client, 'big.bin')
+    requests(server)
+    etag = Downloader(client, chunk_size=CHUNK).download('big.bin', str(local.join('big.bin')),
+        listed.size, listed.mtime, listed.etag)
+    assert etag == listed.etag
+    assert read(local, 'big.bin') == data
+    assert requests(server) == {'GET': 6}
+    assert os.listdir(str(local)) == ['big.bin']
+
+def test_interrupted_download_resumes(remote, local, server, client):
+    data = os.urandom(6 * CHUNK)
+    write(remote, 'big.bin', data)
+    listed = entry(client, 'big.bin')
+    target = str(local.join('big.bin'))
+    with pytest.raises(WebDAVError):
+        FailingDownloader(client, 3 * CHUNK).download('big.bin', target, listed.size,
+            listed.mtime, listed.etag)
+    assert os.path.exists(target + CHUNKS_SUFFIX)
+    requests(server)
+    Downloader(client, chunk_size=CHUNK).download('big.bin', target, listed.size, listed.mtime,
+        listed.etag)
+    assert read(local, 'big.bin') == data
+    # Only the chunks that had not arrived are fetched again.
+    assert requests(server)['GET'] < 6
+    assert os.listdir(str(local)) == ['big.bin']
+
+def test_resume_after_a_remote_change(remote, local, client):
+    write(remote, 'big.bin', os.urandom(6 * CHUNK))
+    listed = entry(client, 'big.bin')
+    target = str(local.join('big.bin'))
+    with pytest.raises(WebDAVError):
+        FailingDownloader(client, 3 * CHUNK).download('big.bin', target, listed.size,
+            listed.mtime, listed.etag)
+    data = os.urandom(6 * CHUNK)
+    write(remote, 'big.bin', data)
+    listed = entry(client, 'big.bin')
+    Downloader(client, chunk_size=CHUNK).download('big.bin', target, listed.size, listed.mtime,
+        listed.etag)
+    assert read(local, 'big.bin') == data
+
+def test_server_without_ranges(tmpdir, remote, local):
+    data = os.urandom(3 * CHUNK)
+    write(remote, 'big.bin', data)
+    server = DAVServer(str(remote), ranges=False).start()
+    client = WebDAVClient(server.url)
+    try:
+        listed = entry(client, 'big.bin')
+        Downloader(client, chunk_size=CHUNK).download('big.bin', str(local.join('big.bin')),
+            listed.size, listed.mtime, listed.etag)
+        assert requests(server)['GET'] == 1
+    finally:
+        client.close()
+        server.stop()
+    assert read(local, 'big.bin') == data
+    assert os.listdir(str(local)) == ['big.bin']
+
+@pytest.mark.parametrize('size', [1000, 5 * CHUNK])
+def test_conditional_download(remote, local, client, size):
+    write(remote, 'a.bin', os.urandom(size))
+    listed = entry(client, 'a.bin')
+    write(local, 'a.bin', 'local copy')
+    with pytest.raises(NotModified):
+        Downloader(client, chunk_size=CHUNK).download('a.bin', str(local.join('a.bin')),
+            listed.size, listed.mtime, listed.etag, conditional_headers(listed.etag, listed.mtime))
+    assert read(local, 'a.bin') == 'local copy'
+    assert os.listdir(str(local)) == ['a.bin']
+
+def test_gzip(remote, local, server):
+    client = WebDAVClient(server.url, compression=Compression(['.txt']))
+    try:
+        data = 'compressible line\n' * 20000
+        write(local, 'up.txt', data)
+        server.reset_traffic()
+        client.put(str(local.join('up.txt')), 'up.txt')
+        assert server.reset_traffic()['received'] < len(data) / 10
+        assert read(remote, 'up.txt') == data
+        listed = entry(client, 'up.txt')
+        Downloader(client).download('up.txt', str(local.join('down.txt')), listed.size,
+            listed.mtime, listed.etag)
+        assert client.gzip_downloads
+        assert server.reset_traffic()['sent'] < len(data) / 10
+        assert read(local, 'down.txt') == data
+    finally:
+        client.close()
@@ -0,0 +1,127 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is part of box-linux-sync.
+#
+# Copyright (C) 2013 Vítor Brandão <noisebleed@noiselabs.org>
+#
+# box-linux-sync is free software; you can redistribute it  and/or modify it
+# under the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# box-linux-sync is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with box-linux-sync; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Tests for the inotify watcher.
+"""
+
+import os
+
+import pytest
+
+from noiselabs.box.sync.filters import PathFilter
+from noiselabs.box.sync.transfer import PART_SUFFIX
+from noiselabs.box.sync.watcher import IN_Q_OVERFLOW, Watcher
+from noiselabs.box.test.helpers import RecordingConsole, write
+
+class FakeIndex(object):
+    def __init__(self, paths=()):
+        self.paths = paths
+
+    def children(self, path):
+        prefix = path + '/' if path else ''
+        return [(p, None) for p in self.paths
+            if p.startswith(prefix) and '/' not in p[len(prefix):]]
+
+class FakeEngine(object):
+    """Records what the watcher pushes."""
+    def __init__(self, box_dir, indexed=(), patterns=()):
+        self.box_dir = box_dir
+        self.filter = PathFilter(patterns)
+        self.index = FakeIndex(indexed)
+        self.pushed = []
+
+    def local_path(self, path):
+        return os.path.join(self.box_dir, *path.split('/'))
+
+    def push(self, paths):
+        self.pushed.append(sorted(paths))
+
+@pytest.fixture
+def make_watcher(local):
+    watchers = []
+
+    def make_watcher(**kwargs):
+        watcher = Watcher(RecordingConsole(), FakeEngine(str(local), **kwargs), delay=0.2,
+            interval=0)
+        watcher.watch_tree(str(local))
+        watchers.append(watcher)
+        return watcher
+
+    yield make_watcher
+    for watcher in watchers:
+        watcher.inotify.close()
+
+def drain(watcher):
+    """Handle every event queued so far."""
+    while True:
+        events = watcher.inotify.read(0.05)
+        if not events:
+            return
+        watcher.handle(events)
+
+def test_bursts_are_coalesced(make_watcher, local):
+    watcher = make_watcher()
+    for i in range(20):
+        write(local, 'a.txt', 'version %d' % i)
+    write(local, 'b.txt' + PART_SUFFIX, 'download in progress')
+    drain(watcher)
+    assert sorted(watcher.pending) == ['a.txt']
+    # Nothing is pushed until the file has been quiet for the delay.
+    watcher.flush()
+    assert watcher.engine.pushed == []
+    watcher.pending['a.txt'] -= 1
+    watcher.flush()
+    assert watcher.engine.pushed == [['a.txt']]
+    assert watcher.pending == {}
+
+def test_new_directories_are_watched(make_watcher, local, tmpdir):
+    watcher = make_watcher()
+    write(tmpdir, 'outside/sub/a.txt', 'made before the watch')
+    os.rename(str(tmpdir.join('outside')), str(local.join('moved')))
+    drain(watcher)
+    write(local, 'moved/sub/b.txt', 'made after the watch')
+    drain(watcher)
+    watcher.flush(force=True)
+    assert watcher.engine.pushed == [['moved', 'moved/sub', 'moved/sub/a.txt', 'moved/sub/b.txt']]
+
+def test_overflow_rescans_modified_directories(make_watcher, local):
+    write(local, 'quiet/a.txt', 'a')
+    write(local, 'busy/gone.txt', 'b')
+    watcher = make_watcher(indexed=['quiet/a.txt', 'busy/gone.txt'])
+    # Changes whose events were lost.
+    os.remove(str(local.join('busy/gone.txt')))
+    write(local, 'busy/new.txt', 'c')
+    write(local, 'busy/newdir/d.txt', 'd')
+    watcher.handle([(-1, IN_Q_OVERFLOW, 0, '')])
+    assert sorted(watcher.pending) == ['busy', 'busy/gone.txt', 'busy/new.txt', 'busy/newdir',
+        'busy/newdir/d.txt']
+    assert str(local.join('busy/newdir')) in watcher.dirs
+    assert watcher.out.messages['warning']
+
+def test_excluded_directories_are_not_marked(make_watcher, local):
+    watcher = make_watcher(patterns=['build/'])
+    write(local, 'build/out.o', 'object')
+    write(local, 'notes/build', 'a file, not a directory')
+    drain(watcher)
+    assert sorted(watcher.pending) == ['notes', 'notes/build']
+    assert str(local.join('build')) not in watcher.dirs